@@ -1,5 +1,12 @@
-from .cmd_wrapper import TCCmdWrapper, DockerCmdWrapper
-from .container_net_ctrl import ConNetController, ConNetServer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cmd_wrapper import TCCmdWrapper, DockerCmdWrapper
+    from .container_net_ctrl import (
+        ConNetController,
+        AsyncConNetController,
+        ConNetServer,
+    )
 
 __version__ = "0.0.5"
 
@@ -7,5 +14,25 @@ __all__ = [
     "TCCmdWrapper",
     "DockerCmdWrapper",
     "ConNetController",
+    "AsyncConNetController",
     "ConNetServer",
 ]
+
+# submodules are imported on first access, so `import contcfg`
+# (e.g. for the CLI) stays cheap
+_LAZY_IMPORTS = {
+    "TCCmdWrapper": ".cmd_wrapper",
+    "DockerCmdWrapper": ".cmd_wrapper",
+    "ConNetController": ".container_net_ctrl",
+    "AsyncConNetController": ".container_net_ctrl",
+    "ConNetServer": ".container_net_ctrl",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_IMPORTS:
+        import importlib
+
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
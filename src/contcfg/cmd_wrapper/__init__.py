@@ -1,11 +1,38 @@
-from .tccmd_wrapper import TCCmdWrapper, DockerCmdWrapper
-from .exception import RateValueError, ContainerNotFoundError
+from .tccmd_wrapper import TCCmdWrapper
+from .dockercmd_wrapper import DockerCmdWrapper, PodmanCmdWrapper
+from .netns_wrapper import NetnsCmdWrapper
+from .runtime import ContainerRuntime, RUNTIMES, set_runtime, get_runtime
+from .host_tccmd_wrapper import HostTCCmdWrapper
+from .exception import (
+    RateValueError,
+    ContainerNotFoundError,
+    CommandTimeoutError,
+    HelperError,
+)
+from .base import set_cmd_timeout, set_priv_helper
+from .priv_helper import PrivHelper, HelperClient
 from .tc_base import split_raw_str_rate
+from .tc_batch import HTBProfile, set_htb_profile
 
 __all__ = [
     "TCCmdWrapper",
     "DockerCmdWrapper",
+    "PodmanCmdWrapper",
+    "NetnsCmdWrapper",
+    "ContainerRuntime",
+    "RUNTIMES",
+    "set_runtime",
+    "get_runtime",
+    "HostTCCmdWrapper",
     "RateValueError",
     "ContainerNotFoundError",
+    "CommandTimeoutError",
+    "HelperError",
+    "set_cmd_timeout",
+    "set_priv_helper",
+    "PrivHelper",
+    "HelperClient",
     "split_raw_str_rate",
+    "HTBProfile",
+    "set_htb_profile",
 ]
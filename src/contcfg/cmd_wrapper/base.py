@@ -1,7 +1,15 @@
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Union
+import os
+import shlex
+import signal
 import subprocess
 
+from .exception import CommandTimeoutError
+
+if TYPE_CHECKING:
+    from .priv_helper import HelperClient, HelperProcess
+
 
 def get_script(script_name: str) -> Path:
     scripts_path = Path(__file__).resolve().parent.parent / "utils" / "scripts"
@@ -39,11 +47,64 @@ def singleton(cls):
     return get_instance
 
 
+# default timeout in seconds of the commands run by `exec_cmd`,
+# None waits forever. See `set_cmd_timeout`.
+_cmd_timeout: Optional[float] = None
+
+
+def set_cmd_timeout(timeout: Optional[float]):
+    """Set the default timeout of all external commands.
+    Args:
+        - timeout (float) : timeout in seconds, None to wait forever.
+    """
+    global _cmd_timeout
+    _cmd_timeout = timeout
+
+
+def get_cmd_timeout() -> Optional[float]:
+    """Get the default timeout set by `set_cmd_timeout`."""
+    return _cmd_timeout
+
+
+# client of the privileged helper running all the commands, None runs
+# them directly. See `set_priv_helper`.
+_priv_helper: Optional["HelperClient"] = None
+
+
+def set_priv_helper(path: Optional[str]):
+    """Run all external commands through the privileged helper listening
+    on path, instead of with sudo.
+    Args:
+        - path (str) : socket of the helper, None to run the commands
+        directly again.
+
+    Raises:
+        - OSError if no helper listens on path
+    """
+    global _priv_helper
+    if _priv_helper is not None:
+        _priv_helper.close()
+        _priv_helper = None
+    if path is not None:
+        from .priv_helper import HelperClient
+
+        client = HelperClient(path)
+        client.connect()
+        _priv_helper = client
+
+
+def get_priv_helper() -> Optional["HelperClient"]:
+    """Get the client of the helper set by `set_priv_helper`."""
+    return _priv_helper
+
+
 def exec_cmd(
     cmd: str,
     run_with_sudo: Optional[bool] = None,
     bash: bool = True,
     stdout=False,
+    input: Optional[str] = None,
+    timeout: Optional[float] = None,
 ) -> subprocess.CompletedProcess:
     """Execute a command.
 
@@ -53,19 +114,68 @@ def exec_cmd(
         Defaults to None.
         - bash (bool, optional): run command with bash.
         Defaults to True.
+        - input (str, optional): data written to the command's stdin.
+        Defaults to None.
+        - timeout (float, optional): timeout in seconds.
+        Defaults to the timeout set by `set_cmd_timeout`.
+
+    Raises:
+        - subprocess.CalledProcessError if the command failed
+        - CommandTimeoutError if the command timed out. The command
+        and all its children are killed.
+        - HelperError if the privileged helper refused the command
     """
 
     if bash and not cmd.strip().startswith("bash"):
         cmd = f"bash {cmd}"
+    if timeout is None:
+        timeout = _cmd_timeout
+    if _priv_helper is not None:
+        # run as root by the helper, without a shell
+        result = _priv_helper.run(shlex.split(cmd), input, timeout)
+        out = result.stdout if stdout else None
+        if result.returncode:
+            raise subprocess.CalledProcessError(
+                result.returncode, cmd, out, result.stderr
+            )
+        return subprocess.CompletedProcess(cmd, 0, out)
     if run_with_sudo:
         cmd = f"sudo {cmd}"
     if stdout:
         output = subprocess.PIPE
     else:
         output = subprocess.DEVNULL
-    return subprocess.run(
+    # run in a new session, so a timed out `docker exec` started by a
+    # script can be killed together with the shell. Without input, stdin
+    # is not inherited: `docker exec -i` would read the server's stdin.
+    with subprocess.Popen(
         cmd,
         shell=True,
-        check=True,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
         stdout=output,
-    )
+        start_new_session=timeout is not None,
+    ) as process:
+        try:
+            out, _ = process.communicate(
+                input.encode() if input is not None else None, timeout
+            )
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.communicate()
+            raise CommandTimeoutError(
+                f"Command timed out after {timeout} seconds: {cmd}"
+            )
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, out)
+    return subprocess.CompletedProcess(cmd, process.returncode, out)
+
+
+def kill_process_group(process: Union[subprocess.Popen, "HelperProcess"]):
+    if not isinstance(process, subprocess.Popen):
+        process.kill()  # the helper kills the process group
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # already gone, or a child started with sudo
+        process.kill()
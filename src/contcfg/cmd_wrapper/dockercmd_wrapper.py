@@ -1,32 +1,35 @@
 import subprocess
 from typing import Optional
 
-from .base import singleton, exec_cmd
+from .base import singleton, exec_cmd, get_script
 from .exception import ContainerNotFoundError
+from .runtime import ContainerRuntime
 
 
-@singleton
-class DockerCmdWrapper:
-    """docker command wrapper for managing docker containers.
-    This class is a singleton, so only one instance will be created.
+class ContainerCmdWrapper(ContainerRuntime):
+    """Wrapper of a docker compatible container cli.
     Args:
         - run_with_sudo (bool, optional) : run all commands with sudo.
         Default is False.
     """
 
+    cli = "docker"
+
     def __init__(self, run_with_sudo: bool = True):
         if not hasattr(self, "_initialized"):
+            # container metadata is resolved once and cached, call
+            # `invalidate` when a container is removed or restarted.
+            self._ip_cache: dict[str, str] = {}
+            self._veth_cache: dict[str, str] = {}
             self._initialized = True
         self._run_with_sudo = run_with_sudo
 
     def run_cmd(self, cmd: str):
-        """Run docker command.
+        """Run a container cli command.
         Args:
-            - cmd (str) : docker command to run
+            - cmd (str) : command to run, e.g. "docker ps"
         """
-        if self._run_with_sudo:
-            cmd = f"sudo {cmd}"
-        return subprocess.run(cmd, shell=True, check=True)
+        return exec_cmd(cmd, self._run_with_sudo, bash=False)
 
     def check_container(self, container: str):
         """Check if container exists.
@@ -40,7 +43,7 @@ class DockerCmdWrapper:
             e: subprocess.CalledProcessError if container not found
         """
 
-        cmd = f"docker inspect {container}"
+        cmd = f"{self.cli} inspect {container}"
         try:
             exec_cmd(cmd, self._run_with_sudo, bash=False)
         except subprocess.CalledProcessError as e:
@@ -62,7 +65,7 @@ class DockerCmdWrapper:
         Returns:
             bool: True if container exists, False otherwise
         """
-        cmd = f"docker inspect {container}"
+        cmd = f"{self.cli} inspect {container}"
         try:
             exec_cmd(cmd, self._run_with_sudo, bash=False)
         except subprocess.CalledProcessError:
@@ -75,11 +78,104 @@ class DockerCmdWrapper:
         Args:
             - prefix (str, optional): container name prefix. Default is None.
         """
-        cmd = "docker ps --format '{{.Names}}'"
-        if prefix:
-            cmd += f" | grep {prefix}"
-        return (
-            exec_cmd(cmd, self._run_with_sudo, bash=False, stdout=True)
-            .stdout.decode()
-            .splitlines()
+        cmd = f"{self.cli} ps --format '{{{{.Names}}}}'"
+        output = exec_cmd(cmd, self._run_with_sudo, bash=False, stdout=True)
+        names = output.stdout.decode().splitlines()
+        return [n for n in names if not prefix or prefix in n]
+
+    def get_container_ip(self, container: str) -> str:
+        """Get the ip address of a container. The result is cached.
+
+        Args:
+            container (str): container name or id
+
+        Raises:
+            ContainerNotFoundError: if the ip can not be resolved
+        """
+        if container not in self._ip_cache:
+            self._ip_cache[container] = self._run_script(
+                "find_container_ip.sh", container
+            )
+        return self._ip_cache[container]
+
+    def get_container_veth(self, container: str) -> str:
+        """Get the host side veth name of a container. The result is cached.
+
+        Args:
+            container (str): container name or id
+
+        Raises:
+            ContainerNotFoundError: if the veth can not be resolved
+        """
+        if container not in self._veth_cache:
+            self._veth_cache[container] = self._run_script(
+                "find_container_veth_name.sh", container
+            )
+        return self._veth_cache[container]
+
+    def get_container_netns(self, container: str) -> str:
+        """Get the network namespace path of a container.
+
+        Args:
+            container (str): container name or id
+
+        Raises:
+            ContainerNotFoundError: if the container is not running
+        """
+        cmd = f"{self.cli} inspect -f '{{{{.State.Pid}}}}' {container}"
+        try:
+            output = exec_cmd(cmd, self._run_with_sudo, bash=False, stdout=True)
+        except subprocess.CalledProcessError as e:
+            raise ContainerNotFoundError(
+                f"Container {container} not found."
+            ) from e
+        pid = output.stdout.decode().strip()
+        if not pid or pid == "0":
+            raise ContainerNotFoundError(f"Container {container} not running.")
+        return f"/proc/{pid}/ns/net"
+
+    def exec_prefix(self, container: str) -> str:
+        return f"{self.cli} exec -i {container}"
+
+    def invalidate(self, container: str):
+        """Drop cached metadata of a container."""
+        self._ip_cache.pop(container, None)
+        self._veth_cache.pop(container, None)
+
+    def _run_script(self, script_name: str, container: str) -> str:
+        # the scripts run `$CONTAINER_CLI`, docker by default
+        cmd = (
+            f"env CONTAINER_CLI={self.cli} "
+            f"bash {get_script(script_name)} {container}"
         )
+        try:
+            output = exec_cmd(cmd, self._run_with_sudo, bash=False, stdout=True)
+        except subprocess.CalledProcessError as e:
+            raise ContainerNotFoundError(
+                f"{script_name} failed for container {container}."
+            ) from e
+        return output.stdout.decode().strip()
+
+
+@singleton
+class DockerCmdWrapper(ContainerCmdWrapper):
+    """docker command wrapper for managing docker containers.
+    This class is a singleton, so only one instance will be created.
+    Args:
+        - run_with_sudo (bool, optional) : run all commands with sudo.
+        Default is False.
+    """
+
+    cli = "docker"
+
+
+@singleton
+class PodmanCmdWrapper(ContainerCmdWrapper):
+    """podman command wrapper for managing podman containers.
+    This class is a singleton, so only one instance will be created.
+    Args:
+        - run_with_sudo (bool, optional) : run all commands with sudo.
+        Default is False.
+    """
+
+    cli = "podman"
@@ -1,6 +1,30 @@
+import subprocess
+
+
 class RateValueError(Exception):
     pass
 
 
 class ContainerNotFoundError(Exception):
     pass
+
+
+class CommandTimeoutError(Exception):
+    pass
+
+
+class TCBatchError(subprocess.CalledProcessError):
+    """Some commands of a tc batch failed."""
+
+    def __init__(self, cmd: str, failed: list[str]):
+        super().__init__(1, cmd, stderr="\n".join(failed))
+        self.failed = failed
+
+    def __str__(self) -> str:
+        return f"{len(self.failed)} tc command(s) failed: " + "; ".join(
+            self.failed
+        )
+
+
+class HelperError(Exception):
+    """The privileged helper refused or could not run a request."""
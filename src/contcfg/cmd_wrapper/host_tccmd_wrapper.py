@@ -0,0 +1,368 @@
+import json
+import time
+import threading
+import subprocess
+from typing import Optional, Union
+from collections.abc import Iterable
+
+from .base import check_scripts, singleton, exec_cmd
+from .tc_base import parse_class_stats, to_rate
+from .tc_batch import TCBatch, BLOCKED, exec_tc_batch
+from .tc_session import TCSession
+from .runtime import get_runtime
+
+
+@singleton
+class HostTCCmdWrapper:
+    """tc command wrapper shaping the host side veth of containers.
+    Traffic from container1 to container2 leaves the host through the
+    veth of container2, so each direction is limited on the receiver's
+    veth by matching the sender's ip. No command runs inside the
+    containers, they do not need `tc` or NET_ADMIN.
+    This class is a singleton,
+    so only one instance will be created.
+    Args:
+        - run_with_sudo (bool, optional) : run all commands with sudo.
+        Default is False.
+    """
+
+    def __init__(self, run_with_sudo: bool = False):
+        if not hasattr(self, "_initialized"):
+            check_scripts()  # check if all scripts are present
+            # veths known to hold the htb root qdisc. None until
+            # the host qdiscs have been listed once.
+            self._htb_devs: Optional[set[str]] = None
+            # guards checking _htb_devs and adding the tree, as
+            # containers are onboarded from several threads
+            self._htb_lock = threading.Lock()
+            # host `tc -batch` session used by `commit`
+            self._session: Optional[TCSession] = None
+            self._session_lock = threading.Lock()
+            self._initialized = True
+
+        self._run_with_sudo = run_with_sudo
+
+    def set_bandwidth(
+        self,
+        container1: str,
+        container2: str,
+        bandwidth: Union[int, str],
+        bandwidth_unit: str = "mbit",
+        egress: Optional[str] = None,
+        reverse: Optional[Union[int, str]] = None,
+        _run_with_sudo: bool = False,
+    ):
+        """Set bandwidth limit between two containers.
+        Args:
+            - container1 (str) : container name or id
+            - container2 (str) : container name or id
+            - bandwidth (int) : bandwidth limit from container1 to
+            container2
+            - bandwidth_unit (str, optional) : bandwidth unit.
+            Default is "mbit".
+            - egress (str, optional) : budget of the containers, see
+            `set_bandwidth_batch`. Default is None (no budget).
+            - reverse (int, optional) : bandwidth limit from container2
+            to container1. Default is None (bandwidth).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        self.set_bandwidth_batch(
+            [(container1, container2, bandwidth, reverse)],
+            bandwidth_unit,
+            egress,
+            _run_with_sudo,
+        )
+
+    @property
+    def shapes_ingress(self) -> bool:
+        """The veth of a container shapes what it receives from its
+        peers."""
+        return True
+
+    def set_bandwidth_batch(
+        self,
+        limits: Iterable[tuple],
+        bandwidth_unit: str = "mbit",
+        egress: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ):
+        """Set bandwidth limits between many container pairs
+        with one `tc -batch` invocation.
+        Args:
+            - limits (Iterable) : (container1, container2, bandwidth) or
+            (container1, container2, bandwidth, reverse) tuples, with the
+            bandwidth from container1 to container2 and the reverse one,
+            None for the same
+            - bandwidth_unit (str, optional) : bandwidth unit used for
+            int bandwidths. Default is "mbit".
+            - egress (str, optional) : budget of each container, shared
+            by the traffic its peers send to it, as the veth shapes what
+            the container receives. Default is None (no budget).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        runtime = get_runtime(run_with_sudo)
+        pairs = []
+        for container1, container2, bandwidth, *reverse in limits:
+            rate = to_rate(bandwidth, bandwidth_unit)
+            reverse_rate = rate
+            if reverse and reverse[0] is not None:
+                reverse_rate = to_rate(reverse[0], bandwidth_unit)
+            pairs.append(
+                (
+                    runtime.get_container_veth(container1),
+                    runtime.get_container_veth(container2),
+                    runtime.get_container_ip(container1),
+                    runtime.get_container_ip(container2),
+                    rate,
+                    reverse_rate,
+                )
+            )
+        with self._htb_lock:
+            batch = TCBatch()
+            new_devs: set[str] = set()
+            budget_devs: set[str] = set()
+            for veth1, veth2, ip1, ip2, rate, reverse_rate in pairs:
+                for veth in (veth1, veth2):
+                    if veth not in new_devs and not self._has_htb(veth):
+                        batch.init_htb(veth)
+                        new_devs.add(veth)
+                    if veth not in budget_devs:
+                        batch.set_budget(veth, egress)
+                        budget_devs.add(veth)
+                # container2 -> container1 leaves the host through veth1
+                batch.set_peer_limit(veth1, ip2, reverse_rate, "src", egress)
+                batch.set_peer_limit(veth2, ip1, rate, "src", egress)
+            try:
+                exec_tc_batch(batch, run_with_sudo)
+            except subprocess.CalledProcessError:
+                # list the host qdiscs again next time
+                self._htb_devs = None
+                raise
+            self._mark_htb(new_devs)
+
+    def prepare(self, container: str, _run_with_sudo: bool = False):
+        """Do the slow part of changing the limits of a container ahead:
+        resolve its veth and ip, add the htb tree and open the host
+        session.
+        Args:
+            - container (str) : container name or id
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        get_runtime(run_with_sudo).get_container_ip(container)
+        self.init_htb(container, run_with_sudo)
+        self._host_session(run_with_sudo)
+
+    def limit_batch(
+        self,
+        container: str,
+        peers: Iterable[tuple[str, Union[int, str]]],
+        bandwidth_unit: str = "mbit",
+        egress: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ) -> TCBatch:
+        """Build the batch limiting the traffic from the peers to a
+        container, to be applied with `commit`. The container and its
+        peers must have been prepared, so that their veths and ips are
+        cached.
+        Args:
+            - container (str) : container name or id
+            - peers (Iterable) : (peer, bandwidth) tuples, the bandwidth
+            from the peer to the container
+            - bandwidth_unit (str, optional) : bandwidth unit used for
+            int bandwidths. Default is "mbit".
+            - egress (str, optional) : budget of the container, see
+            `set_bandwidth_batch`. Default is None (no budget).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        runtime = get_runtime(self._run_with_sudo or _run_with_sudo)
+        veth = runtime.get_container_veth(container)
+        batch = TCBatch()
+        batch.set_budget(veth, egress)
+        for peer, bandwidth in peers:
+            peer_ip = runtime.get_container_ip(peer)
+            batch.set_peer_limit(
+                veth,
+                peer_ip,
+                to_rate(bandwidth, bandwidth_unit),
+                "src",
+                egress,
+            )
+        return batch
+
+    def commit(
+        self, batches: dict[str, TCBatch], _run_with_sudo: bool = False
+    ) -> tuple[float, dict[str, Exception]]:
+        """Apply batches built by `limit_batch` as one batch written to
+        the host session.
+        Args:
+            - batches (dict) : container -> batch
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+
+        Returns:
+            - skew (float) : seconds from the write to the
+            acknowledgement, all the changes landed in between
+            - failed (dict) : container -> error, every container fails
+            with the batch
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        merged = TCBatch()
+        for batch in batches.values():
+            for line in batch:
+                merged.add(line)
+        start = time.monotonic()
+        try:
+            session = self._host_session(run_with_sudo)
+            acked = session.wait(session.send(merged))
+        except Exception as e:
+            return time.monotonic() - start, {c: e for c in batches}
+        return acked - start, {}
+
+    def close_session(self):
+        """Close the host session opened by `prepare`."""
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def _host_session(self, run_with_sudo: bool) -> TCSession:
+        with self._session_lock:
+            if self._session is None or not self._session.alive:
+                self._session = TCSession(run_with_sudo=run_with_sudo)
+            return self._session
+
+    def init_htb(self, container: str, _run_with_sudo: bool = False):
+        """Initialize htb qdisc on the host veth of container.
+        Args:
+            - container (str) : container name or id
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        veth = get_runtime(run_with_sudo).get_container_veth(container)
+        with self._htb_lock:
+            if self._has_htb(veth):
+                return
+            batch = TCBatch()
+            batch.init_htb(veth)
+            exec_tc_batch(batch, run_with_sudo)
+            self._mark_htb({veth})
+
+    def clear_one_container(self, container: str, _run_with_sudo: bool = False):
+        """Clear bandwidth limit on the host veth of one container.
+        Args:
+            - container (str) : container name or id
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        runtime = get_runtime(run_with_sudo)
+        if not runtime.is_container_exist(container):
+            runtime.invalidate(container)
+            return
+        veth = runtime.get_container_veth(container)
+        try:
+            exec_cmd(f"tc qdisc del dev {veth} root", run_with_sudo, bash=False)
+        except subprocess.CalledProcessError:
+            pass  # no tc rules on the veth
+        with self._htb_lock:
+            if self._htb_devs is not None:
+                self._htb_devs.discard(veth)
+        runtime.invalidate(container)
+
+    def remove_peer(
+        self,
+        containers: Iterable[str],
+        peer_ip: str,
+        _run_with_sudo: bool = False,
+    ):
+        """Remove the class and filter of a peer from the host veths
+        of containers with one `tc -batch` invocation.
+        Args:
+            - containers (Iterable[str]) : container names or ids
+            - peer_ip (str) : ip address of the removed peer
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        runtime = get_runtime(run_with_sudo)
+        batch = TCBatch()
+        for container in containers:
+            batch.remove_peer_limit(
+                runtime.get_container_veth(container), peer_ip
+            )
+        exec_tc_batch(batch, run_with_sudo)
+
+    def set_default_class(
+        self,
+        containers: Iterable[str],
+        rate: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ):
+        """Shape the traffic from hosts that are not peers to containers
+        on their host veths with one `tc -batch` invocation, see
+        `TCBatch.set_default`.
+        Args:
+            - containers (Iterable[str]) : container names or ids
+            - rate (str, optional) : rate with unit, or "blocked" to drop
+            that traffic. Default is None (not shaped).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        if rate is not None and rate != BLOCKED:
+            rate = to_rate(rate, "mbit")
+        runtime = get_runtime(run_with_sudo)
+        batch = TCBatch()
+        for container in containers:
+            self.init_htb(container, run_with_sudo)
+            batch.set_default(runtime.get_container_veth(container), rate)
+        exec_tc_batch(batch, run_with_sudo)
+
+    def get_class_stats(
+        self, container: str, _run_with_sudo: bool = False
+    ) -> dict[str, tuple[int, int, int]]:
+        """Get the counters of the htb classes on the host veth of container.
+        Args:
+            - container (str) : container name or id
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+
+        Returns:
+            - stats (dict) : classid -> (bytes, packets, drops)
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        veth = get_runtime(run_with_sudo).get_container_veth(container)
+        cmd = f"tc -s -j class show dev {veth}"
+        output = exec_cmd(cmd, run_with_sudo, bash=False, stdout=True)
+        return parse_class_stats(output.stdout.decode())
+
+    def _has_htb(self, dev: str) -> bool:
+        """Called with _htb_lock held, as is _mark_htb."""
+        if self._htb_devs is None:
+            self._htb_devs = self._list_htb_devs()
+        return dev in self._htb_devs
+
+    def _mark_htb(self, devs: set[str]):
+        if self._htb_devs is None:
+            self._htb_devs = set()
+        self._htb_devs |= devs
+
+    def _list_htb_devs(self) -> set[str]:
+        """List host devices whose root qdisc is htb 1:."""
+        output = exec_cmd(
+            "tc -j qdisc show", self._run_with_sudo, bash=False, stdout=True
+        )
+        return {
+            qdisc["dev"]
+            for qdisc in json.loads(output.stdout.decode() or "[]")
+            if qdisc.get("kind") == "htb"
+            and qdisc.get("handle") == "1:"
+            and qdisc.get("root")
+        }
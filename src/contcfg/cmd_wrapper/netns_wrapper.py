@@ -0,0 +1,95 @@
+import os
+import re
+import subprocess
+from typing import Optional
+
+from .base import singleton, exec_cmd
+from .exception import ContainerNotFoundError
+from .runtime import ContainerRuntime
+
+NETNS_DIR = "/run/netns"
+
+
+@singleton
+class NetnsCmdWrapper(ContainerRuntime):
+    """Wrapper treating the named network namespaces of `ip netns` as
+    containers, for large topologies without a container daemon.
+    Each namespace is expected to hold an `eth0` interface, one end of
+    a veth pair whose other end is on the host.
+    This class is a singleton, so only one instance will be created.
+    Args:
+        - run_with_sudo (bool, optional) : run all commands with sudo.
+        Default is False.
+    """
+
+    def __init__(self, run_with_sudo: bool = False):
+        if not hasattr(self, "_initialized"):
+            self._ip_cache: dict[str, str] = {}
+            self._veth_cache: dict[str, str] = {}
+            self._initialized = True
+        self._run_with_sudo = run_with_sudo
+
+    def check_container(self, container: str):
+        if not self.is_container_exist(container):
+            raise ContainerNotFoundError(
+                f"Network namespace {container} not found."
+            )
+
+    def is_container_exist(self, container: str) -> bool:
+        return os.path.exists(self.get_container_netns(container))
+
+    def get_container(self, prefix: Optional[str] = None) -> list[str]:
+        output = self._ip("netns list")
+        names = [line.split()[0] for line in output.splitlines() if line]
+        return [n for n in names if not prefix or prefix in n]
+
+    def get_container_ip(self, container: str) -> str:
+        if container not in self._ip_cache:
+            output = self._ip(f"-n {container} -4 -o addr show dev eth0")
+            match = re.search(r"inet (\S+)/", output)
+            if match is None:
+                raise ContainerNotFoundError(
+                    f"No ipv4 address on eth0 of {container}."
+                )
+            self._ip_cache[container] = match.group(1)
+        return self._ip_cache[container]
+
+    def get_container_veth(self, container: str) -> str:
+        if container not in self._veth_cache:
+            # "3: eth0@if12: ..." where 12 is the ifindex of the peer
+            output = self._ip(f"-n {container} -o link show dev eth0")
+            match = re.search(r"eth0@if(\d+):", output)
+            if match is None:
+                raise ContainerNotFoundError(
+                    f"eth0 of {container} is not a veth."
+                )
+            peer = f"{match.group(1)}: "
+            for line in self._ip("-o link show").splitlines():
+                if line.startswith(peer):
+                    name = line[len(peer) :].split(":")[0]
+                    self._veth_cache[container] = name.split("@")[0]
+                    break
+            else:
+                raise ContainerNotFoundError(
+                    f"Host side veth of {container} not found."
+                )
+        return self._veth_cache[container]
+
+    def get_container_netns(self, container: str) -> str:
+        return os.path.join(NETNS_DIR, container)
+
+    def exec_prefix(self, container: str) -> str:
+        return f"ip netns exec {container}"
+
+    def invalidate(self, container: str):
+        self._ip_cache.pop(container, None)
+        self._veth_cache.pop(container, None)
+
+    def _ip(self, args: str) -> str:
+        try:
+            output = exec_cmd(
+                f"ip {args}", self._run_with_sudo, bash=False, stdout=True
+            )
+        except subprocess.CalledProcessError as e:
+            raise ContainerNotFoundError(f"ip {args} failed.") from e
+        return output.stdout.decode()
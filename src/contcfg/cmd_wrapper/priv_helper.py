@@ -0,0 +1,572 @@
+import errno
+import itertools
+import json
+import logging
+import os
+import shlex
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional
+
+from .base import get_script, kill_process_group
+from .exception import CommandTimeoutError, HelperError
+
+__all__ = ["PrivHelper", "HelperClient", "HelperProcess", "check_argv"]
+
+DEFAULT_HELPER_SOCKET = "/tmp/contcfg-helper.sock"
+
+# container clis, for their read-only commands and `exec -i`
+RUNTIME_CLIS = ("docker", "podman")
+RUNTIME_COMMANDS = ("inspect", "ps")
+# variables read by the packaged scripts, and their allowed values
+SCRIPT_ENV = {"CONTAINER_CLI": RUNTIME_CLIS}
+# tc commands contcfg runs, the classifier and actions its filters use,
+# and the options it passes before the object
+TC_OBJECTS = ("qdisc", "class", "filter")
+TC_VERBS = ("add", "change", "replace", "del", "delete", "show", "ls", "list")
+TC_ACTIONS = ("mirred",)
+TC_OPTIONS = ("-s", "-j", "-force")
+# options of ip taking no value, `-n <netns>` aside
+IP_OPTIONS = ("-4", "-o", "-j")
+# characters a shell would interpret, never in a contcfg command
+SHELL_CHARS = frozenset("|&;<>()$`\\\n")
+
+_PEERCRED = struct.Struct("3i")  # pid, uid, gid
+
+
+def check_argv(argv: Sequence[str], input: Optional[str] = None):
+    """Check that the helper may run a command. Allowed are the commands
+    contcfg runs: the tc and ip commands it issues, on the host, in a
+    named netns with `ip netns exec <netns>` or in a container with
+    `<cli> exec -i <container>`, `inspect` and `ps` of docker and podman,
+    and the packaged scripts run with bash. The tc commands read by
+    `tc -force -batch -` are checked by `check_tc_line`.
+    Args:
+        - argv (Sequence[str]) : the command, run without a shell
+        - input (str, optional) : data written to its stdin. Default is
+        None.
+
+    Raises:
+        - HelperError if the command is not allowed
+    """
+    args = list(argv)
+    if any(SHELL_CHARS.intersection(arg) for arg in args):
+        raise HelperError(f"Shell syntax not allowed: {shlex.join(argv)}")
+    if args[:1] == ["env"]:
+        args.pop(0)
+        while args and "=" in args[0]:
+            name, value = args.pop(0).split("=", 1)
+            if value not in SCRIPT_ENV.get(name, ()):
+                raise HelperError(f"Variable not allowed: {name}={value}")
+        if args[:1] != ["bash"]:
+            raise HelperError(f"Command not allowed: {shlex.join(argv)}")
+    if args[:1] == ["bash"]:
+        script = Path(args[1]) if len(args) > 1 else None
+        if script is None or script.resolve() != get_script(script.name):
+            raise HelperError(f"Script not allowed: {shlex.join(argv)}")
+        return
+    if args[:1] and args[0] in RUNTIME_CLIS:
+        if len(args) > 1 and args[1] in RUNTIME_COMMANDS:
+            return
+        if (
+            args[1:3] != ["exec", "-i"]
+            or len(args) < 4
+            or args[3].startswith("-")
+        ):
+            raise HelperError(f"Command not allowed: {shlex.join(argv)}")
+        # `-i` is the only option, the container comes next. An option
+        # there, e.g. --privileged, would make the next word the container
+        args = args[4:]
+    if _check_tool(args, argv) and input is not None:
+        for line in input.splitlines():
+            check_tc_line(line)
+
+
+def check_tc_line(line: str):
+    """Check a command of a tc batch, e.g. "class add dev eth0 ...".
+    Only qdiscs, classes and u32 filters are handled, and the only
+    action is mirred, so no program or bpf object is ever loaded.
+
+    Raises:
+        - HelperError if the command is not allowed
+    """
+    tokens = line.split()
+    if not tokens:
+        return
+    if (
+        len(tokens) < 2
+        or tokens[0] not in TC_OBJECTS
+        or tokens[1] not in TC_VERBS
+        or any("bpf" in token or token == "exec" for token in tokens)
+        or (
+            tokens[0] == "filter"
+            and tokens[1] not in ("del", "delete", "show", "ls", "list")
+            and "u32" not in tokens
+        )
+        or any(
+            tokens[i + 1 : i + 2] and tokens[i + 1] not in TC_ACTIONS
+            for i, token in enumerate(tokens)
+            if token in ("action", "actions")
+        )
+    ):
+        raise HelperError(f"tc command not allowed: {line}")
+
+
+def _check_tool(args: list[str], argv: Sequence[str]) -> bool:
+    """Check a tc or ip command, on the host or in the netns given by
+    its `ip netns exec` prefix.
+
+    Returns:
+        - bool : True if the command is `tc -force -batch -`, which
+        reads its commands from stdin
+    """
+    denied = HelperError(f"Command not allowed: {shlex.join(argv)}")
+    if args[:1] == ["tc"]:
+        options = args[1:]
+        batch = False
+        while options[:1] and options[0].startswith("-"):
+            option = options.pop(0)
+            if option == "-batch" and options[:1] == ["-"] and not batch:
+                options.pop(0)
+                batch = True
+            elif option not in TC_OPTIONS:
+                raise denied
+        if batch:
+            if options:
+                raise denied
+            return True
+        if not options:
+            raise denied
+        try:
+            check_tc_line(" ".join(options))
+        except HelperError:
+            raise denied from None
+        return False
+    if args[:1] != ["ip"]:
+        raise denied
+    # netns first, so that -all or -n cannot change its meaning
+    if args[1:3] == ["netns", "exec"]:
+        if len(args) < 5 or args[3].startswith("-"):
+            raise denied
+        return _check_tool(args[4:], argv)
+    if args[1:] == ["netns", "list"]:
+        return False
+    options = args[1:]
+    while options[:1] and options[0].startswith("-"):
+        option = options.pop(0)
+        if option == "-n" and options[:1] and options[0][:1] != "-":
+            options.pop(0)
+        elif option not in IP_OPTIONS:
+            raise denied
+    obj, verb, rest = options[:1], options[1:2], options[2:]
+    if obj == ["addr"]:
+        allowed = verb == ["show"] and _show_dev(rest)
+    elif obj == ["link"]:
+        allowed = (
+            (verb == ["show"] and _show_dev(rest))
+            or (verb == ["add"] and rest[1:] == ["type", "ifb"])
+            or (verb == ["set"] and len(rest) == 2 and rest[1] == "up")
+            or (verb == ["del"] and len(rest) == 1)
+        )
+    else:
+        allowed = False
+    if allowed:
+        return False
+    raise denied
+
+
+def _show_dev(args: list[str]) -> bool:
+    """Check the arguments of `ip <object> show [dev <dev>]`."""
+    return not args or (len(args) == 2 and args[0] == "dev")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """A connection to the helper. Each line is a JSON request:
+    {"op": "run", "id", "argv", "input", "timeout"} is answered with
+    {"id", "returncode", "stdout", "stderr"}, {"id", "timeout": true} or
+    {"id", "error"}, in the order the commands end. A first request
+    {"op": "session", "argv"} turns the connection into the stdin and
+    stderr of a long-lived process, see HelperProcess.
+    """
+
+    server: "PrivHelper"
+
+    def handle(self) -> None:
+        creds = self.request.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size
+        )
+        _, uid, _ = _PEERCRED.unpack(creds)
+        if uid not in self.server.uids:
+            logging.warning(f"Refused a connection from uid {uid}")
+            return
+        self._write_lock = threading.Lock()
+        for line in self.rfile:
+            request: dict = {}
+            try:
+                request = json.loads(line)
+                check_argv(request["argv"], request.get("input"))
+            except (ValueError, KeyError, TypeError, HelperError) as e:
+                self._send({"id": request.get("id"), "error": str(e)})
+                continue
+            if request.get("op") == "session":
+                self._session(request["argv"])
+                return
+            threading.Thread(
+                target=self._run, args=(request,), daemon=True
+            ).start()
+
+    def _send(self, reply: dict):
+        with self._write_lock:
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    def _run(self, request: dict):
+        reply = {"id": request.get("id")}
+        try:
+            reply.update(_run(request))
+        except OSError as e:  # e.g. the program is not installed
+            reply["error"] = str(e)
+        try:
+            self._send(reply)
+        except OSError:
+            pass  # the client is gone
+
+    def _session(self, argv: list[str]):
+        try:
+            process = subprocess.Popen(
+                argv,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            self._send({"error": str(e)})
+            return
+        self._send({"pid": process.pid})
+        feeder = threading.Thread(
+            target=self._feed, args=(process,), daemon=True
+        )
+        feeder.start()
+        assert process.stderr is not None
+        try:
+            for line in process.stderr:
+                self._send({"stderr": line.decode(errors="replace")})
+        except OSError:  # the client is gone
+            kill_process_group(process)
+        returncode = process.wait()
+        try:
+            self._send({"returncode": returncode})
+        except OSError:
+            pass
+
+    def _feed(self, process: subprocess.Popen):
+        """Copy the connection to the stdin of a session process, line by
+        line, each line being checked by `check_tc_line`. A line refused
+        ends the session. Once the client closes the connection, the
+        process gets a second to exit."""
+        assert process.stdin is not None
+        try:
+            for line in self.rfile:
+                check_tc_line(line.decode(errors="replace"))
+                process.stdin.write(line)
+                process.stdin.flush()
+        except HelperError as e:
+            logging.warning(f"Ended a tc session: {e}")
+        except OSError:
+            pass
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+
+
+def _run(request: dict) -> dict:
+    """Run the command of a "run" request."""
+    text = request.get("input")
+    with subprocess.Popen(
+        request["argv"],
+        stdin=subprocess.PIPE if text is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    ) as process:
+        try:
+            out, err = process.communicate(
+                text.encode() if text is not None else None,
+                request.get("timeout"),
+            )
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.communicate()
+            return {"timeout": True}
+    return {
+        "returncode": process.returncode,
+        "stdout": out.decode(errors="surrogateescape"),
+        "stderr": err.decode(errors="replace"),
+    }
+
+
+class PrivHelper(socketserver.ThreadingUnixStreamServer):
+    """Privileged helper running the commands of an unprivileged server.
+    Started once as root, it listens on a Unix socket only its user can
+    open, checks the uid of each peer and runs the commands allowed by
+    `check_argv`, without a shell. A client keeps one connection open
+    and pipelines its commands on it, so running one costs a socket
+    round trip instead of a `sudo` process. Commands run concurrently.
+    Args:
+        - path (str, optional) : path of the socket.
+        Default is DEFAULT_HELPER_SOCKET.
+        - uid (int, optional) : user allowed besides root, also the owner
+        of the socket. Default is None (only root).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str = DEFAULT_HELPER_SOCKET, uid=None):
+        self.path = path
+        self.uids = {0} if uid is None else {0, uid}
+        _remove_stale(path)
+        # the socket is never open to others, even before the chmod
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+        if uid is not None:
+            os.chown(path, uid, -1)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale(path: str):
+    """Remove the socket of a helper that is not running anymore."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError as e:
+            if e.errno == errno.ECONNREFUSED:
+                os.remove(path)
+            elif e.errno != errno.ENOENT:
+                raise
+            return
+    raise OSError(f"Socket is already in use. Socket path: {path}")
+
+
+class _Connection:
+    """A connection of HelperClient and the requests awaiting a reply."""
+
+    def __init__(self, path: str, lock: threading.Lock):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.pending: dict[int, Future] = {}
+        # the lock of the client, held while requests are added
+        self._lock = lock
+        self.closed = False
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        try:
+            with self.sock.makefile("rb") as rfile:
+                for line in rfile:
+                    reply = json.loads(line)
+                    future = self.pending.pop(reply["id"], None)
+                    if future is not None:
+                        future.set_result(reply)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self.closed = True
+            for future in self.pending.values():
+                future.set_exception(ConnectionError("Helper connection lost"))
+            self.pending.clear()
+
+
+class HelperClient:
+    """Client of a PrivHelper. Commands are pipelined on one persistent
+    connection, reopened when lost, and `run` is thread safe.
+    Args:
+        - path (str, optional) : path of the helper socket.
+        Default is DEFAULT_HELPER_SOCKET.
+    """
+
+    def __init__(self, path: str = DEFAULT_HELPER_SOCKET):
+        self.path = path
+        self._conn: Optional[_Connection] = None
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open the connection, raises OSError if no helper listens."""
+        with self._lock:
+            self._connection()
+
+    def run(
+        self,
+        argv: Sequence[str],
+        input: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> subprocess.CompletedProcess:
+        """Run a command as root.
+        Args:
+            - argv (Sequence[str]) : the command, run without a shell
+            - input (str, optional) : data written to its stdin.
+            Default is None.
+            - timeout (float, optional) : timeout in seconds. Default is
+            None (wait forever).
+
+        Returns:
+            - process (CompletedProcess) : the returncode, stdout and
+            stderr, as bytes
+
+        Raises:
+            - HelperError if the helper refused the command
+            - CommandTimeoutError if the command timed out
+            - ConnectionError if the connection was lost meanwhile
+        """
+        future: Future = Future()
+        request: dict = {
+            "op": "run",
+            "argv": list(argv),
+            "input": input,
+            "timeout": timeout,
+        }
+        with self._lock:
+            conn = self._connection()
+            request["id"] = request_id = next(self._ids)
+            conn.pending[request_id] = future
+            try:
+                conn.sock.sendall(json.dumps(request).encode() + b"\n")
+            except OSError:
+                conn.pending.pop(request_id, None)
+                conn.sock.close()
+                raise
+        reply = future.result()
+        if "error" in reply:
+            raise HelperError(reply["error"])
+        if reply.get("timeout"):
+            raise CommandTimeoutError(
+                f"Command timed out after {timeout} seconds: "
+                f"{shlex.join(argv)}"
+            )
+        return subprocess.CompletedProcess(
+            list(argv),
+            reply["returncode"],
+            reply["stdout"].encode(errors="surrogateescape"),
+            reply["stderr"].encode(),
+        )
+
+    def spawn(self, argv: Sequence[str]) -> "HelperProcess":
+        """Start a long-lived process as root on its own connection.
+        Raises HelperError if the helper refused the command."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            request = {"op": "session", "argv": list(argv)}
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            rfile = sock.makefile("rb")
+            reply = json.loads(rfile.readline() or b"{}")
+        except BaseException:
+            sock.close()
+            raise
+        if "pid" not in reply:
+            sock.close()
+            raise HelperError(reply.get("error", "Helper connection lost"))
+        return HelperProcess(sock, rfile, reply["pid"])
+
+    def close(self):
+        """Close the connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.sock.close()
+                self._conn = None
+
+    def _connection(self) -> _Connection:
+        if self._conn is None or self._conn.closed:
+            self._conn = _Connection(self.path, self._lock)
+        return self._conn
+
+
+class _SocketStdin:
+    """Text stdin of a HelperProcess, written to its connection."""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+
+    def write(self, text: str) -> int:
+        self._sock.sendall(text.encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class HelperProcess:
+    """A process started by the helper, with the part of the interface
+    of subprocess.Popen used by TCSession. stdin takes text and stderr
+    yields lines, the return code is known once stderr is exhausted.
+    Killing it closes the connection, the helper then kills the process
+    if it does not exit within a second.
+    """
+
+    def __init__(self, sock: socket.socket, rfile, pid: int):
+        self._sock = sock
+        self._rfile = rfile
+        # pid in the namespace of the helper, for information only
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self._exited = threading.Event()
+        self.stdin: Optional[_SocketStdin] = _SocketStdin(sock)
+        self.stderr: Optional[Iterator[str]] = self._read_stderr()
+
+    def _read_stderr(self) -> Iterator[str]:
+        try:
+            for line in self._rfile:
+                message = json.loads(line)
+                if "stderr" in message:
+                    yield message["stderr"]
+                else:
+                    self.returncode = message["returncode"]
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            if self.returncode is None:  # the connection was lost
+                self.returncode = -1
+            self._sock.close()
+            self._exited.set()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired("helper session", timeout or 0)
+        assert self.returncode is not None
+        return self.returncode
+
+    def kill(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
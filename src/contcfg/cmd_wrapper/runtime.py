@@ -0,0 +1,87 @@
+from typing import Optional
+
+__all__ = ["ContainerRuntime", "RUNTIMES", "set_runtime", "get_runtime"]
+
+# "docker" and "podman" use the container cli, "netns" treats the named
+# network namespaces of `ip netns` as containers
+RUNTIMES = ("docker", "podman", "netns")
+
+# runtime returned by `get_runtime`. See `set_runtime`.
+_runtime = "docker"
+
+
+class ContainerRuntime:
+    """Interface of the container runtime wrappers.
+    A container is anything with its own network namespace holding an
+    `eth0` interface, which is shaped by tc.
+    """
+
+    def check_container(self, container: str):
+        """Raise ContainerNotFoundError if container does not exist."""
+        raise NotImplementedError
+
+    def is_container_exist(self, container: str) -> bool:
+        raise NotImplementedError
+
+    def get_container(self, prefix: Optional[str] = None) -> list[str]:
+        """Get all running containers with given prefix."""
+        raise NotImplementedError
+
+    def get_container_ip(self, container: str) -> str:
+        """Get the ip address of a container. The result is cached."""
+        raise NotImplementedError
+
+    def get_container_veth(self, container: str) -> str:
+        """Get the host side veth of a container. The result is cached."""
+        raise NotImplementedError
+
+    def get_container_netns(self, container: str) -> str:
+        """Get the path of the network namespace of a container."""
+        raise NotImplementedError
+
+    def exec_prefix(self, container: str) -> str:
+        """Get the prefix running a command inside a container, reading
+        stdin, e.g. "docker exec -i c1"."""
+        raise NotImplementedError
+
+    def invalidate(self, container: str):
+        """Drop cached metadata of a container."""
+        raise NotImplementedError
+
+
+def set_runtime(runtime: str):
+    """Set the runtime returned by `get_runtime`.
+    Args:
+        - runtime (str) : one of RUNTIMES
+    """
+    global _runtime
+    if runtime not in RUNTIMES:
+        raise ValueError(
+            f"Invalid runtime {runtime}. Valid runtimes are {RUNTIMES}"
+        )
+    _runtime = runtime
+
+
+def get_runtime(
+    run_with_sudo: bool = False, runtime: Optional[str] = None
+) -> ContainerRuntime:
+    """Get the wrapper of a runtime.
+    Args:
+        - run_with_sudo (bool, optional) : run all commands with sudo.
+        Default is False.
+        - runtime (str, optional) : one of RUNTIMES. Default is the
+        runtime set by `set_runtime`, "docker" if not set.
+    """
+    from .dockercmd_wrapper import DockerCmdWrapper, PodmanCmdWrapper
+    from .netns_wrapper import NetnsCmdWrapper
+
+    runtime = runtime or _runtime
+    if runtime == "podman":
+        return PodmanCmdWrapper(run_with_sudo)
+    if runtime == "netns":
+        return NetnsCmdWrapper(run_with_sudo)
+    if runtime == "docker":
+        return DockerCmdWrapper(run_with_sudo)
+    raise ValueError(
+        f"Invalid runtime {runtime}. Valid runtimes are {RUNTIMES}"
+    )
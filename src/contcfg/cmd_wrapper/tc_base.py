@@ -1,3 +1,9 @@
+import re
+import json
+from typing import Union
+
+from .exception import RateValueError
+
 TC_BANDWIDTH_UNITS = [
     "kbit",
     "mbit",
@@ -12,6 +18,34 @@ TC_BANDWIDTH_UNITS = [
     "bps",
 ]
 
+# bits per second of one rate unit, tc uses SI prefixes
+TC_UNIT_BITS = {
+    "bit": 1,
+    "kbit": 10**3,
+    "mbit": 10**6,
+    "gbit": 10**9,
+    "tbit": 10**12,
+    "bps": 8,
+    "kbps": 8 * 10**3,
+    "mbps": 8 * 10**6,
+    "gbps": 8 * 10**9,
+    "tbps": 8 * 10**12,
+}
+
+# htb stores rates as 32-bit byte counts, tc needs the 64-bit extension
+# of recent kernels above this
+TC_RATE32_MAX_BITS = (2**32 - 1) * 8
+
+
+def convert_rate(rate: int, unit: str, to_unit: str) -> int:
+    """Convert a rate to another unit, rounded to an integer.
+    Args:
+        - rate (int) : rate
+        - unit (str) : unit of rate, e.g. "kbit"
+        - to_unit (str) : target unit, e.g. "mbit"
+    """
+    return round(rate * TC_UNIT_BITS[unit] / TC_UNIT_BITS[to_unit])
+
 
 def split_raw_str_rate(rate: str) -> tuple[int, str]:
     """Split raw string rate into rate and unit.
@@ -29,3 +63,85 @@ def split_raw_str_rate(rate: str) -> tuple[int, str]:
     raise ValueError(
         f"Invalid rate {rate}. " + f"Valid units are {TC_BANDWIDTH_UNITS}"
     )
+
+
+def check_bandwidth(bandwidth: int, bandwidth_unit: str):
+    """Check that a bandwidth can be set as an htb rate.
+    Args:
+        - bandwidth (int) : bandwidth
+        - bandwidth_unit (str) : unit of bandwidth, e.g. "mbit"
+
+    Raises:
+        - RateValueError if the unit is unknown, or the bandwidth is
+        negative or above the 32-bit rate limit of tc
+    """
+    if bandwidth_unit not in TC_BANDWIDTH_UNITS:
+        raise RateValueError(f"Invalid bandwidth unit {bandwidth_unit}")
+    if bandwidth < 0:
+        raise RateValueError(f"Invalid bandwidth {bandwidth}")
+    if bandwidth * TC_UNIT_BITS[bandwidth_unit] > TC_RATE32_MAX_BITS:
+        raise RateValueError(
+            f"Bandwidth {bandwidth}{bandwidth_unit} is above the 32-bit "
+            f"rate limit of tc ({TC_RATE32_MAX_BITS // 10**6}mbit)"
+        )
+
+
+def to_rate(bandwidth: Union[int, str], bandwidth_unit: str) -> str:
+    """Check a bandwidth and get it as a rate string, e.g. "10mbit".
+    Args:
+        - bandwidth (Union[int, str]) : bandwidth, or a raw string rate
+        including its unit, e.g. "10mbit"
+        - bandwidth_unit (str) : unit of an int bandwidth
+
+    Raises:
+        - RateValueError if the bandwidth is invalid, see `check_bandwidth`
+    """
+    if isinstance(bandwidth, str):
+        bandwidth, bandwidth_unit = split_raw_str_rate(bandwidth)
+    check_bandwidth(bandwidth, bandwidth_unit)
+    return f"{bandwidth}{bandwidth_unit}"
+
+
+_CLASS_RE = re.compile(r"^class \S+ (\S+)")
+_SENT_RE = re.compile(r"Sent (\d+) bytes (\d+) pkt \(dropped (\d+)")
+
+
+def parse_class_stats(output: str) -> dict[str, tuple[int, int, int]]:
+    """Parse the output of `tc -s -j class show`.
+    Some tc versions ignore -j for htb classes, so the text format
+    is parsed as a fallback.
+    Args:
+        - output (str) : output of tc
+
+    Returns:
+        - stats (dict) : classid -> (bytes, packets, drops)
+    """
+    try:
+        classes = json.loads(output)
+    except ValueError:
+        classes = None
+    stats: dict[str, tuple[int, int, int]] = {}
+    if isinstance(classes, list):
+        for cls in classes:
+            counters = cls.get("stats", {})
+            stats[cls["handle"]] = (
+                counters.get("bytes", 0),
+                counters.get("packets", 0),
+                counters.get("drops", 0),
+            )
+        return stats
+    classid = None
+    for line in output.splitlines():
+        match = _CLASS_RE.match(line)
+        if match:
+            classid = match.group(1)
+            continue
+        match = _SENT_RE.search(line)
+        if match and classid is not None:
+            stats[classid] = (
+                int(match.group(1)),
+                int(match.group(2)),
+                int(match.group(3)),
+            )
+            classid = None
+    return stats
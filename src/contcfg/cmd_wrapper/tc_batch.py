@@ -0,0 +1,345 @@
+import gzip
+import math
+import hashlib
+import platform
+from typing import Optional
+from collections.abc import Iterator
+
+from .base import exec_cmd
+from .tc_base import TC_UNIT_BITS, split_raw_str_rate
+
+# Class ids used by the htb tree. Peer classes are derived from the peer ip,
+# see `get_class_minor`.
+HTB_ROOT_HANDLE = "1:"
+HTB_DEFAULT_CLASS = "1:9999"
+# The minors of peer classes are written in decimal digits, so that the
+# classes below, whose minors have hex letters, never clash with a peer.
+# parent of the peer classes, its rate is the egress budget of the device
+HTB_BUDGET_CLASS = "1:fffd"
+# class of the ip traffic to containers that are not peers, see
+# `set_default`
+HTB_OTHER_CLASS = "1:fffe"
+# u32 filter catching that traffic. It is the first node of the first
+# hash table allocated after 800:, the table of the peer filters, so its
+# handle is known as long as the peer filters are added first.
+HTB_OTHER_FILTER = "801::1"
+# default rate of set_default dropping the traffic instead
+BLOCKED = "blocked"
+# packets queued by the leaf of HTB_OTHER_CLASS, the usual txqueuelen.
+# Replacing a pfifo without a limit keeps its old limit.
+HTB_OTHER_QUEUE = 1000
+# device receiving the ingress traffic of a container, see
+# `redirect_ingress`
+IFB_DEV = "ifb0"
+# the largest rate in mbit fitting the 32-bit rates of tc
+HTB_MAX_RATE = "34359mbit"
+# default quantum is rate / r2q, the kernel warns beyond this
+HTB_R2Q = 10
+HTB_MAX_QUANTUM = 200000
+# used when the kernel config cannot be read
+DEFAULT_HZ = 250
+
+
+def get_kernel_hz() -> int:
+    """Get CONFIG_HZ of the running kernel, the tick rate bounding how
+    often htb can dequeue. Containers share the kernel of the host.
+    Returns DEFAULT_HZ if the kernel config is not available."""
+    paths = ("/proc/config.gz", f"/boot/config-{platform.release()}")
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt") as f:
+                for line in f:
+                    if line.startswith("CONFIG_HZ="):
+                        return int(line.split("=")[1])
+        except (OSError, ValueError):
+            continue
+    return DEFAULT_HZ
+
+
+class HTBProfile:
+    """Parameters of the htb classes derived from their rate.
+    A class must be able to send one tick worth of traffic at once to
+    reach its rate, so the burst is rate / HZ, at least one MTU. The
+    quantum shares the spare bandwidth in proportion to the rates and is
+    kept between one MTU and the size the kernel warns about.
+    Args:
+        - mtu (int, optional) : MTU of the shaped interfaces. Default
+        is 1500.
+        - hz (int, optional) : kernel tick rate. Default is None (read
+        from the kernel config, see `get_kernel_hz`).
+        - fq_codel (bool, optional) : attach a fq_codel qdisc to each
+        class, instead of the default pfifo. Default is False.
+    """
+
+    def __init__(
+        self,
+        mtu: int = 1500,
+        hz: Optional[int] = None,
+        fq_codel: bool = False,
+    ):
+        if mtu <= 0:
+            raise ValueError(f"Invalid mtu {mtu}")
+        if hz is not None and hz <= 0:
+            raise ValueError(f"Invalid hz {hz}")
+        self.mtu = mtu
+        self.hz = hz if hz is not None else get_kernel_hz()
+        self.fq_codel = fq_codel
+
+    def class_params(self, rate: str, ceil: Optional[str] = None) -> str:
+        """Get the htb parameters of a class, e.g.
+        "rate 1gbit ceil 1gbit burst 500000 cburst 500000 quantum 125000".
+        Args:
+            - rate (str) : rate with unit, e.g. "1gbit"
+            - ceil (str, optional) : rate the class may borrow up to, at
+            least rate. Default is None (rate).
+        """
+        if ceil is None or self._bytes(ceil) < self._bytes(rate):
+            ceil = rate
+        rate_bytes = self._bytes(rate)
+        quantum = min(
+            max(int(rate_bytes / HTB_R2Q), self.mtu), HTB_MAX_QUANTUM
+        )
+        return (
+            f"rate {rate} ceil {ceil} burst {self._burst(rate_bytes)} "
+            f"cburst {self._burst(self._bytes(ceil))} quantum {quantum}"
+        )
+
+    def _burst(self, rate_bytes: float) -> int:
+        return max(math.ceil(rate_bytes / self.hz), self.mtu)
+
+    @staticmethod
+    def _bytes(rate: str) -> float:
+        value, unit = split_raw_str_rate(rate)
+        return value * TC_UNIT_BITS[unit] / 8
+
+
+# profile used by the batches, see `set_htb_profile`
+_profile: Optional[HTBProfile] = None
+
+
+def set_htb_profile(profile: HTBProfile):
+    """Set the htb profile of all the classes added from now on."""
+    global _profile
+    _profile = profile
+
+
+def get_htb_profile() -> HTBProfile:
+    """Get the profile set by `set_htb_profile`, the default one if none
+    was set."""
+    global _profile
+    if _profile is None:
+        _profile = HTBProfile()
+    return _profile
+
+
+def get_class_minor(ip: str) -> int:
+    """Get the htb class minor id for a peer ip.
+    This is the same hash as `generate_ids` in functions.sh, so
+    classes created by the scripts and by a batch are interchangeable.
+    Args:
+        - ip (str) : peer ip address
+
+    Returns:
+        - minor (int) : class minor id in range 1-4095
+    """
+    digest = hashlib.md5(ip.encode()).hexdigest()
+    return int(digest[:4], 16) % 4095 + 1
+
+
+def get_class_id(ip: str) -> str:
+    """Get the full htb class id for a peer ip. e.g. "1:2748".
+    Note: tc parses the minor as hex, the scripts write it
+    in decimal digits, and so do we.
+    """
+    return f"1:{get_class_minor(ip)}"
+
+
+def get_filter_handle(ip: str) -> str:
+    """Get the u32 filter handle for a peer ip. e.g. "800::abc".
+    An explicit handle makes `filter replace` idempotent and
+    lets a peer's filter be deleted without listing the chain.
+    """
+    return f"800::{get_class_minor(ip):x}"
+
+
+class TCBatch:
+    """A list of tc commands applied with one `tc -batch` invocation.
+    Commands are written without the leading `tc`, as expected by
+    `tc -batch`.
+    """
+
+    def __init__(self, profile: Optional[HTBProfile] = None) -> None:
+        self._lines: list[str] = []
+        self._profile = profile or get_htb_profile()
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._lines)
+
+    def add(self, line: str):
+        """Append a raw tc command, e.g. "qdisc del dev eth0 root"."""
+        self._lines.append(line)
+
+    def init_htb(self, dev: str):
+        """Add the htb root qdisc and its two default classes on dev."""
+        self.add(
+            f"qdisc add dev {dev} root handle {HTB_ROOT_HANDLE} "
+            "htb default 9999"
+        )
+        params = self._profile.class_params(HTB_MAX_RATE)
+        for classid in (HTB_BUDGET_CLASS, HTB_DEFAULT_CLASS):
+            self.add(
+                f"class add dev {dev} parent {HTB_ROOT_HANDLE} "
+                f"classid {classid} htb {params}"
+            )
+        self._add_leaf(dev, HTB_DEFAULT_CLASS)
+
+    def redirect_ingress(self, dev: str, ifb: str = IFB_DEV):
+        """Redirect all the traffic received on dev to the egress of an
+        ifb device with a single mirred filter, so that it can be shaped
+        by an htb tree on the ifb device. The ifb device must exist."""
+        self.add(f"qdisc add dev {dev} handle ffff: ingress")
+        self.add(
+            f"filter replace dev {dev} parent ffff: protocol all prio 1 "
+            f"handle 800::1 u32 match u32 0 0 "
+            f"action mirred egress redirect dev {ifb}"
+        )
+
+    def set_budget(self, dev: str, rate: Optional[str] = None):
+        """Set the egress budget shared by the peer classes of dev.
+        Args:
+            - dev (str) : device holding the htb tree
+            - rate (str, optional) : rate with unit, e.g. "1gbit".
+            Default is None (no budget).
+        """
+        params = self._profile.class_params(rate or HTB_MAX_RATE)
+        self.add(
+            f"class replace dev {dev} parent {HTB_ROOT_HANDLE} "
+            f"classid {HTB_BUDGET_CLASS} htb {params}"
+        )
+
+    def set_peer_limit(
+        self,
+        dev: str,
+        ip: str,
+        rate: str,
+        match: str = "dst",
+        ceil: Optional[str] = None,
+    ):
+        """Add or update the class and filter limiting traffic to/from a peer.
+        Args:
+            - dev (str) : device holding the htb tree
+            - ip (str) : peer ip address
+            - rate (str) : rate with unit, e.g. "100mbit"
+            - match (str, optional) : "dst" to classify by destination ip,
+            "src" to classify by source ip. Default is "dst".
+            - ceil (str, optional) : rate the class may borrow up to from
+            the budget, see `set_budget`. Default is None (rate).
+        """
+        if match not in ("src", "dst"):
+            raise ValueError(f"Invalid match {match}. Use 'src' or 'dst'.")
+        classid = get_class_id(ip)
+        # the parent of a class cannot be changed, so the peer classes
+        # are always under the budget class
+        params = self._profile.class_params(rate, ceil)
+        self.add(
+            f"class replace dev {dev} parent {HTB_BUDGET_CLASS} "
+            f"classid {classid} htb {params}"
+        )
+        self._add_leaf(dev, classid)
+        self.add(
+            f"filter replace dev {dev} parent {HTB_ROOT_HANDLE} protocol ip "
+            f"prio 1 handle {get_filter_handle(ip)} u32 "
+            f"match ip {match} {ip}/32 flowid {classid}"
+        )
+
+    def set_default(self, dev: str, rate: Optional[str] = None):
+        """Shape the ip traffic of dev to hosts without a peer limit.
+        Non-ip traffic, e.g. arp, stays in the default class.
+        Args:
+            - dev (str) : device holding the htb tree
+            - rate (str, optional) : rate with unit, or BLOCKED to drop
+            the traffic. Default is None (not shaped).
+        """
+        # the peer filters own the first u32 table of the tree, so it is
+        # created first if no peer was added yet, which is a no-op
+        # otherwise
+        self.add(
+            f"filter add dev {dev} parent {HTB_ROOT_HANDLE} protocol ip "
+            "prio 1 u32"
+        )
+        flowid = HTB_DEFAULT_CLASS
+        if rate is not None:
+            flowid = HTB_OTHER_CLASS
+            # the blocked class never sends, its rate does not matter
+            params = self._profile.class_params(
+                "1kbit" if rate == BLOCKED else rate
+            )
+            self.add(
+                f"class replace dev {dev} parent {HTB_ROOT_HANDLE} "
+                f"classid {HTB_OTHER_CLASS} htb {params}"
+            )
+            if rate == BLOCKED:
+                # a fifo of length 0 drops every packet
+                self.add(
+                    f"qdisc replace dev {dev} parent {HTB_OTHER_CLASS} "
+                    "pfifo limit 0"
+                )
+            elif self._profile.fq_codel:
+                self._add_leaf(dev, HTB_OTHER_CLASS)
+            else:
+                self.add(
+                    f"qdisc replace dev {dev} parent {HTB_OTHER_CLASS} "
+                    f"pfifo limit {HTB_OTHER_QUEUE}"
+                )
+        self.add(
+            f"filter replace dev {dev} parent {HTB_ROOT_HANDLE} protocol ip "
+            f"prio 2 handle {HTB_OTHER_FILTER} u32 match u32 0 0 "
+            f"flowid {flowid}"
+        )
+
+    def _add_leaf(self, dev: str, classid: str):
+        """Attach the leaf qdisc of the profile to a class. Replacing
+        a leaf of the same kind only changes it, the queue is kept."""
+        if self._profile.fq_codel:
+            self.add(f"qdisc replace dev {dev} parent {classid} fq_codel")
+
+    def remove_peer_limit(self, dev: str, ip: str):
+        """Delete the filter and class of a peer added by `set_peer_limit`.
+        Args:
+            - dev (str) : device holding the htb tree
+            - ip (str) : peer ip address
+        """
+        self.add(
+            f"filter del dev {dev} parent {HTB_ROOT_HANDLE} protocol ip "
+            f"prio 1 handle {get_filter_handle(ip)} u32"
+        )
+        self.add(f"class del dev {dev} classid {get_class_id(ip)}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def exec_tc_batch(
+    batch: TCBatch,
+    run_with_sudo: Optional[bool] = None,
+    prefix: str = "",
+):
+    """Run a batch with one `tc -force -batch -` call.
+    Args:
+        - batch (TCBatch) : commands to run
+        - run_with_sudo (bool, optional) : run command with sudo.
+        - prefix (str, optional) : command prefix, e.g. "docker exec -i c1".
+        Default is "" (run tc on the host).
+
+    Raises:
+        - subprocess.CalledProcessError if any command failed. With -force
+        the remaining commands are still applied.
+    """
+    if not len(batch):
+        return
+    cmd = f"{prefix} tc -force -batch -".strip()
+    exec_cmd(cmd, run_with_sudo, bash=False, input=batch.render())
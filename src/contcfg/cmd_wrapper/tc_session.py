@@ -0,0 +1,214 @@
+import re
+import time
+import queue
+import shlex
+import threading
+import subprocess
+from collections.abc import Container
+from typing import TYPE_CHECKING, NamedTuple, Optional, Union
+
+from .base import get_cmd_timeout, get_priv_helper, kill_process_group
+from .exception import CommandTimeoutError, TCBatchError
+from .tc_batch import TCBatch
+
+if TYPE_CHECKING:
+    from .priv_helper import HelperProcess
+
+__all__ = ["TCSession"]
+
+# a device that never exists. `qdisc show` on it fails, and the failure
+# written to stderr after the commands of a batch acknowledges them.
+ACK_DEV = "contcfg-ack"
+
+_FAILED_RE = re.compile(r"^Command failed -:(\d+)$")
+# what tc reports when adding a qdisc or class that exists already
+_EXISTS_RE = re.compile(r"File exists|Exclusivity flag on")
+
+
+class _Pending(NamedTuple):
+    """A batch written to a session whose acknowledgement is awaited."""
+
+    lines: list[str]
+    first: int  # line number of the first command in the stream
+    ack: int  # line number of the acknowledgement
+    ignore: Container[int]
+    sent: float  # time.monotonic() before writing
+
+
+class TCSession:
+    """A long-lived `tc -force -batch -` process.
+    Batches are streamed into its stdin, so applying one costs a pipe
+    write instead of a new `docker exec`. tc reports a failed command as
+    "Command failed -:N" on stderr, N being the line number in the
+    stream. Each batch is followed by a command that always fails, whose
+    report tells that all the commands of the batch have been applied.
+    Batches of one session are serialized. A session whose process died
+    is not alive anymore and must be replaced. With a privileged helper
+    set, the process is started by the helper instead of sudo.
+    Args:
+        - prefix (str, optional) : command prefix, e.g. "docker exec -i c1".
+        Default is "" (run tc on the host).
+        - run_with_sudo (bool, optional) : run command with sudo.
+        Default is False.
+    """
+
+    def __init__(self, prefix: str = "", run_with_sudo: bool = False):
+        self.cmd = f"{prefix} tc -force -batch -".strip()
+        helper = get_priv_helper()
+        if run_with_sudo and helper is None:
+            self.cmd = f"sudo {self.cmd}"
+        # devices on which the htb tree is known to exist
+        self.htb_devs: set[str] = set()
+        # (time received, line) of stderr, None once closed
+        self._lines: queue.Queue[Optional[tuple[float, str]]] = queue.Queue()
+        self._line_no = 0  # lines written so far
+        self._lock = threading.Lock()
+        self._process: Union[subprocess.Popen, HelperProcess]
+        if helper is not None:
+            self._process = helper.spawn(shlex.split(self.cmd))
+        else:
+            # a new session, so that the docker client and the tc it
+            # started can be killed together
+            self._process = subprocess.Popen(
+                shlex.split(self.cmd),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                start_new_session=True,
+            )
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def run(
+        self,
+        batch: TCBatch,
+        timeout: Optional[float] = None,
+        ignore: Container[int] = (),
+    ):
+        """Apply a batch and wait until tc has processed it.
+        Args:
+            - batch (TCBatch) : commands to run
+            - timeout (float, optional) : timeout in seconds. Defaults to
+            the timeout set by `set_cmd_timeout`.
+            - ignore (Container[int], optional) : indexes of commands in
+            the batch that may fail because what they add exists already,
+            e.g. an htb root. Other failures of them are still raised.
+
+        Raises:
+            - TCBatchError if any command failed. The remaining commands
+            of the batch are still applied.
+            - subprocess.CalledProcessError if the process exited
+            - CommandTimeoutError if tc did not answer in time. The
+            process is killed.
+        """
+        if len(batch):
+            self.wait(self.send(batch, ignore), timeout)
+
+    def send(self, batch: TCBatch, ignore: Container[int] = ()) -> "_Pending":
+        """Write a batch without waiting for tc. The session is locked
+        until `wait` is called with the returned ticket, so that several
+        sessions can be fed before waiting for any of them.
+        See `run` for the arguments.
+        """
+        lines = list(batch)
+        self._lock.acquire()
+        first = self._line_no + 1
+        ack = first + len(lines)
+        self._line_no = ack
+        sent = time.monotonic()
+        try:
+            assert self._process.stdin is not None
+            self._process.stdin.write(
+                batch.render() + f"qdisc show dev {ACK_DEV}\n"
+            )
+            self._process.stdin.flush()
+        except (OSError, ValueError) as e:  # exited or closed
+            self.close()
+            self._lock.release()
+            raise subprocess.CalledProcessError(
+                self._process.returncode or 1, self.cmd
+            ) from e
+        return _Pending(lines, first, ack, ignore, sent)
+
+    def wait(
+        self, pending: "_Pending", timeout: Optional[float] = None
+    ) -> float:
+        """Wait until tc has processed a batch written by `send`, and
+        unlock the session. See `run` for the arguments and errors.
+
+        Returns:
+            - acked (float) : time.monotonic() when tc acknowledged the batch
+        """
+        try:
+            return self._wait(pending, timeout)
+        finally:
+            self._lock.release()
+
+    def _wait(self, pending: "_Pending", timeout: Optional[float]) -> float:
+        if timeout is None:
+            timeout = get_cmd_timeout()
+        lines, first, ack = pending.lines, pending.first, pending.ack
+        deadline = None if timeout is None else pending.sent + timeout
+        failed: list[str] = []
+        message: list[str] = []  # error lines of the next report
+        while True:
+            try:
+                wait = None
+                if deadline is not None:
+                    wait = max(deadline - time.monotonic(), 0)
+                item = self._lines.get(timeout=wait)
+            except queue.Empty:
+                kill_process_group(self._process)
+                self.close()
+                raise CommandTimeoutError(
+                    f"Command timed out after {timeout} seconds: "
+                    f"{self.cmd}"
+                )
+            if item is None:  # the process exited
+                self.close()
+                raise subprocess.CalledProcessError(
+                    self._process.returncode or 1,
+                    self.cmd,
+                    stderr="\n".join(message),
+                )
+            received, line = item
+            match = _FAILED_RE.match(line)
+            if match is None:
+                message.append(line)
+                continue
+            n = int(match.group(1))
+            if n == ack:
+                break
+            reason = " ".join(message) or "unknown error"
+            exists = n - first in pending.ignore and _EXISTS_RE.search(reason)
+            if first <= n < ack and not exists:
+                failed.append(f"{lines[n - first]} ({reason})")
+            message = []
+        if failed:
+            raise TCBatchError(self.cmd, failed)
+        return received
+
+    def close(self):
+        """Stop the process."""
+        if self._process.stdin is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+        if self._process.poll() is None:
+            try:
+                self._process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                kill_process_group(self._process)
+                self._process.wait()
+
+    def _read_stderr(self):
+        assert self._process.stderr is not None
+        for line in self._process.stderr:
+            self._lines.put((time.monotonic(), line.rstrip("\n")))
+        self._lines.put(None)
@@ -1,9 +1,14 @@
 from .base import check_scripts, get_script, singleton, exec_cmd
-from .tc_base import TC_BANDWIDTH_UNITS, split_raw_str_rate
-from .dockercmd_wrapper import DockerCmdWrapper
-from .exception import RateValueError
+from .tc_base import parse_class_stats, to_rate
+from .tc_batch import TCBatch, BLOCKED, IFB_DEV
+from .tc_session import TCSession
+from .runtime import get_runtime
 
-from typing import Union
+import time
+import threading
+import subprocess
+from typing import Optional, Union
+from collections.abc import Iterable
 
 
 @singleton
@@ -12,6 +17,13 @@ class TCCmdWrapper:
     limits between docker containers.
     This class is a singleton,
     so only one instance will be created.
+    The tc commands of a container are streamed into one long-lived
+    `docker exec -i <container> tc -force -batch -` session, opened on
+    first use and reopened if it dies. Containers are handled by the
+    runtime set with `set_runtime`.
+    The tree of a container shapes what it sends to each peer on eth0,
+    or with `set_ingress` what it receives from each peer, redirected to
+    an ifb device.
     Args:
         - run_with_sudo (bool, optional) : run all commands with sudo.
         Default is False.
@@ -21,6 +33,9 @@ class TCCmdWrapper:
         if not hasattr(self, "_initialized"):
             check_scripts()  # check if all scripts are present
             self._exec_script = get_script("docker_tcconfig.sh")
+            self._sessions: dict[str, TCSession] = {}
+            self._sessions_lock = threading.Lock()
+            self._ingress = False
             self._initialized = True
 
         self._run_with_sudo = run_with_sudo
@@ -31,33 +46,162 @@ class TCCmdWrapper:
         container2: str,
         bandwidth: Union[int, str],
         bandwidth_unit: str = "mbit",
+        egress: Optional[str] = None,
+        reverse: Optional[Union[int, str]] = None,
         _run_with_sudo: bool = False,
     ):
         """Set bandwidth limit between two containers.
         Args:
             - container1 (str) : container name or id
             - container2 (str) : container name or id
-            - bandwidth (int) : bandwidth limit
+            - bandwidth (int) : bandwidth limit from container1 to
+            container2
             - bandwidth_unit (str, optional) : bandwidth unit.
             Default is "mbit".
+            - egress (str, optional) : budget of the containers, the pair
+            may borrow up to it. Default is None (no budget).
+            - reverse (int, optional) : bandwidth limit from container2
+            to container1. Default is None (bandwidth).
             - _run_with_sudo (bool, optional) : run command with sudo.
             Default is None.
         """
-        if isinstance(bandwidth, str):
-            bandwidth, bandwidth_unit = split_raw_str_rate(bandwidth)
         run_with_sudo = self._run_with_sudo or _run_with_sudo
-        _check_container = DockerCmdWrapper(
-            run_with_sudo
-        ).check_container  # function call to check if container exists
-
-        _check_container(container1)
-        _check_container(container2)
-        self._check_bandwidth(bandwidth, bandwidth_unit)
-        cmd = (
-            f"{self._exec_script} {container1} {container2} "
-            + f"{bandwidth}{bandwidth_unit}"
+        rate = to_rate(bandwidth, bandwidth_unit)
+        reverse_rate = rate
+        if reverse is not None:
+            reverse_rate = to_rate(reverse, bandwidth_unit)
+        # the ips are cached, and resolving them fails for missing
+        # containers, so no `docker inspect` is needed
+        runtime = get_runtime(run_with_sudo)
+        ip1 = runtime.get_container_ip(container1)
+        ip2 = runtime.get_container_ip(container2)
+        # (container, peer ip, rate of container -> peer, of peer -> it)
+        sides = (
+            (container1, ip2, rate, reverse_rate),
+            (container2, ip1, reverse_rate, rate),
         )
-        exec_cmd(cmd, run_with_sudo)
+        for container, peer_ip, out_rate, in_rate in sides:
+            batch = TCBatch()
+            batch.set_budget(self.shaped_dev, egress)
+            batch.set_peer_limit(
+                self.shaped_dev,
+                peer_ip,
+                in_rate if self._ingress else out_rate,
+                self._match,
+                egress,
+            )
+            self._run_batch(container, batch, run_with_sudo)
+
+    def set_ingress(self, ingress: bool):
+        """Shape the traffic received by the containers rather than the
+        traffic they send. The traffic entering eth0 is redirected to an
+        ifb device holding the htb tree, with one filter. Containers whose
+        tree is already set up should be cleared first.
+        Args:
+            - ingress (bool) : shape the received traffic
+        """
+        self._ingress = ingress
+
+    @property
+    def shapes_ingress(self) -> bool:
+        """True if the tree of a container shapes what it receives from
+        its peers, False if it shapes what it sends to them."""
+        return self._ingress
+
+    @property
+    def shaped_dev(self) -> str:
+        """Device holding the htb tree inside the containers."""
+        return IFB_DEV if self._ingress else "eth0"
+
+    @property
+    def _match(self) -> str:
+        return "src" if self._ingress else "dst"
+
+    def prepare(self, container: str, _run_with_sudo: bool = False):
+        """Do the slow part of changing the limits of a container ahead:
+        resolve its ip, open its session and add the htb tree.
+        Args:
+            - container (str) : container name or id
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        get_runtime(run_with_sudo).get_container_ip(container)
+        self._run_batch(container, TCBatch(), run_with_sudo)
+
+    def limit_batch(
+        self,
+        container: str,
+        peers: Iterable[tuple[str, Union[int, str]]],
+        bandwidth_unit: str = "mbit",
+        egress: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ) -> TCBatch:
+        """Build the batch setting the limits between a container and its
+        peers, to be applied with `commit`. The peers must have been
+        prepared, so that their ips are cached.
+        Args:
+            - container (str) : container name or id
+            - peers (Iterable) : (peer, bandwidth) tuples, the bandwidth
+            of the traffic shaped by the container, see `shapes_ingress`
+            - bandwidth_unit (str, optional) : bandwidth unit used for
+            int bandwidths. Default is "mbit".
+            - egress (str, optional) : egress budget of the container.
+            Default is None (no budget).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        runtime = get_runtime(self._run_with_sudo or _run_with_sudo)
+        batch = TCBatch()
+        batch.set_budget(self.shaped_dev, egress)
+        for peer, bandwidth in peers:
+            peer_ip = runtime.get_container_ip(peer)
+            batch.set_peer_limit(
+                self.shaped_dev,
+                peer_ip,
+                to_rate(bandwidth, bandwidth_unit),
+                self._match,
+                egress,
+            )
+        return batch
+
+    def commit(
+        self, batches: dict[str, TCBatch], _run_with_sudo: bool = False
+    ) -> tuple[float, dict[str, Exception]]:
+        """Apply batches built by `limit_batch` as close together as
+        possible: every batch is written to its session before waiting
+        for any of them.
+        Args:
+            - batches (dict) : container -> batch
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+
+        Returns:
+            - skew (float) : seconds from the first write to the last
+            acknowledgement, all the changes landed in between
+            - failed (dict) : container -> error of the failed batches
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        failed: dict[str, Exception] = {}
+        pending = {}
+        start = time.monotonic()
+        last = start
+        # sessions are locked in order, so that commits cannot deadlock
+        for container in sorted(batches):
+            try:
+                session = self._session(container, run_with_sudo)
+                pending[container] = (
+                    session,
+                    session.send(batches[container]),
+                )
+            except Exception as e:
+                failed[container] = e
+        for container, (session, ticket) in pending.items():
+            try:
+                last = max(last, session.wait(ticket))
+            except Exception as e:
+                failed[container] = e
+        return last - start, failed
 
     def init_htb(self, container: str, _run_with_sudo: bool = False):
         """Initialize htb qdisc for container.
@@ -67,9 +211,8 @@ class TCCmdWrapper:
             Default is None.
         """
         run_with_sudo = self._run_with_sudo or _run_with_sudo
-        DockerCmdWrapper(run_with_sudo).check_container(container)
-        cmd = f"{self._exec_script} -init {container}"
-        exec_cmd(cmd, run_with_sudo)
+        get_runtime(run_with_sudo).check_container(container)
+        self._run_batch(container, TCBatch(), run_with_sudo)
 
     def clear_one_container(self, container: str, _run_with_sudo: bool = False):
         """Clear bandwidth limit for one container.
@@ -79,12 +222,159 @@ class TCCmdWrapper:
             Default is None.
         """
         run_with_sudo = self._run_with_sudo or _run_with_sudo
-        if DockerCmdWrapper(run_with_sudo).is_container_exist(container):
-            cmd = f"{self._exec_script} -c {container}"
-            exec_cmd(cmd, run_with_sudo)
-
-    def _check_bandwidth(self, bandwidth: int, bandwidth_unit: str):
-        if bandwidth_unit not in TC_BANDWIDTH_UNITS:
-            raise RateValueError(f"Invalid bandwidth unit {bandwidth_unit}")
-        if bandwidth < 0:
-            raise RateValueError(f"Invalid bandwidth {bandwidth}")
+        # the session assumes the htb tree exists, start over
+        self.close_session(container)
+        runtime = get_runtime(run_with_sudo)
+        if runtime.is_container_exist(container):
+            prefix = runtime.exec_prefix(container)
+            cmds = [f"{prefix} tc qdisc del dev eth0 root"]
+            if self._ingress:
+                cmds += [
+                    f"{prefix} tc qdisc del dev eth0 ingress",
+                    f"{prefix} ip link del {IFB_DEV}",
+                ]
+            for cmd in cmds:
+                try:
+                    exec_cmd(cmd, run_with_sudo, bash=False)
+                except subprocess.CalledProcessError:
+                    pass  # no tc rules in the container
+
+    def remove_peer(
+        self,
+        containers: Iterable[str],
+        peer_ip: str,
+        iface: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ):
+        """Remove the class and filter of a peer from containers.
+        The commands of each container are applied with one
+        batch on its session.
+        Args:
+            - containers (Iterable[str]) : container names or ids
+            - peer_ip (str) : ip address of the removed peer
+            - iface (str, optional) : interface inside the containers.
+            Default is None (shaped_dev).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        iface = iface or self.shaped_dev
+        for container in containers:
+            batch = TCBatch()
+            batch.remove_peer_limit(iface, peer_ip)
+            self._run_batch(container, batch, run_with_sudo, iface)
+
+    def set_default_class(
+        self,
+        containers: Iterable[str],
+        rate: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ):
+        """Shape the traffic of containers with hosts that are not their
+        peers, see `TCBatch.set_default`.
+        Args:
+            - containers (Iterable[str]) : container names or ids
+            - rate (str, optional) : rate with unit, or "blocked" to drop
+            that traffic. Default is None (not shaped).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        if rate is not None and rate != BLOCKED:
+            rate = to_rate(rate, "mbit")
+        for container in containers:
+            batch = TCBatch()
+            batch.set_default(self.shaped_dev, rate)
+            self._run_batch(container, batch, run_with_sudo)
+
+    def get_class_stats(
+        self,
+        container: str,
+        iface: Optional[str] = None,
+        _run_with_sudo: bool = False,
+    ) -> dict[str, tuple[int, int, int]]:
+        """Get the counters of the htb classes inside a container.
+        Args:
+            - container (str) : container name or id
+            - iface (str, optional) : interface inside the container.
+            Default is None (shaped_dev).
+            - _run_with_sudo (bool, optional) : run command with sudo.
+            Default is None.
+
+        Returns:
+            - stats (dict) : classid -> (bytes, packets, drops)
+        """
+        run_with_sudo = self._run_with_sudo or _run_with_sudo
+        prefix = get_runtime(run_with_sudo).exec_prefix(container)
+        cmd = f"{prefix} tc -s -j class show dev {iface or self.shaped_dev}"
+        output = exec_cmd(cmd, run_with_sudo, bash=False, stdout=True)
+        return parse_class_stats(output.stdout.decode())
+
+    def close_session(self, container: str):
+        """Close the tc session of a container, e.g. when it is removed."""
+        with self._sessions_lock:
+            session = self._sessions.pop(container, None)
+        if session is not None:
+            session.close()
+
+    def close_sessions(self):
+        """Close the tc sessions of all containers."""
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def _session(self, container: str, run_with_sudo: bool) -> TCSession:
+        with self._sessions_lock:
+            session = self._sessions.get(container)
+            if session is None or not session.alive:
+                session = TCSession(
+                    get_runtime(run_with_sudo).exec_prefix(container),
+                    run_with_sudo,
+                )
+                self._sessions[container] = session
+            return session
+
+    def _run_batch(
+        self,
+        container: str,
+        batch: TCBatch,
+        run_with_sudo: bool,
+        iface: Optional[str] = None,
+    ):
+        """Run a batch on the session of a container. The htb tree is
+        added first if the session has not seen it on iface yet, iface
+        defaults to shaped_dev."""
+        iface = iface or self.shaped_dev
+        session = self._session(container, run_with_sudo)
+        ignore = range(0)
+        if iface not in session.htb_devs:
+            init = TCBatch()
+            if iface == IFB_DEV:
+                self._add_ifb(container, run_with_sudo)
+                init.redirect_ingress("eth0", IFB_DEV)
+            init.init_htb(iface)
+            # adding the tree fails if it exists already, other errors
+            # are raised so that onboarding fails
+            ignore = range(len(init))
+            for line in batch:
+                init.add(line)
+            batch = init
+        session.run(batch, ignore=ignore)
+        session.htb_devs.add(iface)
+
+    def _add_ifb(self, container: str, run_with_sudo: bool):
+        """Add and bring up the ifb device of a container."""
+        prefix = get_runtime(run_with_sudo).exec_prefix(container)
+        try:
+            exec_cmd(
+                f"{prefix} ip link add {IFB_DEV} type ifb",
+                run_with_sudo,
+                bash=False,
+            )
+        except subprocess.CalledProcessError:
+            pass  # added by a previous session
+        exec_cmd(
+            f"{prefix} ip link set {IFB_DEV} up", run_with_sudo, bash=False
+        )
@@ -1,5 +1,37 @@
-from .msg import CtrlMsg, CtrlAction
-from .container_net_server import ConNetServer
-from .container_net_controller import ConNetController
+from typing import TYPE_CHECKING
 
-__all__ = ["CtrlMsg", "CtrlAction", "ConNetServer", "ConNetController"]
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+from .limit_log import LimitLog, LimitLogReader
+
+if TYPE_CHECKING:
+    from .container_net_server import ConNetServer
+    from .container_net_controller import ConNetController
+    from .async_controller import AsyncConNetController
+
+__all__ = [
+    "CtrlMsg",
+    "CtrlAction",
+    "CtrlReply",
+    "LimitLog",
+    "LimitLogReader",
+    "ConNetServer",
+    "ConNetController",
+    "AsyncConNetController",
+]
+
+# the server pulls in asyncio and the tc wrappers, so it is only
+# imported when used
+_LAZY_IMPORTS = {
+    "ConNetServer": ".container_net_server",
+    "ConNetController": ".container_net_controller",
+    "AsyncConNetController": ".async_controller",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_IMPORTS:
+        import importlib
+
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
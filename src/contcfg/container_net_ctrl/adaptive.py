@@ -0,0 +1,172 @@
+from typing import Optional
+
+from ..cmd_wrapper.tc_base import TC_UNIT_BITS, split_raw_str_rate
+
+__all__ = ["AdaptivePolicy", "MODES", "POLICIES", "max_min_share"]
+
+# "random" draws a new rate for every pair on each tick, "adaptive"
+# moves the rates of the pairs according to their measured throughput
+MODES = ("random", "adaptive")
+# "target" keeps the utilization of each pair around the target,
+# "fair" shares a per container budget max-min fairly among its peers
+POLICIES = ("target", "fair")
+
+Pair = tuple[str, str]
+
+
+def max_min_share(demands: dict[str, float], budget: float) -> dict[str, float]:
+    """Share a budget max-min fairly among demands (water filling).
+    Demands below the fair share get what they ask for, what they leave
+    is split evenly among the larger ones.
+    Args:
+        - demands (dict) : key -> demand
+        - budget (float) : total to share
+    """
+    share = {}
+    left = budget
+    pending = sorted(demands.items(), key=lambda kv: kv[1])
+    for i, (key, demand) in enumerate(pending):
+        share[key] = min(demand, left / (len(pending) - i))
+        left -= share[key]
+    return share
+
+
+class AdaptivePolicy:
+    """Closed loop rate policy of an adaptive shaping group.
+    Rates are computed from the throughput measured on each pair since
+    the previous tick. A pair asks for `throughput / target`, so a pair
+    running at its limit asks for more and an idle pair shrinks towards
+    the minimum rate. Only rates moving by more than the threshold are
+    returned, so a tick only touches the pairs whose load changed.
+    Args:
+        - policy (str, optional) : "target" or "fair". Default is "target".
+        - target (float, optional) : wanted utilization of a pair, in
+        (0, 1]. Default is 0.8.
+        - threshold (float, optional) : relative change under which a
+        rate is kept. Default is 0.1.
+        - budget (str, optional) : total rate of a container shared by
+        its peers with the "fair" policy, e.g. "500mbit". Default is None
+        (the maximum rate of the group).
+    """
+
+    def __init__(
+        self,
+        policy: str = "target",
+        target: float = 0.8,
+        threshold: float = 0.1,
+        budget: Optional[str] = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Invalid policy {policy}. Valid policies are {POLICIES}"
+            )
+        if not 0 < target <= 1:
+            raise ValueError(f"Invalid target utilization {target}")
+        if threshold < 0:
+            raise ValueError(f"Invalid threshold {threshold}")
+        self.policy = policy
+        self.target = target
+        self.threshold = threshold
+        self.budget = budget
+        # bits per second, validated now rather than on the first tick
+        self._budget_bits: Optional[int] = None
+        if budget is not None:
+            rate, unit = split_raw_str_rate(budget)
+            self._budget_bits = rate * TC_UNIT_BITS[unit]
+
+    def modified(self, payload: dict) -> "AdaptivePolicy":
+        """Get a copy updated from the "policy", "target", "threshold"
+        and "budget" keys of a group payload. Missing keys are kept."""
+        return AdaptivePolicy(
+            payload.get("policy", self.policy),
+            payload.get("target", self.target),
+            payload.get("threshold", self.threshold),
+            payload.get("budget", self.budget),
+        )
+
+    def plan(
+        self,
+        limits: dict[Pair, int],
+        usage: dict[Pair, float],
+        min_rate: int,
+        max_rate: int,
+        rate_unit: str,
+        directed: bool = False,
+    ) -> dict[Pair, int]:
+        """Compute the new rates of the pairs of a group.
+        Args:
+            - limits (dict) : (container1, container2) -> current rate
+            - usage (dict) : (container1, container2) -> measured
+            throughput in bits per second. Pairs without a measure keep
+            their rate.
+            - min_rate (int) : minimum rate
+            - max_rate (int) : maximum rate
+            - rate_unit (str) : unit of the rates
+            - directed (bool, optional) : pairs are directions, the rate
+            of (container1, container2) only shapes the traffic from
+            container1 to container2. Default is False.
+
+        Returns:
+            - rates (dict) : (container1, container2) -> new rate, only
+            for the pairs whose rate moves beyond the threshold
+        """
+        unit_bits = TC_UNIT_BITS[rate_unit]
+        demands = {
+            pair: usage[pair] / unit_bits / self.target
+            if pair in usage
+            else rate
+            for pair, rate in limits.items()
+        }
+        if self.policy == "fair":
+            demands = self._fair_rates(demands, max_rate, unit_bits, directed)
+        rates = {}
+        for pair, demand in demands.items():
+            rate = round(min(max(demand, min_rate), max_rate))
+            current = limits[pair]
+            if abs(rate - current) > self.threshold * current:
+                rates[pair] = rate
+        return rates
+
+    def _fair_rates(
+        self,
+        demands: dict[Pair, float],
+        max_rate: int,
+        unit_bits: int,
+        directed: bool = False,
+    ) -> dict[Pair, float]:
+        """Rate of each pair as the smaller of the max-min fair shares
+        granted by its two containers. Directed pairs share the sending
+        budget of container1 and the receiving budget of container2."""
+        budget: float = max_rate
+        if self._budget_bits is not None:
+            budget = self._budget_bits / unit_bits
+        sent: dict[str, dict[str, float]] = {}
+        received: dict[str, dict[str, float]] = {}
+        for (c1, c2), demand in demands.items():
+            sent.setdefault(c1, {})[c2] = demand
+            received.setdefault(c2, {})[c1] = demand
+            if not directed:
+                sent.setdefault(c2, {})[c1] = demand
+                received.setdefault(c1, {})[c2] = demand
+        out_shares = {
+            container: max_min_share(peers, budget)
+            for container, peers in sent.items()
+        }
+        in_shares = out_shares
+        if directed:
+            in_shares = {
+                container: max_min_share(peers, budget)
+                for container, peers in received.items()
+            }
+        return {
+            (c1, c2): min(out_shares[c1][c2], in_shares[c2][c1])
+            for c1, c2 in demands
+        }
+
+    def info(self) -> dict:
+        return {
+            "policy": self.policy,
+            "target": self.target,
+            "threshold": self.threshold,
+            "budget": self.budget,
+        }
@@ -0,0 +1,164 @@
+import os
+import struct
+import pickle
+import asyncio
+import logging
+import itertools
+from typing import Optional
+
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+
+__all__ = ["AsyncNetCtrlCommClient"]
+
+
+class AsyncNetCtrlCommClient:
+    """Asyncio client of the network control server.
+    One connection is kept open and shared by all requests. Requests are
+    written without waiting for the previous replies, and a reader task
+    matches each reply to its request by id. If the connection is lost,
+    the pending requests fail with ConnectionError and the next request
+    reconnects.
+    Args:
+        - socket_path (str) : path to the unix socket
+        - _conn_retry (int, optional) : connection attempts. Default is 5.
+        - _retry_interval (float, optional) : seconds between two
+        connection attempts. Default is 1.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        _conn_retry: int = 5,
+        _retry_interval: float = 1,
+    ):
+        self.socket_path = socket_path
+        self._conn_retry = _conn_retry
+        self._retry_interval = _retry_interval
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count(1)
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        """Connect to the server, if not connected yet."""
+        if self._closed:
+            raise ConnectionError("Client has been closed.")
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            if not os.path.exists(self.socket_path):
+                raise FileNotFoundError(
+                    f"Socket file not found: {self.socket_path}"
+                )
+            for attempt in range(self._conn_retry):
+                try:
+                    reader, writer = await asyncio.open_unix_connection(
+                        self.socket_path
+                    )
+                    break
+                except ConnectionRefusedError:
+                    if attempt + 1 == self._conn_retry:
+                        continue  # no retry left
+                    logging.info(
+                        "Connection refused. Retrying in "
+                        f"{self._retry_interval} seconds."
+                    )
+                    await asyncio.sleep(self._retry_interval)
+            else:
+                raise ConnectionRefusedError(
+                    f"Could not connect to {self.socket_path}"
+                )
+            self._reader, self._writer = reader, writer
+            self._reader_task = asyncio.create_task(self._read_replies(reader))
+
+    async def send(self, data: CtrlMsg):
+        """Send a message without waiting for a reply."""
+        await self.connect()
+        self._write(data)
+        assert self._writer is not None
+        await self._writer.drain()
+
+    def submit(self, data: CtrlMsg) -> "asyncio.Future[CtrlReply]":
+        """Send a message and return a future of its reply right away.
+        Many requests can be submitted before awaiting any of them.
+        """
+        return asyncio.ensure_future(self.request(data))
+
+    async def request(self, data: CtrlMsg) -> CtrlReply:
+        """Send a message and wait for the reply of the server."""
+        await self.connect()
+        data.request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[data.request_id] = future
+        try:
+            self._write(data)
+            assert self._writer is not None
+            await self._writer.drain()
+            return await future
+        finally:
+            self._pending.pop(data.request_id, None)
+
+    def _write(self, data: CtrlMsg):
+        if not self.connected:
+            raise ConnectionError("Connection is not established.")
+        serialized_data = pickle.dumps(data)
+        assert self._writer is not None
+        self._writer.write(struct.pack(">I", len(serialized_data)))
+        self._writer.write(serialized_data)
+
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        """Resolve pending requests with the replies of the server."""
+        error: Exception = ConnectionError("Connection closed by the server.")
+        try:
+            while True:
+                raw_msglen = await reader.readexactly(4)
+                msglen = struct.unpack(">I", raw_msglen)[0]
+                reply = pickle.loads(await reader.readexactly(msglen))
+                future = self._pending.get(reply.request_id)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except asyncio.IncompleteReadError:
+            pass
+        except (OSError, pickle.UnpicklingError) as e:
+            error = ConnectionError(f"Connection lost: {e}")
+        finally:
+            # the requests in flight may or may not have been handled,
+            # fail them and let the next request reconnect
+            if self._reader is reader:
+                if self._writer is not None:
+                    self._writer.close()
+                self._reader = self._writer = None
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(error)
+
+    async def stop_server(self):
+        """Stop the server and close the connection."""
+        await self.send(CtrlMsg(action=CtrlAction.STOP))
+        await self.stop()
+
+    async def stop(self):
+        """Close the connection."""
+        self._closed = True
+        writer, task = self._writer, self._reader_task
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
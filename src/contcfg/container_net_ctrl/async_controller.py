@@ -0,0 +1,214 @@
+import asyncio
+from typing import Optional
+
+from .async_comm_client import AsyncNetCtrlCommClient
+from .container_net_controller import _runtime, _group_payload
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+
+__all__ = ["AsyncConNetController"]
+
+
+class AsyncConNetController:
+    """Asyncio container network controller message sender.
+    The asyncio counterpart of ConNetController. All requests share one
+    persistent connection and are pipelined, so many of them can be in
+    flight at once, e.g. with `asyncio.gather`. Every method returns once
+    the server has handled the request, and raises RuntimeError if it
+    failed. The connection is reopened when lost.
+    Args:
+        - prefix (str, optional) : container name prefix.
+        - _socket_path (str, optional) : path to the Unix socket.
+        - _run_with_sudo (bool, optional) : run docker commands with sudo.
+        - _conn_retry (int, optional) : connection attempts. Default is 5.
+        - _runtime (str, optional) : runtime used to check and find
+        containers. Default is "docker".
+    """
+
+    def __init__(
+        self,
+        prefix: str = "",
+        *,
+        _socket_path: str = "/tmp/contcfg.sock",
+        _run_with_sudo: bool = False,
+        _conn_retry: int = 5,
+        _runtime: str = "docker",
+    ):
+        self._socket_path = _socket_path
+        self._runtime = _runtime
+        self._client = AsyncNetCtrlCommClient(
+            self._socket_path, _conn_retry=_conn_retry
+        )
+        self._run_with_sudo = _run_with_sudo
+        self._prefix = prefix
+        self._containers: set[str] = set()
+
+    async def __aenter__(self) -> "AsyncConNetController":
+        await self._client.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def add_container(
+        self, container: str, group: Optional[str] = None, check: bool = False
+    ):
+        """Add container to the network controller.
+        Args:
+            - container (str) : container name or id
+            - group (str, optional) : shaping group. Default is None
+            (the default group).
+            - check (bool, optional) : check that the container exists
+            before sending the request. The server skips missing
+            containers anyway. Default is False.
+        """
+        if container in self._containers:
+            raise ValueError(f"Container {container} already exists.")
+        if check:
+            runtime = _runtime(self._run_with_sudo, self._runtime)
+            await asyncio.get_running_loop().run_in_executor(
+                None, runtime.check_container, container
+            )
+        # added before the reply, so a concurrent duplicate is rejected
+        self._containers.add(container)
+        try:
+            await self._request(
+                CtrlMsg(CtrlAction.ADD_CONTAINER, container, group=group)
+            )
+        except BaseException:
+            self._containers.discard(container)
+            raise
+
+    async def del_container(self, container: str):
+        """Delete container from the network controller.
+        Args:
+            - container (str) : container name or id
+        """
+        if container not in self._containers:
+            raise ValueError(f"Container {container} not found.")
+        self._containers.discard(container)
+        await self._request(CtrlMsg(CtrlAction.DEL_CONTAINER, container))
+
+    async def find_all_containers(self, prefix: str = "") -> list[str]:
+        """Find all containers with given prefix."""
+        prefix = prefix if prefix else self._prefix
+        if not prefix:
+            raise ValueError("Prefix is not set.")
+        runtime = _runtime(self._run_with_sudo, self._runtime)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, runtime.get_container, prefix
+        )
+
+    async def add_all_containers(
+        self, prefix: str = "", group: Optional[str] = None
+    ):
+        """Add all containers with given prefix, in one pipelined burst."""
+        containers = await self.find_all_containers(prefix)
+        await asyncio.gather(
+            *(
+                self.add_container(container, group)
+                for container in containers
+                if container not in self._containers
+            )
+        )
+
+    async def create_group(
+        self,
+        name: str,
+        min_rate: str,
+        max_rate: str,
+        interval: float,
+        interval_unit: str = "min",
+        **options,
+    ):
+        """Create a shaping group. See ConNetController.create_group."""
+        payload = _group_payload(
+            min_rate, max_rate, interval, interval_unit, **options
+        )
+        await self._request(
+            CtrlMsg(CtrlAction.CREATE_GROUP, group=name, payload=payload)
+        )
+
+    async def modify_group(
+        self,
+        name: str,
+        min_rate: Optional[str] = None,
+        max_rate: Optional[str] = None,
+        interval: Optional[float] = None,
+        interval_unit: str = "min",
+        **options,
+    ):
+        """Change a shaping group. See ConNetController.modify_group."""
+        payload = _group_payload(
+            min_rate, max_rate, interval, interval_unit, **options
+        )
+        await self._request(
+            CtrlMsg(CtrlAction.MODIFY_GROUP, group=name, payload=payload)
+        )
+
+    async def destroy_group(self, name: str):
+        """Remove a shaping group and clear the rules of its containers."""
+        await self._request(CtrlMsg(CtrlAction.DESTROY_GROUP, group=name))
+
+    async def list_groups(self) -> dict:
+        """Get the config and containers of all shaping groups."""
+        reply = await self._request(CtrlMsg(CtrlAction.LIST_GROUPS))
+        return reply.result
+
+    async def get_stats(self, container: Optional[str] = None, last: int = 0):
+        """Get the sampled traffic counters of container pairs.
+        See ConNetController.get_stats.
+        """
+        payload = {"container": container, "last": last or None}
+        reply = await self._request(
+            CtrlMsg(CtrlAction.GET_STATS, payload=payload)
+        )
+        return reply.result
+
+    async def set_bandwidth(
+        self,
+        container1: str,
+        container2: str,
+        rate: str,
+        reverse: Optional[str] = None,
+    ):
+        """Set the bandwidth limit between two containers right away.
+        Args:
+            - container1 (str) : container name or id
+            - container2 (str) : container name or id
+            - rate (str) : rate with unit, e.g. "100mbit", from container1
+            to container2
+            - reverse (str, optional) : rate from container2 to
+            container1. Default is None (rate).
+        """
+        await self._request(
+            CtrlMsg(
+                CtrlAction.SET_LIMIT,
+                container1,
+                payload={
+                    "peer": container2,
+                    "rate": rate,
+                    "reverse": reverse,
+                },
+            )
+        )
+
+    async def clear_container(self, container: str):
+        """Clear the tc rules of a container through the server.
+        Args:
+            - container (str) : container name or id
+        """
+        await self._request(CtrlMsg(CtrlAction.CLEAR_LIMIT, container))
+
+    async def _request(self, msg: CtrlMsg) -> CtrlReply:
+        reply = await self._client.request(msg)
+        if not reply.ok:
+            raise RuntimeError(f"{msg.action.name} failed: {reply.error}")
+        return reply
+
+    async def stop_server(self):
+        """Stop the server."""
+        await self._client.stop_server()
+
+    async def stop(self):
+        """Stop the client."""
+        await self._client.stop()
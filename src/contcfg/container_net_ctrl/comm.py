@@ -2,14 +2,16 @@ import socket
 import os
 import struct
 import pickle
-import time
 import fcntl
 import errno
 import asyncio
 from asyncio import Queue
 from typing import Optional
 
-from .msg import CtrlMsg, CtrlAction
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+from .comm_client import NetCtrlCommClient
+
+__all__ = ["NetCtrlCommServer", "NetCtrlCommClient"]
 
 
 class NetCtrlCommServer:
@@ -27,6 +29,10 @@ class NetCtrlCommServer:
         self._check_path()
         self._server: Optional[asyncio.AbstractServer] = None
         self._stop_event = asyncio.Event()
+        # set once the socket is bound and clients can connect
+        self.bound = asyncio.Event()
+        # handler task -> reader and writer of each connected client
+        self._clients: dict[asyncio.Task, tuple] = {}
 
     async def start(self, q: Queue):
         """Start the server. This method will start the server
@@ -47,6 +53,7 @@ class NetCtrlCommServer:
                 ) from e
             else:
                 raise
+        self.bound.set()
         try:
             serve_task = asyncio.create_task(self._server.serve_forever())
             await self._stop_event.wait()  # stop event
@@ -107,6 +114,10 @@ class NetCtrlCommServer:
 
     async def _handle_client(self, reader, writer, q: Queue):
         """Handle the client connection."""
+        replies: set[asyncio.Task] = set()
+        handler = asyncio.current_task()
+        assert handler is not None
+        self._clients[handler] = (reader, writer)
         try:
             while True:
                 raw_msglen = await self._recvall(reader, 4)
@@ -117,16 +128,41 @@ class NetCtrlCommServer:
                 if not data:
                     break
                 data_obj = pickle.loads(data)
+                if data_obj.request_id is not None:
+                    # the reply is sent once the message has been handled,
+                    # without blocking the next messages of the client
+                    reply = asyncio.get_running_loop().create_future()
+                    data_obj.reply = reply
+                    task = asyncio.create_task(
+                        self._send_reply(writer, data_obj.request_id, reply)
+                    )
+                    replies.add(task)
+                    task.add_done_callback(replies.discard)
                 # put the data in the queue
                 await q.put(data_obj)
                 if data_obj.action == CtrlAction.STOP:
                     asyncio.create_task(self._initiate_stop())
                     break
         finally:
-            # close the writer
+            # wait for pending replies, then close the writer
+            if replies:
+                await asyncio.gather(*replies, return_exceptions=True)
+            del self._clients[handler]
             writer.close()
             await writer.wait_closed()
 
+    async def _send_reply(
+        self, writer, request_id: int, future: asyncio.Future
+    ):
+        """Wait for the reply of a message and send it to the client."""
+        try:
+            reply = await future
+        except asyncio.CancelledError:
+            reply = CtrlReply(request_id, ok=False, error="Cancelled")
+        serialized_data = pickle.dumps(reply)
+        writer.write(struct.pack(">I", len(serialized_data)) + serialized_data)
+        await writer.drain()
+
     async def _initiate_stop(self):
         """Initiate the stop event."""
 
@@ -136,67 +172,20 @@ class NetCtrlCommServer:
         """Stop the server."""
         if self._server:
             self._server.close()
+        # let the handlers of the connected clients end on their own, once
+        # their pending replies are sent, rather than being cancelled
+        # with the loop. They are done before wait_closed, which waits
+        # for the connections to close since Python 3.12.
+        for reader, writer in self._clients.values():
+            writer.transport.pause_reading()
+            reader.feed_eof()
+        if self._clients:
+            await asyncio.wait(list(self._clients))
+        if self._server:
             await self._server.wait_closed()
+            self._server = None
+        if self._lock_file is not None:
+            # another server may use the socket path now
+            self._lock_file.close()
+            self._lock_file = None
         self._stop_event.set()
-
-
-class NetCtrlCommClient:
-    def __init__(
-        self, socket_path: str, _conn_retry: int = 5, _retry_interval: int = 1
-    ):
-        self.socket_path = socket_path
-        self.conn: Optional[socket.socket] = None
-        self._conn_retry = _conn_retry
-        self._retry_interval = _retry_interval
-        self._connected = False
-        self._connect()
-
-    def _connect(self):
-        self._check_path()
-        for _ in range(self._conn_retry):
-            try:
-                self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                self.conn.connect(self.socket_path)
-                break
-            except ConnectionRefusedError:
-                print(
-                    f"Connection refused. Retrying \
-                    in {self._retry_interval} seconds."
-                )
-                time.sleep(self._retry_interval)
-        else:
-            raise ConnectionRefusedError(
-                f"Cound not connect to {self.socket_path}"
-            )
-        self._connected = True
-
-    def send(self, data: CtrlMsg):
-        """Send data to the server."""
-        if not self._connected:
-            raise ConnectionError("Connection has been closed.")
-
-        serialized_data = pickle.dumps(data)
-        data_len = struct.pack(">I", len(serialized_data))
-        if self.conn is not None:
-            self.conn.sendall(data_len + serialized_data)
-        else:
-            raise ConnectionError("Connection is not established.")
-
-    def stop_server(self):
-        """Stop the server. This method will send a stop message
-        to the server and close the connection.
-        """
-        self.send(CtrlMsg(action=CtrlAction.STOP))  # send stop message
-        self.stop()
-
-    def stop(self):
-        """Stop the client."""
-        self.conn.close()
-        self._connected = False
-
-    def _check_path(self):
-        """Check if the socket path exists, and remove it if it does."""
-        if not os.path.exists(self.socket_path):
-            raise FileNotFoundError(
-                f"Socket file not found: {self.socket_path}"
-            )
@@ -0,0 +1,100 @@
+import socket
+import os
+import struct
+import pickle
+import time
+from typing import Optional
+
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+
+
+class NetCtrlCommClient:
+    def __init__(
+        self, socket_path: str, _conn_retry: int = 5, _retry_interval: int = 1
+    ):
+        self.socket_path = socket_path
+        self.conn: Optional[socket.socket] = None
+        self._conn_retry = _conn_retry
+        self._retry_interval = _retry_interval
+        self._connected = False
+        self._request_id = 0
+        self._connect()
+
+    def _connect(self):
+        self._check_path()
+        for attempt in range(self._conn_retry):
+            try:
+                self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.conn.connect(self.socket_path)
+                break
+            except ConnectionRefusedError:
+                if attempt + 1 == self._conn_retry:
+                    continue  # no retry left
+                print(
+                    f"Connection refused. Retrying \
+                    in {self._retry_interval} seconds."
+                )
+                time.sleep(self._retry_interval)
+        else:
+            raise ConnectionRefusedError(
+                f"Cound not connect to {self.socket_path}"
+            )
+        self._connected = True
+
+    def send(self, data: CtrlMsg):
+        """Send data to the server."""
+        if not self._connected:
+            raise ConnectionError("Connection has been closed.")
+
+        serialized_data = pickle.dumps(data)
+        data_len = struct.pack(">I", len(serialized_data))
+        if self.conn is not None:
+            self.conn.sendall(data_len + serialized_data)
+        else:
+            raise ConnectionError("Connection is not established.")
+
+    def request(self, data: CtrlMsg) -> CtrlReply:
+        """Send a message and wait for the reply of the server."""
+        self._request_id += 1
+        data.request_id = self._request_id
+        self.send(data)
+        raw_msglen = self._recvall(4)
+        msglen = struct.unpack(">I", raw_msglen)[0]
+        reply = pickle.loads(self._recvall(msglen))
+        if reply.request_id != data.request_id:
+            raise ConnectionError(
+                f"Unexpected reply {reply.request_id} "
+                f"to request {data.request_id}."
+            )
+        return reply
+
+    def _recvall(self, n: int) -> bytes:
+        """Receive n bytes from the connection."""
+        if self.conn is None:
+            raise ConnectionError("Connection is not established.")
+        data = bytearray()
+        while len(data) < n:
+            packet = self.conn.recv(n - len(data))
+            if not packet:
+                raise ConnectionError("Connection closed by the server.")
+            data.extend(packet)
+        return bytes(data)
+
+    def stop_server(self):
+        """Stop the server. This method will send a stop message
+        to the server and close the connection.
+        """
+        self.send(CtrlMsg(action=CtrlAction.STOP))  # send stop message
+        self.stop()
+
+    def stop(self):
+        """Stop the client."""
+        self.conn.close()
+        self._connected = False
+
+    def _check_path(self):
+        """Check if the socket path exists, and remove it if it does."""
+        if not os.path.exists(self.socket_path):
+            raise FileNotFoundError(
+                f"Socket file not found: {self.socket_path}"
+            )
@@ -1,6 +1,36 @@
-from .comm import NetCtrlCommClient
-from .msg import CtrlMsg, CtrlAction
-from ..cmd_wrapper import DockerCmdWrapper
+from typing import Optional
+
+from .comm_client import NetCtrlCommClient
+from .msg import CtrlMsg, CtrlAction, CtrlReply
+
+
+def _runtime(run_with_sudo: bool, runtime: str):
+    # imported on use, sending messages does not need the tc wrappers
+    from ..cmd_wrapper import get_runtime
+
+    return get_runtime(run_with_sudo, runtime)
+
+
+def _group_payload(
+    min_rate: Optional[str],
+    max_rate: Optional[str],
+    interval: Optional[float],
+    interval_unit: str,
+    **options,
+) -> dict:
+    """Build the payload of a CREATE_GROUP or MODIFY_GROUP message.
+    options are the update keys, e.g. "mode", see ShapingGroup.modify."""
+    payload: dict = {
+        key: value for key, value in options.items() if value is not None
+    }
+    if min_rate is not None:
+        payload["min_rate"] = min_rate
+    if max_rate is not None:
+        payload["max_rate"] = max_rate
+    if interval is not None:
+        payload["interval"] = interval
+        payload["interval_unit"] = interval_unit
+    return payload
 
 
 class ConNetController:
@@ -9,6 +39,8 @@ class ConNetController:
     to the network controller.
     Args:
         - socket_path (str) : path to the unix socket
+        - _runtime (str, optional) : runtime used to check and find
+        containers. Default is "docker".
     """
 
     def __init__(
@@ -17,25 +49,36 @@ class ConNetController:
         *,
         _socket_path: str = "/tmp/contcfg.sock",
         _run_with_sudo: bool = False,
+        _conn_retry: int = 5,
+        _runtime: str = "docker",
     ):
         self._socket_path = _socket_path
-        self._client = NetCtrlCommClient(self._socket_path)
+        self._runtime = _runtime
+        self._client = NetCtrlCommClient(
+            self._socket_path, _conn_retry=_conn_retry
+        )
         self._run_with_sudo = _run_with_sudo
         self._prefix = prefix
         self._containers: list[str] = []
 
-    def add_container(self, container: str):
+    def add_container(self, container: str, group: Optional[str] = None):
         """Add container to the network controller.
         Args:
             - container (str) : container name or id
+            - group (str, optional) : shaping group. Default is None
+            (the default group).
         """
         if container in self._containers:
             raise ValueError(f"Container {container} already exists.")
         try:
-            DockerCmdWrapper(self._run_with_sudo).check_container(container)
+            _runtime(self._run_with_sudo, self._runtime).check_container(
+                container
+            )
         except Exception as e:
             raise e
-        self._client.send(CtrlMsg(CtrlAction.ADD_CONTAINER, container))
+        self._client.send(
+            CtrlMsg(CtrlAction.ADD_CONTAINER, container, group=group)
+        )
         self._containers.append(container)
 
     def del_container(self, container: str):
@@ -54,15 +97,153 @@ class ConNetController:
         if not prefix:
             raise ValueError("Prefix is not set.")
 
-        containers = DockerCmdWrapper(self._run_with_sudo).get_container(prefix)
+        containers = _runtime(
+            self._run_with_sudo, self._runtime
+        ).get_container(prefix)
         return containers
 
-    def add_all_containers(self, prefix: str):
+    def add_all_containers(self, prefix: str, group: Optional[str] = None):
         """Add all containers with given prefix."""
         containers = self.find_all_containers(prefix)
         for container in containers:
             if container not in self._containers:
-                self.add_container(container)
+                self.add_container(container, group)
+
+    def create_group(
+        self,
+        name: str,
+        min_rate: str,
+        max_rate: str,
+        interval: float,
+        interval_unit: str = "min",
+        **options,
+    ):
+        """Create a shaping group on the server.
+        Args:
+            - name (str) : group name
+            - min_rate (str) : minimum rate with unit, e.g. "10mbit"
+            - max_rate (str) : maximum rate with the same unit
+            - interval (float) : interval between two updates
+            - interval_unit (str, optional) : "s", "min" or "h".
+            Default is "min".
+        Kwargs:
+            - mode (str, optional) : "random" or "adaptive".
+            Default is "random".
+            - policy (str, optional) : "target" or "fair".
+            - target (float, optional) : utilization kept by the
+            adaptive mode.
+            - threshold (float, optional) : relative rate change under
+            which a pair is left alone.
+            - budget (str, optional) : per container rate shared by the
+            "fair" policy, e.g. "1gbit".
+            - fraction (float, optional) : share of the pairs updated on
+            each random tick, in turn.
+            - pace (bool, optional) : spread the updates of a tick over
+            the interval.
+            - sync (bool, optional) : prepare the updates of a tick, then
+            apply them all together.
+            - egress (str, optional) : rate shared by the peer classes of
+            each container, pairs borrow up to it, e.g. "1gbit".
+            - asymmetric (bool, optional) : draw or adapt the two
+            directions of a pair separately.
+            - edges (list, optional) : (container1, container2) pairs
+            shaped by the group, "all" for all pairs. See load_edges.
+            - default_rate (str, optional) : rate of the traffic outside
+            the edges, or "blocked" to drop it.
+        """
+        payload = _group_payload(
+            min_rate, max_rate, interval, interval_unit, **options
+        )
+        self._request(
+            CtrlMsg(CtrlAction.CREATE_GROUP, group=name, payload=payload)
+        )
+
+    def modify_group(
+        self,
+        name: str,
+        min_rate: Optional[str] = None,
+        max_rate: Optional[str] = None,
+        interval: Optional[float] = None,
+        interval_unit: str = "min",
+        **options,
+    ):
+        """Change the rate range, interval or mode of a shaping group.
+        Arguments left to None are kept, see create_group.
+        """
+        payload = _group_payload(
+            min_rate, max_rate, interval, interval_unit, **options
+        )
+        self._request(
+            CtrlMsg(CtrlAction.MODIFY_GROUP, group=name, payload=payload)
+        )
+
+    def destroy_group(self, name: str):
+        """Remove a shaping group and clear the rules of its containers.
+        Args:
+            - name (str) : group name
+        """
+        self._request(CtrlMsg(CtrlAction.DESTROY_GROUP, group=name))
+
+    def list_groups(self) -> dict:
+        """Get the config and containers of all shaping groups."""
+        return self._request(CtrlMsg(CtrlAction.LIST_GROUPS)).result
+
+    def get_stats(self, container: Optional[str] = None, last: int = 0):
+        """Get the sampled traffic counters of container pairs.
+        Args:
+            - container (str, optional) : only pairs involving container.
+            - last (int, optional) : only the newest `last` samples per pair.
+            Default is 0 (all samples kept by the server).
+
+        Returns:
+            - stats (dict) : (src, dst) -> list of
+            (timestamp, bytes, packets, drops) samples
+        """
+        payload = {"container": container, "last": last or None}
+        reply = self._request(CtrlMsg(CtrlAction.GET_STATS, payload=payload))
+        return reply.result
+
+    def set_bandwidth(
+        self,
+        container1: str,
+        container2: str,
+        rate: str,
+        reverse: Optional[str] = None,
+    ):
+        """Set the bandwidth limit between two containers through the
+        server, which applies it right away with its own tc backend.
+        Args:
+            - container1 (str) : container name or id
+            - container2 (str) : container name or id
+            - rate (str) : rate with unit, e.g. "100mbit", from container1
+            to container2
+            - reverse (str, optional) : rate from container2 to
+            container1. Default is None (rate).
+        """
+        self._request(
+            CtrlMsg(
+                CtrlAction.SET_LIMIT,
+                container1,
+                payload={
+                    "peer": container2,
+                    "rate": rate,
+                    "reverse": reverse,
+                },
+            )
+        )
+
+    def clear_container(self, container: str):
+        """Clear the tc rules of a container through the server.
+        Args:
+            - container (str) : container name or id
+        """
+        self._request(CtrlMsg(CtrlAction.CLEAR_LIMIT, container))
+
+    def _request(self, msg: CtrlMsg) -> CtrlReply:
+        reply = self._client.request(msg)
+        if not reply.ok:
+            raise RuntimeError(f"{msg.action.name} failed: {reply.error}")
+        return reply
 
     def stop_server(self):
         """Stop the server."""
@@ -1,6 +1,8 @@
-import random
+import os
+import math
+import itertools
+import time
 import asyncio
-from asyncio import Queue
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
@@ -8,20 +10,57 @@ from typing import Optional
 
 from ..cmd_wrapper import (
     TCCmdWrapper,
-    DockerCmdWrapper,
+    HostTCCmdWrapper,
     RateValueError,
     ContainerNotFoundError,
+    set_cmd_timeout,
+    set_priv_helper,
+    set_runtime,
+    set_htb_profile,
+    HTBProfile,
+    get_runtime,
+    RUNTIMES,
 )
-from .msg import CtrlMsg, CtrlAction
+from ..cmd_wrapper.tc_batch import get_class_id
+from ..cmd_wrapper.tc_base import convert_rate, split_raw_str_rate
+from .msg import CtrlMsg, CtrlAction, CtrlReply
 from .comm import NetCtrlCommServer
+from .stats import TrafficStats
+from .limit_store import LimitMatrix
+from .limit_log import LimitLog
+from .ctrl_queue import CtrlQueue
+from .group import ShapingGroup, DEFAULT_GROUP, interval_to_sec, load_edges
+from .resilience import RetryPolicy, CircuitBreaker, TRANSIENT_ERRORS
+from .pipeline import CtrlPipeline, container_key, pair_key
+from .pacing import TokenBucket, PACE_SPAN
 
 __all__ = ["ConNetServer"]
 
-logging.basicConfig(
-    level=logging.INFO, format="[%(asctime)s][%(levelname)s]%(message)s"
+# "exec" runs tc inside the containers with docker exec,
+# "host" shapes the host side veth of the containers.
+BACKENDS = ("exec", "host")
+
+# kwargs configuring the updates of the default group
+GROUP_KEYS = (
+    "mode",
+    "policy",
+    "target",
+    "threshold",
+    "budget",
+    "fraction",
+    "pace",
+    "sync",
+    "egress",
+    "asymmetric",
+    "edges",
+    "default_rate",
 )
 
 
+# (container1, container2, rate from container1 to container2, reverse rate)
+Limit = tuple[str, str, int, int]
+
+
 def all_pairs_iter(lst: list, paticular=None):
     """Generate all pairs from a list. If paticular is given,
     generate pairs including paticular."""
@@ -39,6 +78,14 @@ class ConNetServer:
     """Container network controller class.
     This class is used to control network bandwidth
     between docker containers.
+    Containers are shaped in named groups, each with its own rate range,
+    interval and members, sharing the executor, caches and scheduler of
+    the server. The arguments configure the default group, more groups
+    can be created over the control socket.
+    `start()` runs the server on its own event loop. To embed it in an
+    asyncio application, await `serve()` or use `async with`, then call
+    `add_container`, `del_container`, `set_bandwidth` and `stop`
+    directly, without the socket.
     Args:
         - min_rate (int) : minimum rate in mbit
         - max_rate (int) : maximum rate in mbit
@@ -49,7 +96,68 @@ class ConNetServer:
     Kwargs:
         - rate_unit (str, optional) : rate unit. Default is "mbit".
         - interval_unit (str, optional) : interval unit. Default is "min".
-        Default is None.
+        - backend (str, optional) : "exec" or "host". Default is "exec".
+        - runtime (str, optional) : "docker", "podman" or "netns".
+        Default is "docker".
+        - mode (str, optional) : "random" or "adaptive", mode of the
+        default group. Default is "random".
+        - policy (str, optional) : "target" or "fair", policy of the
+        adaptive mode. Default is "target".
+        - target (float, optional) : utilization kept by the adaptive
+        mode. Default is 0.8.
+        - threshold (float, optional) : relative rate change under which
+        the adaptive mode leaves a pair alone. Default is 0.1.
+        - budget (str, optional) : per container rate shared by the
+        "fair" policy, e.g. "1gbit". Default is max_rate.
+        - fraction (float, optional) : share of the pairs of the default
+        group re-randomized on each tick, in turn. Default is 1.
+        - pace (bool, optional) : spread the updates of a tick over the
+        interval with a token bucket. Default is False.
+        - sync (bool, optional) : prepare the updates of a tick first,
+        then apply them all together. Default is False.
+        - egress (str, optional) : rate shared by the peer classes of each
+        container of the default group, a pair may borrow beyond its
+        limit up to it. Default is None (no budget).
+        - topology (str, optional) : edge list file of the default group,
+        see load_edges. Only those pairs are shaped. Default is None (all
+        pairs).
+        - edges (list, optional) : the edges of the default group as
+        (container1, container2) pairs, instead of a file.
+        - default_rate (str, optional) : rate of the traffic outside the
+        edges, or "blocked" to drop it. Default is None (not shaped).
+        - asymmetric (bool, optional) : draw or adapt the two directions
+        of a pair separately. Default is False.
+        - stats_interval (float, optional) : seconds between two samples
+        of the htb class counters. Default is 0 (disabled).
+        - stats_capacity (int, optional) : samples kept per container pair.
+        Default is 360.
+        - cmd_timeout (float, optional) : seconds before a docker or tc
+        command is killed. Default is 30.
+        - mtu (int, optional) : MTU of the shaped interfaces, used to size
+        the htb bursts and quantums. Default is 1500.
+        - hz (int, optional) : kernel tick rate used to size the htb
+        bursts. Default is CONFIG_HZ of the running kernel.
+        - fq_codel (bool, optional) : attach fq_codel to the htb classes.
+        Default is False.
+        - limit_log (str, optional) : path of a binary log of every rate
+        applied, read with LimitLogReader. Default is None (no log).
+        - ingress (bool, optional) : with the exec backend, shape the
+        traffic received by the containers, redirected to an ifb device,
+        rather than the traffic they send. Default is False.
+        - helper_socket (str, optional) : socket of a PrivHelper running
+        all the commands as root, so the server needs neither root nor
+        sudo. Default is None (run the commands directly).
+        - workers (int, optional) : threads running docker and tc
+        commands, also the pairs of a round in flight at once.
+        Default is min(32, cpu count + 4).
+        - max_retries (int, optional) : retries of a failed command.
+        Default is 2.
+        - retry_backoff (float, optional) : delay before the first retry
+        in seconds. Default is 0.5.
+        - breaker_threshold (int, optional) : consecutive failures after
+        which a container is skipped. Default is 3.
+        - breaker_cooldown (float, optional) : seconds a failing container
+        is skipped. Default is 60.
         - _run_with_sudo (bool, optional) : run all commands with sudo.
         Default is False.
     """
@@ -69,34 +177,101 @@ class ConNetServer:
         self.max_rate = max_rate
         self.rate_unit = kwargs.get("rate_unit", "mbit")
         self.interval_unit = kwargs.get("interval_unit", "min")
+        self.backend = kwargs.get("backend", "exec")
+        if self.backend not in BACKENDS:
+            raise ValueError(
+                f"Invalid backend {self.backend}. Valid backends are {BACKENDS}"
+            )
+        self.ingress = kwargs.get("ingress", False)
+        if self.ingress and self.backend != "exec":
+            raise ValueError("ingress shaping needs the exec backend")
+        self.runtime = kwargs.get("runtime", "docker")
+        if self.runtime not in RUNTIMES:
+            raise ValueError(
+                f"Invalid runtime {self.runtime}. Valid runtimes are {RUNTIMES}"
+            )
+        self.stats_interval = kwargs.get("stats_interval", 0)
+        self.cmd_timeout = kwargs.get("cmd_timeout", 30)
+        self.helper_socket = kwargs.get("helper_socket")
+        self.htb_profile = HTBProfile(
+            kwargs.get("mtu", 1500),
+            kwargs.get("hz"),
+            kwargs.get("fq_codel", False),
+        )
+        # the default of ThreadPoolExecutor
+        self.workers = kwargs.get("workers", min(32, (os.cpu_count() or 1) + 4))
         self.prefix = prefix
         self._run_with_sudo = _run_with_sudo
-        # convert interval to seconds
-        if self.interval_unit.startswith("s"):
-            self.interval_sec = interval
-        elif self.interval_unit.startswith("m"):
-            self.interval_sec = interval * 60
-        elif self.interval_unit.startswith("h"):
-            self.interval_sec = interval * 3600
-
-        self._container_list: list[str] = []
-        self._msg_queue: Queue = asyncio.Queue()
+        self.interval_sec = interval_to_sec(interval, self.interval_unit)
+
+        self._groups = {
+            DEFAULT_GROUP: ShapingGroup(
+                DEFAULT_GROUP,
+                min_rate,
+                max_rate,
+                self.interval_sec,
+                self.rate_unit,
+            )
+        }
+        options = {key: kwargs[key] for key in GROUP_KEYS if key in kwargs}
+        if kwargs.get("topology"):
+            options["edges"] = load_edges(kwargs["topology"])
+        self._groups[DEFAULT_GROUP].modify(options)
+        # container -> name of its group
+        self._group_of: dict[str, str] = {}
+        # members whose htb tree is initialized, the only ones shaped,
+        # and the members being onboarded
+        self._ready: set[str] = set()
+        self._onboarding: set[str] = set()
+        # containers of all groups and the bandwidth limits between
+        # them, in rate_unit
+        self.limit_log = kwargs.get("limit_log")
+        self._limits = LimitMatrix(
+            log=LimitLog(self.limit_log, self.rate_unit)
+            if self.limit_log
+            else None
+        )
+        self._pipeline = CtrlPipeline()
         self._is_running = False
-        self._limit_dict: dict[tuple[str, str], int] = {}
-        self._stop_event = asyncio.Event()
-        self._loop = asyncio.get_event_loop()
+        self._stats = TrafficStats(kwargs.get("stats_capacity", 360))
+        self._retry = RetryPolicy(
+            kwargs.get("max_retries", 2), kwargs.get("retry_backoff", 0.5)
+        )
+        self._breaker = CircuitBreaker(
+            kwargs.get("breaker_threshold", 3),
+            kwargs.get("breaker_cooldown", 60),
+        )
         self._socket_path = _server_socket_path
+        self._request_ids = itertools.count()
+        self._serve_task: Optional[asyncio.Task] = None
+        # bound to the loop running the server by _prepare
+        self._loop: asyncio.AbstractEventLoop
+        self._msg_queue: CtrlQueue
+        self._stop_event: asyncio.Event
+        # wakes the clock up when the groups change
+        self._clock_wakeup: asyncio.Event
+        # wakes the paced rounds up when a round may have been superseded
+        self._round_changed: asyncio.Event
 
     async def _monitor_and_adjust_network(self):
-        """Monitor and adjust network bandwidth between containers."""
-        with ThreadPoolExecutor() as executor:
+        """Monitor and adjust network bandwidth between containers.
+        Messages are dispatched as soon as they arrive: the groups are
+        updated right away and the tc work runs on the pipeline, so that
+        operations on disjoint containers overlap and only conflicting
+        ones wait for each other.
+        """
+        with ThreadPoolExecutor(self.workers) as executor:
             while True:
                 msg = await self._msg_queue.get()
                 logging.debug(f"Received message: {msg}")
                 if msg.action == CtrlAction.STOP:
+                    # the rounds are superseded, wait for the operations
+                    # in flight
+                    self._notify_round_changed()
+                    await self._pipeline.join()
                     # clear all bandwidth limits
                     tasks = []
-                    for container in self._container_list:
+                    for container in self._limits.containers():
                         tasks.append(
                             self._loop.run_in_executor(
                                 executor, self._clear_one, container, True
@@ -104,149 +279,1405 @@ class ConNetServer:
                         )
                     # wait for all tasks to complete
                     await asyncio.gather(*tasks)
+                    self._limits.log_cleared()
+                    self._ready.clear()
+                    if self.backend == "exec":
+                        TCCmdWrapper(self._run_with_sudo).close_sessions()
+                    else:
+                        HostTCCmdWrapper(self._run_with_sudo).close_session()
                     # set stop event
                     self._is_running = False
                     self._stop_event.set()
+                    self._clock_wakeup.set()
+                    self._reply(msg)
                     break
                 elif msg.action == CtrlAction.SET_BANDWIDTH:
-                    # for each container pair, set bandwidth limit
-                    tasks = []
-                    for container1, container2 in all_pairs_iter(
-                        self._container_list
-                    ):
-                        tasks.append(
-                            self._loop.run_in_executor(
-                                executor,
-                                self._set_bandwidth_limit,
-                                container1,
-                                container2,
-                            )
-                        )
-                    # wait for all tasks to complete
-                    await asyncio.gather(*tasks)
+                    group = self._groups.get(msg.group or DEFAULT_GROUP)
+                    if group is None:
+                        continue  # destroyed since the tick
+                    # the round is abandoned when a newer tick or STOP
+                    # arrives
+                    round_token = (
+                        msg.group,
+                        self._msg_queue.group_round(msg.group),
+                    )
+                    self._notify_round_changed()
+                    self._pipeline.start(
+                        [("group", group.name)],
+                        self._tick,
+                        executor,
+                        group,
+                        round_token,
+                    )
                 elif msg.action == CtrlAction.ADD_CONTAINER:
                     # adjust network for new container
-                    if msg.container in self._container_list:
+                    group_name = msg.group or DEFAULT_GROUP
+                    group = self._groups.get(group_name)
+                    if group is None:
+                        self._reply(msg, error=f"Group {group_name} not found")
                         continue
-
-                    # initialize htb qdisc for the container. This is required
-                    # because executor may call tc command
-                    # in one container at a time,
-                    # which may cause setting failed.
-                    self._init_container_htb(msg.container)
-
-                    tasks = []
-                    for container1, container2 in all_pairs_iter(
-                        self._container_list, msg.container
-                    ):
-                        tasks.append(
-                            self._loop.run_in_executor(
-                                executor,
-                                self._set_bandwidth_limit,
-                                container1,
-                                container2,
+                    current = self._group_of.get(msg.container)
+                    if current is not None:
+                        error = None
+                        if current != group_name:
+                            error = (
+                                f"Container {msg.container} is in group "
+                                f"{current}"
                             )
-                        )
-                    # wait for all tasks to complete
-                    await asyncio.gather(*tasks)
-                    self._container_list.append(msg.container)
+                        self._reply(msg, error=error)
+                        continue
+                    self._limits.add(msg.container)
+                    group.containers[msg.container] = None
+                    self._group_of[msg.container] = group_name
+                    self._onboard(executor, group, msg.container, msg)
                 elif msg.action == CtrlAction.DEL_CONTAINER:
-                    if msg.container not in self._container_list:
+                    if msg.container not in self._group_of:
                         logging.warning(
                             f"Recv DEL_CONTAINER. the container {msg.container}"
                             + " is not in the list"
                         )
+                        self._reply(
+                            msg, error=f"Container {msg.container} not found"
+                        )
                         continue
-                    # clear bandwidth limit for the container
-                    await self._loop.run_in_executor(
-                        executor, self._clear_one, msg.container, True
+                    peers = self._remove_member(msg.container)
+                    self._pipeline.start(
+                        [container_key(msg.container)]
+                        + [pair_key(msg.container, p) for p in peers],
+                        self._del_container,
+                        executor,
+                        msg.container,
+                        peers,
+                        msg,
+                    )
+                elif msg.action in (
+                    CtrlAction.SET_LIMIT,
+                    CtrlAction.CLEAR_LIMIT,
+                ):
+                    # one-off requests, e.g. from `contcfg cli`
+                    self._pipeline.start(
+                        self._cli_request_keys(msg),
+                        self._cli_request,
+                        executor,
+                        msg,
+                    )
+                elif msg.action == CtrlAction.GET_STATS:
+                    payload = msg.payload or {}
+                    self._reply(
+                        msg,
+                        self._stats.query(
+                            payload.get("container"), payload.get("last")
+                        ),
+                    )
+                elif msg.action == CtrlAction.LIST_GROUPS:
+                    self._reply(
+                        msg,
+                        {
+                            name: {**g.info(), "ready": len(self._members(g))}
+                            for name, g in self._groups.items()
+                        },
+                    )
+                elif msg.action == CtrlAction.DESTROY_GROUP:
+                    self._destroy_group(executor, msg)
+                elif msg.action in (
+                    CtrlAction.CREATE_GROUP,
+                    CtrlAction.MODIFY_GROUP,
+                ):
+                    self._reply(
+                        msg, error=self._handle_group_request(executor, msg)
+                    )
+
+    async def _tick(
+        self,
+        executor,
+        group: ShapingGroup,
+        round_token: tuple[Optional[str], int],
+    ):
+        """Update the limits of a group on its periodic tick."""
+        if self._groups.get(group.name) is not group:
+            return  # destroyed since the tick
+        # members whose onboarding failed are tried again
+        for container in group.containers:
+            if (
+                container not in self._ready
+                and container not in self._onboarding
+                and not self._breaker.is_open(container)
+            ):
+                self._onboard(executor, group, container)
+        span = group.interval_sec * PACE_SPAN if group.pace else None
+        if group.mode == "adaptive":
+            await self._adapt(executor, group, round_token, span)
+        else:
+            # set the bandwidth limit of each container pair, or of the
+            # next fraction of them
+            await self._set_pairs(
+                executor,
+                group,
+                group.rolling_pairs(self._ready_pairs(group)),
+                round_token=round_token,
+                span=span,
+            )
+        # show a summary of the bandwidth limits
+        self._show_bandwidth_limits()
+
+    def _onboard(
+        self,
+        executor,
+        group: ShapingGroup,
+        container: str,
+        msg: Optional[CtrlMsg] = None,
+    ):
+        """Start the onboarding of a member of a group on the pipeline.
+        The onboardings of different containers run in parallel on the
+        executor, each one only holds the key of its container."""
+        self._onboarding.add(container)
+        self._pipeline.start(
+            [container_key(container)],
+            self._add_container,
+            executor,
+            group,
+            container,
+            msg,
+        )
+
+    async def _add_container(
+        self,
+        executor,
+        group: ShapingGroup,
+        container: str,
+        msg: Optional[CtrlMsg] = None,
+    ):
+        """Initialize the htb tree of a new member of a group, then mark
+        it ready and set its limits with the ready peers. A pair is set
+        by whichever of its containers becomes ready last, and ticks
+        leave the members that are not ready alone.
+        Args:
+            - msg (CtrlMsg, optional) : message to reply once done
+        """
+        try:
+            if container in self._ready:
+                return  # onboarded by an earlier operation
+            ok = await self._loop.run_in_executor(
+                executor, self._init_container_htb, container
+            )
+            if not ok or not self._in_group(group, container):
+                return
+            if group.default_rate is not None:
+                await self._loop.run_in_executor(
+                    executor,
+                    self._set_default_class,
+                    [container],
+                    group.default_rate,
+                )
+            self._ready.add(container)
+            peers = self._members(group)
+            await self._set_pairs(
+                executor,
+                group,
+                [
+                    (peer, container)
+                    for peer in group.neighbors(container, peers)
+                ],
+            )
+            self._show_bandwidth_limits()
+        finally:
+            self._onboarding.discard(container)
+            if msg is not None:
+                self._reply(msg)
+
+    def _members(self, group: ShapingGroup) -> list[str]:
+        """Get the members of a group that are ready to be shaped."""
+        return [c for c in group.containers if c in self._ready]
+
+    def _ready_pairs(self, group: ShapingGroup) -> list[tuple[str, str]]:
+        """Get the shaped pairs of a group whose containers are ready."""
+        return [
+            (c1, c2)
+            for c1, c2 in group.pairs()
+            if c1 in self._ready and c2 in self._ready
+        ]
+
+    def _handle_group_request(self, executor, msg: CtrlMsg) -> Optional[str]:
+        """Create or modify a shaping group. A change of the edges or of
+        the default rate of a group is applied to its members on the
+        pipeline.
+
+        Returns:
+            - error (str) : None if the request succeeded
+        """
+        name = msg.group or DEFAULT_GROUP
+        group = self._groups.get(name)
+        if msg.action == CtrlAction.CREATE_GROUP:
+            if group is not None:
+                return f"Group {name} already exists"
+            try:
+                group = ShapingGroup.from_payload(name, msg.payload or {})
+            except (ValueError, TypeError) as e:
+                return f"Invalid group config: {e}"
+            self._groups[name] = group
+        elif group is None:
+            return f"Group {name} not found"
+        else:
+            pairs, default_rate = self._shaped_pairs(group), group.default_rate
+            try:
+                group.modify(msg.payload or {})
+            except (ValueError, TypeError) as e:
+                return f"Invalid group config: {e}"
+            self._reshape(executor, group, pairs, default_rate)
+        # the new interval starts now
+        group.next_tick = self._loop.time() + group.interval_sec
+        self._clock_wakeup.set()
+        return None
+
+    @staticmethod
+    def _shaped_pairs(group: ShapingGroup) -> set[tuple[str, str]]:
+        return {(min(pair), max(pair)) for pair in group.pairs()}
+
+    def _reshape(
+        self,
+        executor,
+        group: ShapingGroup,
+        pairs: set[tuple[str, str]],
+        default_rate: Optional[str],
+    ):
+        """Apply a change of the shaped pairs or of the default rate of a
+        group. The limits of the pairs left out are removed, the new pairs
+        get a random rate until the next tick.
+        Args:
+            - pairs (set) : shaped pairs before the change
+            - default_rate (str) : default rate before the change
+        """
+        current = self._shaped_pairs(group)
+        removed = sorted(pairs - current)
+        added = sorted(current - pairs)
+        default_changed = group.default_rate != default_rate
+        if not removed and not added and not default_changed:
+            return
+        # the new pairs are set on the pipeline with their own keys
+        keys = [pair_key(c1, c2) for c1, c2 in removed]
+        if default_changed:
+            keys += [container_key(c) for c in group.containers]
+
+        async def reshape():
+            for container1, container2 in removed:
+                self._limits.unset(container1, container2)
+            await asyncio.gather(
+                *(
+                    self._prune_peer(executor, peer, [container])
+                    for pair in removed
+                    for peer, container in (pair, pair[::-1])
+                )
+            )
+            if default_changed:
+                await self._apply_default_class(
+                    executor, self._members(group), group.default_rate
+                )
+            # pairs with a container not ready yet are set once it is
+            await self._set_pairs(
+                executor,
+                group,
+                [
+                    (c1, c2)
+                    for c1, c2 in added
+                    if c1 in self._ready and c2 in self._ready
+                ],
+            )
+            self._show_bandwidth_limits()
+
+        self._pipeline.start(keys, reshape)
+
+    async def _apply_default_class(
+        self, executor, containers: list[str], rate: Optional[str]
+    ):
+        """Set the default class of containers, see
+        TCBatch.set_default. The exec backend runs one batch per
+        container in parallel, the host backend a single tc batch."""
+        if not containers:
+            return
+        if self.backend == "host":
+            await self._loop.run_in_executor(
+                executor, self._set_default_class, containers, rate
+            )
+            return
+        await asyncio.gather(
+            *(
+                self._loop.run_in_executor(
+                    executor, self._set_default_class, [container], rate
+                )
+                for container in containers
+            )
+        )
+
+    def _destroy_group(self, executor, msg: CtrlMsg):
+        """Remove a shaping group, then clear the rules of its containers
+        on the pipeline. The reply is sent once they are cleared."""
+        name = msg.group or DEFAULT_GROUP
+        group = self._groups.get(name)
+        if group is None:
+            self._reply(msg, error=f"Group {name} not found")
+            return
+        if name == DEFAULT_GROUP:
+            self._reply(msg, error="The default group cannot be destroyed")
+            return
+        containers = list(group.containers)
+        pairs = group.pairs()
+        for container in containers:
+            self._remove_member(container)
+        del self._groups[name]
+        self._clock_wakeup.set()
+
+        async def clear():
+            # no member is left to prune the containers from
+            await asyncio.gather(
+                *(
+                    self._del_container(executor, container, [])
+                    for container in containers
+                )
+            )
+            self._reply(msg)
+
+        keys = [container_key(c) for c in containers]
+        keys += [pair_key(c1, c2) for c1, c2 in pairs]
+        self._pipeline.start(keys, clear)
+
+    def _remove_member(self, container: str) -> list[str]:
+        """Remove a container from its group and the limit matrix.
+
+        Returns:
+            - peers (list) : the remaining containers of the group shaped
+            with it
+        """
+        group = self._groups[self._group_of.pop(container)]
+        del group.containers[container]
+        self._ready.discard(container)
+        self._limits.remove(container)
+        return group.neighbors(container, group.containers)
+
+    async def _del_container(
+        self,
+        executor,
+        container: str,
+        peers: list[str],
+        msg: Optional[CtrlMsg] = None,
+    ):
+        """Clear the rules of a removed container.
+        Args:
+            - container (str) : container name or id
+            - peers (list) : containers of its group when it was removed.
+            The class of the container is removed from those still there.
+            - msg (CtrlMsg, optional) : message to reply once done
+        """
+        # remove the classes of the departed container from
+        # all remaining containers of the group, then clear its own rules
+        peers = [peer for peer in peers if peer in self._group_of]
+        await self._prune_peer(executor, container, peers)
+        await self._loop.run_in_executor(
+            executor, self._clear_one, container, True
+        )
+        self._forget_container(container)
+        if msg is not None:
+            self._show_bandwidth_limits()
+            self._reply(msg)
+
+    def _cli_request_keys(self, msg: CtrlMsg) -> list:
+        """Keys of a SET_LIMIT or CLEAR_LIMIT request."""
+        if msg.container is None:
+            return []
+        if msg.action == CtrlAction.SET_LIMIT:
+            peer = (msg.payload or {}).get("peer")
+            return [pair_key(msg.container, peer)] if peer else []
+        keys = [container_key(msg.container)]
+        group = self._group_of.get(msg.container)
+        if group is not None:
+            keys += [
+                pair_key(msg.container, peer)
+                for peer in self._groups[group].containers
+                if peer != msg.container
+            ]
+        return keys
+
+    async def _cli_request(self, executor, msg: CtrlMsg):
+        error = await self._loop.run_in_executor(
+            executor, self._handle_cli_request, msg
+        )
+        self._reply(msg, error=error)
+
+    async def _set_pairs(
+        self,
+        executor,
+        group: ShapingGroup,
+        pairs,
+        round_token: Optional[tuple[Optional[str], int]] = None,
+        span: Optional[float] = None,
+    ):
+        """Set random bandwidth limits for container pairs of a group.
+        If round_token, the group and round id of a tick, is given,
+        pairs not applied yet are skipped once the round is superseded.
+        See _apply_limits for span.
+        """
+        limits = [
+            (container1, container2, *group.random_rates())
+            for container1, container2 in pairs
+        ]
+        await self._apply_limits(executor, group, limits, round_token, span)
+
+    async def _adapt(
+        self,
+        executor,
+        group: ShapingGroup,
+        round_token: tuple[Optional[str], int],
+        span: Optional[float] = None,
+    ):
+        """Move the rates of an adaptive group according to its policy.
+        The class counters of each container are sampled with one
+        `tc -s -j class show`, and only the pairs whose rate moves beyond
+        the threshold of the policy are set.
+        """
+        containers = self._members(group)
+        if len(containers) < 2:
+            return
+        ts = time.time()
+        await asyncio.gather(
+            *(
+                self._loop.run_in_executor(
+                    executor,
+                    self._collect_stats,
+                    container,
+                    group.neighbors(container, containers),
+                    ts,
+                )
+                for container in containers
+            )
+        )
+        if self._is_stale(round_token):
+            return
+        limits = {}
+        usage = {}
+        for container1, container2 in sorted(self._shaped_pairs(group)):
+            directions = [(container1, container2)]
+            if group.asymmetric:
+                directions.append((container2, container1))
+            for pair in directions:
+                rate = self._limits.get(*pair)
+                if rate is None:
+                    continue  # never set, e.g. the container was not found
+                limits[pair] = convert_rate(
+                    rate, self.rate_unit, group.rate_unit
+                )
+                measured = [
+                    t
+                    for t in (
+                        self._stats.throughput(*pair),
+                        self._stats.throughput(*pair[::-1]),
+                    )
+                    if t is not None
+                ]
+                if measured:
+                    # a symmetric class is sized for its busier direction
+                    usage[pair] = (
+                        measured[0] if group.asymmetric else max(measured)
+                    )
+        rates = group.policy.plan(
+            limits,
+            usage,
+            group.min_rate,
+            group.max_rate,
+            group.rate_unit,
+            directed=group.asymmetric,
+        )
+        logging.info(
+            f"Group {group.name}: {len(usage)} of {len(limits)} pairs "
+            f"measured, {len(rates)} adapted"
+        )
+        await self._apply_limits(
+            executor,
+            group,
+            self._adapted_limits(group, rates, limits),
+            round_token,
+            span,
+        )
+
+    @staticmethod
+    def _adapted_limits(
+        group: ShapingGroup,
+        rates: dict[tuple[str, str], int],
+        limits: dict[tuple[str, str], int],
+    ) -> list[Limit]:
+        """Turn the planned rates into limits. A direction of an
+        asymmetric pair that was not adapted keeps its current rate."""
+        if not group.asymmetric:
+            return [(c1, c2, rate, rate) for (c1, c2), rate in rates.items()]
+        current = {**limits, **rates}
+        pairs = sorted({(min(pair), max(pair)) for pair in rates})
+        return [
+            (
+                c1,
+                c2,
+                current.get((c1, c2), group.min_rate),
+                current.get((c2, c1), group.min_rate),
+            )
+            for c1, c2 in pairs
+        ]
+
+    async def _apply_limits(
+        self,
+        executor,
+        group: ShapingGroup,
+        limits: list[Limit],
+        round_token: Optional[tuple[Optional[str], int]] = None,
+        span: Optional[float] = None,
+    ):
+        """Set (container1, container2, rate, reverse) limits of a group.
+        The exec backend runs one operation per pair on the pipeline,
+        the host backend applies all pairs with a single tc batch.
+        If span is given, the operations are paced evenly over span
+        seconds with a token bucket, the host backend then applies about
+        one batch per second. The ticks of a synced group are committed
+        together instead, see _commit_limits.
+        """
+        if not limits:
+            return
+        if group.sync and round_token is not None:
+            await self._pipeline.start(
+                [pair_key(c1, c2) for c1, c2, *_ in limits],
+                self._commit_limits,
+                executor,
+                group,
+                limits,
+                round_token,
+            )
+            return
+        if self.backend == "host":
+            chunks = [limits]
+            if span:
+                size = math.ceil(len(limits) / max(1, math.ceil(span)))
+                chunks = [
+                    limits[i : i + size] for i in range(0, len(limits), size)
+                ]
+            bucket = TokenBucket(len(chunks) / span) if span else None
+            for chunk in chunks:
+                if bucket is not None and not await self._pace(
+                    bucket, round_token
+                ):
+                    return
+                await self._pipeline.start(
+                    [pair_key(c1, c2) for c1, c2, *_ in chunk],
+                    self._apply_batch,
+                    executor,
+                    group,
+                    chunk,
+                    round_token,
+                )
+            return
+        bucket = TokenBucket(len(limits) / span) if span else None
+        # pairs are started a window at a time, so that later operations
+        # on the same containers do not wait behind the whole round
+        window = asyncio.Semaphore(self.workers)
+        tasks = []
+        for container1, container2, bandwidth, reverse in limits:
+            if bucket is not None and not await self._pace(
+                bucket, round_token
+            ):
+                break
+            await window.acquire()
+            if self._is_stale(round_token) or not self._in_group(
+                group, container1, container2
+            ):
+                window.release()
+                continue
+            task = self._pipeline.start(
+                [pair_key(container1, container2)],
+                self._apply_pair,
+                executor,
+                group,
+                container1,
+                container2,
+                bandwidth,
+                reverse,
+                round_token,
+            )
+            task.add_done_callback(lambda _: window.release())
+            tasks.append(task)
+        # wait for all tasks to complete
+        applied = await asyncio.gather(*tasks)
+        skipped = applied.count(False)
+        if self._is_stale(round_token):
+            skipped += len(limits) - len(applied)
+        if skipped:
+            logging.info(
+                f"Round of group {group.name} superseded by a newer message, "
+                f"{skipped} of {len(limits)} pairs skipped"
+            )
+
+    async def _apply_pair(
+        self,
+        executor,
+        group: ShapingGroup,
+        container1: str,
+        container2: str,
+        bandwidth: int,
+        reverse: int,
+        round_token: Optional[tuple[Optional[str], int]],
+    ) -> bool:
+        """Set the limits of a pair unless a container left the group
+        while the operation waited.
+
+        Returns:
+            - bool : False if skipped because the round is stale
+        """
+        if not self._in_group(group, container1, container2):
+            return True
+        return await self._loop.run_in_executor(
+            executor,
+            self._set_bandwidth_limit,
+            container1,
+            container2,
+            bandwidth,
+            round_token,
+            group.rate_unit,
+            group.egress,
+            reverse,
+        )
+
+    async def _apply_batch(
+        self,
+        executor,
+        group: ShapingGroup,
+        limits: list[Limit],
+        round_token: Optional[tuple[Optional[str], int]],
+    ):
+        """Set the limits of the pairs still in the group in one batch."""
+        if self._is_stale(round_token):
+            return
+        limits = [
+            limit for limit in limits if self._in_group(group, *limit[:2])
+        ]
+        if limits:
+            await self._loop.run_in_executor(
+                executor,
+                self._set_bandwidth_limits,
+                limits,
+                group.rate_unit,
+                group.egress,
+            )
+
+    async def _commit_limits(
+        self,
+        executor,
+        group: ShapingGroup,
+        limits: list[Limit],
+        round_token: Optional[tuple[Optional[str], int]],
+    ):
+        """Apply the limits of a tick in two phases.
+        The containers are prepared in parallel first: ips resolved,
+        sessions opened and htb trees added. Then the batches of all
+        containers are committed at once, and the time over which the
+        changes landed is kept as the skew of the group.
+        """
+        limits = [
+            limit for limit in limits if self._in_group(group, *limit[:2])
+        ]
+        containers = sorted({c for c1, c2, *_ in limits for c in (c1, c2)})
+        prepared = await asyncio.gather(
+            *(
+                self._loop.run_in_executor(
+                    executor, self._prepare_container, container
+                )
+                for container in containers
+            )
+        )
+        ready = {c for c, ok in zip(containers, prepared) if ok}
+        # a pair is only changed if both of its containers are ready
+        limits = [
+            limit
+            for limit in limits
+            if limit[0] in ready and limit[1] in ready
+        ]
+        if self._is_stale(round_token) or not limits:
+            return
+        wrapper = self._tc_wrapper()
+        # the tree of a container gets the rates of the direction it shapes
+        peers: dict[str, list[tuple[str, int]]] = {}
+        for c1, c2, bandwidth, reverse in limits:
+            shaped1, shaped2 = bandwidth, reverse
+            if wrapper.shapes_ingress:
+                shaped1, shaped2 = reverse, bandwidth
+            peers.setdefault(c1, []).append((c2, shaped1))
+            peers.setdefault(c2, []).append((c1, shaped2))
+        try:
+            batches = {
+                container: wrapper.limit_batch(
+                    container, container_peers, group.rate_unit, group.egress
+                )
+                for container, container_peers in peers.items()
+            }
+        except (RateValueError, ContainerNotFoundError) as e:
+            logging.error(f"Error building the batches of {group.name}: {e}")
+            return
+        skew, failed = await self._loop.run_in_executor(
+            executor, wrapper.commit, batches
+        )
+        for container, error in failed.items():
+            logging.error(f"Error committing limits of {container}: {error}")
+            if isinstance(error, TRANSIENT_ERRORS):
+                self._record(False, container)
+        self._record(True, *(c for c in batches if c not in failed))
+        for c1, c2, bandwidth, reverse in limits:
+            if c1 not in failed and c2 not in failed:
+                self._limits.set(
+                    c1,
+                    c2,
+                    convert_rate(bandwidth, group.rate_unit, self.rate_unit),
+                    convert_rate(reverse, group.rate_unit, self.rate_unit),
+                )
+        group.last_skew = skew
+        logging.info(
+            f"Group {group.name}: {len(limits)} pairs committed on "
+            f"{len(batches)} containers, skew {skew * 1000:.2f}ms"
+        )
+
+    def _prepare_container(self, container: str) -> bool:
+        """Prepare a container for a commit.
+
+        Returns:
+            - bool : False if the container cannot be changed now
+        """
+        if not self._allow(container):
+            return False
+        try:
+            self._retry.call(self._tc_wrapper().prepare, container)
+            return True
+        except ContainerNotFoundError:
+            logging.error(f"Container {container} not found")
+        except Exception as e:
+            if isinstance(e, TRANSIENT_ERRORS):
+                self._record(False, container)
+            logging.error(f"Error preparing container {container}: {e}")
+        return False
+
+    async def _pace(
+        self,
+        bucket: TokenBucket,
+        round_token: Optional[tuple[Optional[str], int]],
+    ) -> bool:
+        """Wait for a token of a paced round.
+
+        Returns:
+            - bool : False if the round was superseded while waiting
+        """
+        deadline = self._loop.time() + bucket.reserve()
+        while not self._is_stale(round_token):
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(
+                    self._round_changed.wait(), timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    def _notify_round_changed(self):
+        """Wake the paced rounds up, e.g. to check if they are stale."""
+        self._round_changed.set()
+        self._round_changed.clear()
+
+    def _in_group(self, group: ShapingGroup, *containers: str) -> bool:
+        """Check that containers are all members of a group."""
+        return all(self._group_of.get(c) == group.name for c in containers)
+
+    def _is_stale(
+        self, round_token: Optional[tuple[Optional[str], int]]
+    ) -> bool:
+        """Check whether the round of a group has been superseded."""
+        if round_token is None:
+            return False
+        group, round_id = round_token
+        return round_id != self._msg_queue.group_round(group)
+
+    async def _prune_peer(self, executor, peer: str, containers: list[str]):
+        """Remove the class and filter of peer from containers.
+        The exec backend runs one batch per container in parallel,
+        the host backend removes them all with a single tc batch.
+        """
+        if not containers:
+            return
+        if self.backend == "host":
+            await self._loop.run_in_executor(
+                executor, self._remove_peer, containers, peer
+            )
+            return
+        tasks = []
+        for container in containers:
+            tasks.append(
+                self._loop.run_in_executor(
+                    executor, self._remove_peer, [container], peer
+                )
+            )
+        await asyncio.gather(*tasks)
+
+    async def _stats_clock(self):
+        """Periodic clock to sample the htb class counters."""
+        with ThreadPoolExecutor() as executor:
+            while self._is_running:
+                try:
+                    await asyncio.wait_for(
+                        self._stop_event.wait(), timeout=self.stats_interval
                     )
-                    self._container_list.remove(msg.container)
-                # show bandwidth limits
-                self._show_bandwidth_limits()
+                except asyncio.TimeoutError:
+                    ts = time.time()
+                    tasks = []
+                    for group in self._groups.values():
+                        containers = self._members(group)
+                        for container in containers:
+                            tasks.append(
+                                self._loop.run_in_executor(
+                                    executor,
+                                    self._collect_stats,
+                                    container,
+                                    group.neighbors(container, containers),
+                                    ts,
+                                )
+                            )
+                    await asyncio.gather(*tasks)
 
     async def _periodic_clock(self):
-        """Periodic clock to trigger network adjustment."""
+        """Periodic clock to trigger network adjustment of each group.
+        One clock serves all groups, sleeping until the next tick is due
+        or the groups change.
+        """
+        for group in self._groups.values():
+            if group.next_tick is None:
+                group.next_tick = self._loop.time() + group.interval_sec
         while self._is_running:
+            now = self._loop.time()
+            next_tick = None
+            for group in list(self._groups.values()):
+                if group.next_tick is None or group.next_tick <= now:
+                    group.next_tick = now + group.interval_sec
+                    await self._msg_queue.put(
+                        CtrlMsg(CtrlAction.SET_BANDWIDTH, group=group.name)
+                    )
+                if next_tick is None or group.next_tick < next_tick:
+                    next_tick = group.next_tick
+            assert next_tick is not None  # the default group always exists
+            self._clock_wakeup.clear()
             try:
                 await asyncio.wait_for(
-                    self._stop_event.wait(), timeout=self.interval_sec
+                    self._clock_wakeup.wait(), timeout=next_tick - now
                 )
             except asyncio.TimeoutError:
-                await self._msg_queue.put(CtrlMsg(CtrlAction.SET_BANDWIDTH))
-        # stop the loop
-        self._loop.stop()
+                pass
 
     def start(self):
-        """start monitoring and adjusting network."""
+        """start monitoring and adjusting network.
+        Runs the server on a new event loop until it is stopped. On
+        KeyboardInterrupt the rules are cleared before returning."""
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s][%(levelname)s]%(message)s",
+        )
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self):
+        """Run the server on the running event loop until it is stopped,
+        by a STOP message or `stop()`, or cancelled. On cancellation the
+        rules are cleared as for STOP before CancelledError propagates.
+        """
+        await self._serve(self._prepare())
+
+    async def __aenter__(self) -> "ConNetServer":
+        """Start serving in the background. Returns once clients can
+        connect, and raises if the server failed to start."""
+        server = self._prepare()
+        self._serve_task = asyncio.create_task(self._serve(server))
+        bound = asyncio.create_task(server.bound.wait())
+        await asyncio.wait(
+            [bound, self._serve_task], return_when=asyncio.FIRST_COMPLETED
+        )
+        bound.cancel()
+        if self._serve_task.done():
+            task, self._serve_task = self._serve_task, None
+            task.result()  # e.g. the socket could not be bound
+            raise RuntimeError("Server stopped while starting")
+        return self
+
+    async def __aexit__(self, *exc):
+        assert self._serve_task is not None
+        if not self._serve_task.done():
+            self._serve_task.cancel()
+        try:
+            await self._serve_task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._serve_task = None
+
+    def _prepare(self) -> NetCtrlCommServer:
+        """Bind the server to the running loop and acquire its socket.
+        Raises OSError if another server holds the socket path."""
+        if self._is_running:
+            raise RuntimeError("Server is already running")
+        self._loop = asyncio.get_running_loop()
+        self._msg_queue = CtrlQueue()
+        self._stop_event = asyncio.Event()
+        self._clock_wakeup = asyncio.Event()
+        self._round_changed = asyncio.Event()
+        set_cmd_timeout(self.cmd_timeout)
+        if self.helper_socket:
+            set_priv_helper(self.helper_socket)
+        set_runtime(self.runtime)
+        set_htb_profile(self.htb_profile)
+        if self.backend == "exec":
+            TCCmdWrapper(self._run_with_sudo).set_ingress(self.ingress)
         server = NetCtrlCommServer(self._socket_path)
         self._is_running = True
+        return server
+
+    async def _serve(self, server: NetCtrlCommServer):
+        """Run the tasks of the server until the dispatcher stops."""
+        monitor = asyncio.create_task(self._monitor_and_adjust_network())
+        comm = asyncio.create_task(server.start(self._msg_queue))
+        tasks = [comm, asyncio.create_task(self._periodic_clock())]
+        if self.stats_interval:
+            tasks.append(asyncio.create_task(self._stats_clock()))
+        try:
+            # waiting with asyncio.wait does not cancel the dispatcher
+            # with the caller, the shutdown below stops it
+            await asyncio.wait(
+                [monitor, comm], return_when=asyncio.FIRST_COMPLETED
+            )
+            if comm.done() and not comm.cancelled() and comm.exception():
+                comm.result()  # e.g. the socket could not be bound
+            await asyncio.wait([monitor])
+            monitor.result()
+        finally:
+            await self._shutdown(server, monitor, tasks)
+
+    async def _shutdown(
+        self,
+        server: NetCtrlCommServer,
+        monitor: asyncio.Task,
+        tasks: list[asyncio.Task],
+    ):
+        """Stop the dispatcher as for STOP if it is still running, then
+        close the socket and the clocks."""
+        if not monitor.done():
+            self._msg_queue.put_nowait(CtrlMsg(CtrlAction.STOP))
+            await asyncio.wait([monitor])
+        self._is_running = False
+        self._stop_event.set()
+        self._clock_wakeup.set()
+        # answer the requests left behind, e.g. a second STOP
+        while not self._msg_queue.empty():
+            msg = self._msg_queue.get_nowait()
+            if msg.action == CtrlAction.STOP:
+                self._reply(msg)
+            else:
+                self._reply(msg, error="Server stopped")
+        await server.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._limits.flush_log()
+        if self.helper_socket:
+            set_priv_helper(None)
+
+    async def request(self, msg: CtrlMsg) -> CtrlReply:
+        """Handle a control message in process, without the socket.
+        Returns once the server has handled it, like a client request.
+        Args:
+            - msg (CtrlMsg) : the message, its reply fields are set here
+        """
+        if not self._is_running:
+            raise RuntimeError("Server is not running")
+        msg.request_id = next(self._request_ids)
+        msg.reply = self._loop.create_future()
+        await self._msg_queue.put(msg)
+        return await msg.reply
+
+    async def _request(self, msg: CtrlMsg) -> CtrlReply:
+        reply = await self.request(msg)
+        if not reply.ok:
+            raise RuntimeError(f"{msg.action.name} failed: {reply.error}")
+        return reply
+
+    async def add_container(self, container: str, group: Optional[str] = None):
+        """Add a container to a group of the running server.
+        Args:
+            - container (str) : container name or id
+            - group (str, optional) : shaping group. Default is None
+            (the default group).
+        """
+        await self._request(
+            CtrlMsg(CtrlAction.ADD_CONTAINER, container, group=group)
+        )
 
-        self._loop.create_task(self._monitor_and_adjust_network())
-        self._loop.create_task(self._periodic_clock())
-        self._loop.create_task(server.start(self._msg_queue))
-        self._loop.run_forever()
+    async def del_container(self, container: str):
+        """Remove a container from the running server and clear its rules.
+        Args:
+            - container (str) : container name or id
+        """
+        await self._request(CtrlMsg(CtrlAction.DEL_CONTAINER, container))
+
+    async def set_bandwidth(
+        self,
+        container1: str,
+        container2: str,
+        rate: str,
+        reverse: Optional[str] = None,
+    ):
+        """Set the bandwidth limit between two containers right away.
+        Args:
+            - container1 (str) : container name or id
+            - container2 (str) : container name or id
+            - rate (str) : rate with unit, e.g. "100mbit", from container1
+            to container2
+            - reverse (str, optional) : rate from container2 to
+            container1. Default is None (rate).
+        """
+        await self._request(
+            CtrlMsg(
+                CtrlAction.SET_LIMIT,
+                container1,
+                payload={
+                    "peer": container2,
+                    "rate": rate,
+                    "reverse": reverse,
+                },
+            )
+        )
+
+    async def stop(self):
+        """Stop the running server and clear all rules. Returns once they
+        are cleared, does nothing if the server is not running."""
+        if self._is_running:
+            await self.request(CtrlMsg(CtrlAction.STOP))
+
+    def _reply(
+        self, msg: CtrlMsg, result=None, error: Optional[str] = None
+    ):
+        """Complete the reply of a message if the client expects one."""
+        if msg.reply is None or msg.request_id is None or msg.reply.done():
+            return
+        msg.reply.set_result(
+            CtrlReply(msg.request_id, error is None, result, error)
+        )
 
     def _show_bandwidth_limits(self):
-        """Show bandwidth limits between containers."""
-        s = ""
-        for (container1, container2), bandwidth in self._limit_dict.items():
-            s += (
-                f"{container1} <--> {container2} : {bandwidth} {self.rate_unit}"
-            )
-            s += "\n"
-        if s:
-            logging.info(f"Bandwidth limits:\n{s}")
-
-    def _init_container_htb(self, container: str):
-        """Initialize htb qdisc for container."""
+        """Log a summary of the bandwidth limits between containers."""
+        summary = self._limits.summary()
+        if not summary["pairs"]:
+            return
+        logging.info(
+            f"Bandwidth limits: {summary['containers']} containers, "
+            f"{summary['pairs']} pairs, min {summary['min']}, "
+            f"max {summary['max']}, mean {summary['mean']:.1f} "
+            f"{self.rate_unit}, {summary['changed']} changed"
+        )
+
+    def _tc_wrapper(self):
+        """Get the tc wrapper of the configured backend."""
+        if self.backend == "host":
+            return HostTCCmdWrapper(self._run_with_sudo)
+        return TCCmdWrapper(self._run_with_sudo)
+
+    def _allow(self, *containers: str) -> bool:
+        """Check the circuit breaker of all containers."""
+        if any(self._breaker.is_open(c) for c in containers):
+            return False
+        return all([self._breaker.allow(c) for c in containers])
+
+    def _record(self, ok: bool, *containers: str):
+        """Record the outcome of an operation on containers."""
+        for container in containers:
+            if ok:
+                self._breaker.record_success(container)
+            else:
+                self._breaker.record_failure(container)
+
+    def _init_container_htb(self, container: str) -> bool:
+        """Initialize htb qdisc for container.
+
+        Returns:
+            - bool : True if the container is ready to be shaped
+        """
         try:
-            TCCmdWrapper(self._run_with_sudo).init_htb(container)
+            self._retry.call(self._tc_wrapper().init_htb, container)
+            # resolve the ip now, it is needed to prune the container
+            # from its peers after it is gone
+            self._retry.call(
+                get_runtime(self._run_with_sudo).get_container_ip,
+                container,
+            )
+            self._record(True, container)
+            return True
         except ContainerNotFoundError:
             logging.error(f"Container {container} not found")
         except Exception as e:
+            if isinstance(e, TRANSIENT_ERRORS):
+                self._record(False, container)
             logging.error(
                 "Error initializing htb. Please check if tc is installed "
                 f"or set docker run with --cap-add=NET_ADMIN: {e}"
             )
+        return False
 
     def _set_bandwidth_limit(
-        self, container1: str, container2: str, bandwidth: Optional[int] = None
-    ):
+        self,
+        container1: str,
+        container2: str,
+        bandwidth: Optional[int] = None,
+        round_token: Optional[tuple[Optional[str], int]] = None,
+        rate_unit: Optional[str] = None,
+        egress: Optional[str] = None,
+        reverse: Optional[int] = None,
+    ) -> bool:
         """Set bandwidth limit between two containers.
         Args:
             - container1 (str) : container name or id
             - container2 (str) : container name or id
-            - bandwidth (int, optional) : bandwidth limit. Default is None.
+            - bandwidth (int, optional) : bandwidth limit from container1
+            to container2. Default is a random rate of the default group.
+            - round_token (tuple, optional) : group and round of the
+            update. Default is None.
+            - rate_unit (str, optional) : unit of bandwidth. Default is
+            the server's rate_unit.
+            - egress (str, optional) : egress budget of the containers.
+            Default is None (no budget).
+            - reverse (int, optional) : bandwidth limit from container2
+            to container1. Default is None (bandwidth).
+
+        Returns:
+            - bool : False if skipped because the round is stale
         """
+        if self._is_stale(round_token):
+            return False
+        if not self._allow(container1, container2):
+            logging.debug(
+                f"Skip {container1} - {container2}, circuit breaker is open"
+            )
+            return True
         if bandwidth is None:
-            bandwidth = random.randint(self.min_rate, self.max_rate)
+            bandwidth = self._groups[DEFAULT_GROUP].random_rate()
+        rate_unit = rate_unit or self.rate_unit
+        if reverse is None:
+            reverse = bandwidth
+        if container2 < container1:
+            container1, container2 = container2, container1
+            bandwidth, reverse = reverse, bandwidth
 
         try:
-            container1, container2 = sorted([container1, container2])
-            TCCmdWrapper(self._run_with_sudo).set_bandwidth(
-                container1, container2, bandwidth, self.rate_unit
+            self._retry.call(
+                self._tc_wrapper().set_bandwidth,
+                container1,
+                container2,
+                bandwidth,
+                rate_unit,
+                egress,
+                reverse,
             )
-            self._limit_dict[(container1, container2)] = bandwidth
+            self._limits.set(
+                container1,
+                container2,
+                convert_rate(bandwidth, rate_unit, self.rate_unit),
+                convert_rate(reverse, rate_unit, self.rate_unit),
+            )
+            self._record(True, container1, container2)
         except ContainerNotFoundError:
             logging.error(f"Container {container1} or {container2} not found")
         except RateValueError as e:
             logging.error(f"Rate value error: {e}")
         except Exception as e:
+            if isinstance(e, TRANSIENT_ERRORS):
+                self._record(False, container1, container2)
             logging.error(
                 "Error setting bandwidth. Please check if tc is installed"
                 + f" or run with sudo: {e}"
             )
+        return True
+
+    def _set_bandwidth_limits(
+        self,
+        limits: list[Limit],
+        rate_unit: Optional[str] = None,
+        egress: Optional[str] = None,
+    ):
+        """Set bandwidth limits for many container pairs in one batch.
+        Args:
+            - limits (list) : (container1, container2, bandwidth, reverse)
+            tuples
+            - rate_unit (str, optional) : unit of the bandwidths. Default
+            is the server's rate_unit.
+            - egress (str, optional) : budget of the containers. Default
+            is None (no budget).
+        """
+        rate_unit = rate_unit or self.rate_unit
+        # resolve every container first, so one failing container
+        # is left out instead of failing the whole batch
+        runtime = get_runtime(self._run_with_sudo)
+        resolved = set()
+        for container in {c for c1, c2, *_ in limits for c in (c1, c2)}:
+            if not self._allow(container):
+                continue
+            try:
+                self._retry.call(runtime.get_container_veth, container)
+                self._retry.call(runtime.get_container_ip, container)
+                resolved.add(container)
+            except ContainerNotFoundError:
+                logging.error(f"Container {container} not found")
+            except Exception as e:
+                if isinstance(e, TRANSIENT_ERRORS):
+                    self._record(False, container)
+                logging.error(f"Error resolving container {container}: {e}")
+        limits = [
+            limit
+            for limit in limits
+            if limit[0] in resolved and limit[1] in resolved
+        ]
+        if not limits:
+            return
+        try:
+            self._retry.call(
+                self._tc_wrapper().set_bandwidth_batch,
+                limits,
+                rate_unit,
+                egress,
+            )
+        except ContainerNotFoundError as e:
+            logging.error(f"Container not found: {e}")
+            return
+        except RateValueError as e:
+            logging.error(f"Rate value error: {e}")
+            return
+        except Exception as e:
+            if isinstance(e, TRANSIENT_ERRORS):
+                self._record(False, *resolved)
+            logging.error(
+                "Error setting bandwidth. Please check if tc is installed"
+                + f" on the host or run with sudo: {e}"
+            )
+            return
+        self._record(True, *resolved)
+        for container1, container2, bandwidth, reverse in limits:
+            self._limits.set(
+                container1,
+                container2,
+                convert_rate(bandwidth, rate_unit, self.rate_unit),
+                convert_rate(reverse, rate_unit, self.rate_unit),
+            )
+
+    def _set_default_class(self, containers: list[str], rate: Optional[str]):
+        """Set the default class of containers."""
+        try:
+            self._retry.call(
+                self._tc_wrapper().set_default_class, containers, rate
+            )
+        except ContainerNotFoundError as e:
+            logging.error(f"Container not found: {e}")
+        except Exception as e:
+            logging.error(f"Error setting the default class: {e}")
+
+    def _remove_peer(self, containers: list[str], peer: str):
+        """Remove the class and filter of peer from containers."""
+        try:
+            peer_ip = get_runtime(self._run_with_sudo).get_container_ip(
+                peer
+            )
+            self._retry.call(
+                self._tc_wrapper().remove_peer, containers, peer_ip
+            )
+        except ContainerNotFoundError:
+            logging.error(f"Cannot resolve the ip of container {peer}")
+        except Exception as e:
+            logging.error(f"Error removing container {peer} from peers: {e}")
+
+    def _handle_cli_request(self, msg: CtrlMsg) -> Optional[str]:
+        """Apply a SET_LIMIT or CLEAR_LIMIT request.
+
+        Returns:
+            - error (str) : None if the request succeeded
+        """
+        if msg.container is None:
+            return "Missing container"
+        try:
+            if msg.action == CtrlAction.CLEAR_LIMIT:
+                self._retry.call(
+                    self._tc_wrapper().clear_one_container, msg.container
+                )
+                return None
+            payload = msg.payload or {}
+            peer, rate = payload["peer"], payload["rate"]
+            reverse = payload.get("reverse") or rate
+            group = self._groups.get(self._group_of.get(msg.container, ""))
+            self._retry.call(
+                self._tc_wrapper().set_bandwidth,
+                msg.container,
+                peer,
+                rate,
+                egress=group.egress if group is not None else None,
+                reverse=reverse,
+            )
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        # keep the matrix in the server's rate unit
+        bandwidth, unit = split_raw_str_rate(rate)
+        reverse_bandwidth, reverse_unit = split_raw_str_rate(reverse)
+        self._limits.set(
+            msg.container,
+            peer,
+            convert_rate(bandwidth, unit, self.rate_unit),
+            convert_rate(reverse_bandwidth, reverse_unit, self.rate_unit),
+        )
+        return None
+
+    def _collect_stats(self, container: str, peers: list[str], ts: float):
+        """Sample the htb class counters of one container.
+        With the exec backend the class of a peer shapes the traffic
+        from the container to the peer, with the host backend or ingress
+        shaping the traffic from the peer to the container.
+        """
+        if self._breaker.is_open(container):
+            return
+        runtime = get_runtime(self._run_with_sudo)
+        pairs = {}
+        try:
+            for peer in peers:
+                if peer == container:
+                    continue
+                classid = get_class_id(runtime.get_container_ip(peer))
+                if self._tc_wrapper().shapes_ingress:
+                    pairs[classid] = (peer, container)
+                else:
+                    pairs[classid] = (container, peer)
+            class_stats = self._tc_wrapper().get_class_stats(container)
+        except Exception as e:
+            logging.warning(f"Error sampling stats of {container}: {e}")
+            return
+        self._stats.record(ts, class_stats, pairs)
+
+    def _forget_container(self, container: str):
+        """Drop cached metadata, tc session and traffic stats of a
+        container."""
+        get_runtime(self._run_with_sudo).invalidate(container)
+        if self.backend == "exec":
+            TCCmdWrapper(self._run_with_sudo).close_session(container)
+        self._stats.forget(container)
+        self._breaker.forget(container)
 
     def _clear_one(self, container: str, check_exist: bool = False):
         """Clear tc rules for one container."""
         if check_exist:
-            if not DockerCmdWrapper(self._run_with_sudo).is_container_exist(
+            if not get_runtime(self._run_with_sudo).is_container_exist(
                 container
             ):
                 return
         try:
-            TCCmdWrapper(self._run_with_sudo).clear_one_container(container)
+            self._retry.call(self._tc_wrapper().clear_one_container, container)
         except ContainerNotFoundError:
             logging.error(f"Container {container} not found")
         except Exception as e:
@@ -0,0 +1,67 @@
+import asyncio
+import heapq
+import itertools
+from typing import Optional
+
+from .msg import CtrlMsg, CtrlAction
+
+__all__ = ["CtrlQueue"]
+
+# lower values are handled first, messages with the same
+# priority keep their arrival order. Messages changing containers share
+# the default priority, so e.g. a DEL never overtakes the ADD of the
+# same container; GET_STATS only reads.
+PRIORITIES = {
+    CtrlAction.STOP: 0,
+    CtrlAction.GET_STATS: 1,
+    CtrlAction.SET_BANDWIDTH: 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class CtrlQueue(asyncio.Queue):
+    """Priority aware queue of control messages.
+    - STOP is handled before other pending messages, GET_STATS before
+    the messages changing containers, which keep their arrival order.
+    - Periodic ticks (SET_BANDWIDTH) have the lowest priority, and at
+    most one tick per group is pending: new ticks collapse into the
+    pending one. Ticks of different groups keep their arrival order, so
+    groups are served round robin.
+    - Every new tick or STOP increases `round_id`, and the round of the
+    tick's group (every group for STOP). A round started for an older id
+    of its group is stale, and its unapplied remainder can be skipped.
+    """
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: list[tuple[int, int, CtrlMsg]] = []
+        self._seq = itertools.count()
+        self._ticks_pending: set[Optional[str]] = set()
+        self._group_rounds: dict[Optional[str], int] = {}
+        self.round_id = 0
+
+    def group_round(self, group: Optional[str] = None) -> int:
+        """Get the current round of a group."""
+        return self._group_rounds.get(group, 0)
+
+    def put_nowait(self, item: CtrlMsg):
+        if item.action == CtrlAction.STOP:
+            self.round_id += 1  # supersede the running rounds
+            for group in self._group_rounds:
+                self._group_rounds[group] += 1
+        elif item.action == CtrlAction.SET_BANDWIDTH:
+            self.round_id += 1
+            self._group_rounds[item.group] = self.group_round(item.group) + 1
+            if item.group in self._ticks_pending:
+                return  # coalesce with the pending tick
+            self._ticks_pending.add(item.group)
+        super().put_nowait(item)
+
+    def _put(self, item: CtrlMsg):
+        priority = PRIORITIES.get(item.action, DEFAULT_PRIORITY)
+        heapq.heappush(self._queue, (priority, next(self._seq), item))
+
+    def _get(self) -> CtrlMsg:
+        item = heapq.heappop(self._queue)[2]
+        if item.action == CtrlAction.SET_BANDWIDTH:
+            self._ticks_pending.discard(item.group)
+        return item
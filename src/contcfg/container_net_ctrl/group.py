@@ -0,0 +1,285 @@
+import math
+import random
+import itertools
+from collections.abc import Iterable
+from typing import Optional
+
+from ..cmd_wrapper.tc_batch import BLOCKED
+from ..cmd_wrapper.tc_base import (
+    TC_RATE32_MAX_BITS,
+    TC_UNIT_BITS,
+    split_raw_str_rate,
+)
+from .adaptive import AdaptivePolicy, MODES
+
+__all__ = ["ShapingGroup", "DEFAULT_GROUP", "interval_to_sec", "load_edges"]
+
+# group of the containers added without a group name
+DEFAULT_GROUP = "default"
+
+
+def interval_to_sec(interval: float, unit: str) -> float:
+    """Convert an interval to seconds.
+    Args:
+        - interval (float) : interval
+        - unit (str) : "s", "min" or "h". Only the first letter is checked.
+    """
+    if unit.startswith("s"):
+        return interval
+    elif unit.startswith("m"):
+        return interval * 60
+    elif unit.startswith("h"):
+        return interval * 3600
+    raise ValueError(f"Invalid interval unit {unit}")
+
+
+def load_edges(path: str) -> list[tuple[str, str]]:
+    """Read an edge list file, one "container1 container2" pair per
+    line. Blank lines and "#" comments are skipped."""
+    edges = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{n}: expected two containers")
+            edges.append((fields[0], fields[1]))
+    return edges
+
+
+def _edge(container1: str, container2: str) -> tuple[str, str]:
+    return min(container1, container2), max(container1, container2)
+
+
+class ShapingGroup:
+    """A named set of containers shaped with the same rate range and
+    interval. The bandwidth limits are only set between containers of
+    the same group, and a container belongs to one group at a time.
+    In "random" mode each tick draws new rates, in "adaptive" mode the
+    rates follow the measured throughput according to the policy.
+    A random tick may only update a fraction of the pairs, taken in turn
+    so that every pair is updated every 1 / fraction ticks, and a paced
+    group spreads the updates of a tick over its interval. A synced group
+    applies the updates of a tick in two phases instead, so that they all
+    land together.
+    With an egress budget, the peer classes of each member share a parent
+    class at that rate: a pair is guaranteed its rate and may borrow up
+    to the budget when the other peers are idle.
+    An asymmetric group draws or adapts the two directions of a pair
+    separately.
+    A sparse group only shapes the pairs of its edge list, the traffic
+    between the other members goes to the default class, which may be
+    given a rate or blocked.
+    Args:
+        - name (str) : group name
+        - min_rate (int) : minimum rate in rate_unit
+        - max_rate (int) : maximum rate in rate_unit
+        - interval_sec (float) : seconds between two random updates
+        - rate_unit (str, optional) : rate unit. Default is "mbit".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_rate: int,
+        max_rate: int,
+        interval_sec: float,
+        rate_unit: str = "mbit",
+    ):
+        self.name = name
+        # members in the order they joined, as an insertion-ordered set
+        self.containers: dict[str, None] = {}
+        # loop time of the next update, set by the server clock
+        self.next_tick: Optional[float] = None
+        self.mode = "random"
+        self.policy = AdaptivePolicy()
+        self.fraction = 1.0
+        self.pace = False
+        self.sync = False
+        # total rate of the peer classes of a member, e.g. "1gbit"
+        self.egress: Optional[str] = None
+        self.asymmetric = False
+        # shaped pairs as (min, max), None for all pairs
+        self.edges: Optional[set[tuple[str, str]]] = None
+        # rate of the traffic outside the edges, or BLOCKED
+        self.default_rate: Optional[str] = None
+        # seconds over which the changes of the last synced tick landed
+        self.last_skew: Optional[float] = None
+        self._cursor = 0  # index of the next pair of a rolling update
+        self.configure(min_rate, max_rate, interval_sec, rate_unit)
+
+    @classmethod
+    def from_payload(cls, name: str, payload: dict) -> "ShapingGroup":
+        """Create a group from a CREATE_GROUP payload."""
+        group = cls(name, 0, 0, 0)
+        group.modify(payload, required=True)
+        return group
+
+    def configure(
+        self,
+        min_rate: int,
+        max_rate: int,
+        interval_sec: float,
+        rate_unit: str = "mbit",
+    ):
+        if min_rate > max_rate:
+            raise ValueError(f"min_rate {min_rate} > max_rate {max_rate}")
+        if max_rate * TC_UNIT_BITS[rate_unit] > TC_RATE32_MAX_BITS:
+            raise ValueError(
+                f"max_rate {max_rate}{rate_unit} is above the 32-bit rate "
+                "limit of tc"
+            )
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.interval_sec = interval_sec
+        self.rate_unit = rate_unit
+
+    def modify(self, payload: dict, required: bool = False):
+        """Update the group from a CREATE_GROUP or MODIFY_GROUP payload.
+        Args:
+            - payload (dict) : "min_rate" and "max_rate" as rate strings
+            with the same unit, e.g. "10mbit", "interval" and
+            "interval_unit" (default "min"), "mode", "fraction", "pace",
+            "sync", "egress" (a rate, "" to remove the budget),
+            "asymmetric", "edges" (a list of container pairs, "all" for
+            all pairs), "default_rate" (a rate or "blocked", "" to leave the
+            traffic outside the edges alone) and the keys of
+            AdaptivePolicy.modified. Missing keys are kept.
+            - required (bool, optional) : all keys but interval_unit must
+            be given. Default is False.
+        """
+        if required:
+            missing = {"min_rate", "max_rate", "interval"} - set(payload)
+            if missing:
+                raise ValueError(f"Missing {', '.join(sorted(missing))}")
+        min_rate, max_rate = self.min_rate, self.max_rate
+        rate_unit = self.rate_unit
+        if "min_rate" in payload or "max_rate" in payload:
+            if not {"min_rate", "max_rate"} <= set(payload):
+                raise ValueError("min_rate and max_rate go together")
+            min_rate, rate_unit = split_raw_str_rate(payload["min_rate"])
+            max_rate, max_unit = split_raw_str_rate(payload["max_rate"])
+            if max_unit != rate_unit:
+                raise ValueError("Rate units do not match")
+        interval_sec = self.interval_sec
+        if "interval" in payload:
+            interval_sec = interval_to_sec(
+                payload["interval"], payload.get("interval_unit", "min")
+            )
+            if interval_sec <= 0:
+                raise ValueError(f"Invalid interval {payload['interval']}")
+        mode = payload.get("mode", self.mode)
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode {mode}. Valid modes are {MODES}")
+        fraction = payload.get("fraction", self.fraction)
+        if not 0 < fraction <= 1:
+            raise ValueError(f"Invalid fraction {fraction}")
+        pace = bool(payload.get("pace", self.pace))
+        sync = bool(payload.get("sync", self.sync))
+        if pace and sync:
+            raise ValueError("pace and sync cannot be used together")
+        egress = payload.get("egress", self.egress) or None
+        if egress is not None:
+            rate, unit = split_raw_str_rate(egress)
+            if rate <= 0 or rate * TC_UNIT_BITS[unit] > TC_RATE32_MAX_BITS:
+                raise ValueError(f"Invalid egress budget {egress}")
+        asymmetric = bool(payload.get("asymmetric", self.asymmetric))
+        edges = self.edges
+        if "edges" in payload:
+            edges = self._parse_edges(payload["edges"])
+        default_rate = payload.get("default_rate", self.default_rate) or None
+        if default_rate is not None and default_rate != BLOCKED:
+            rate, unit = split_raw_str_rate(default_rate)
+            if rate <= 0 or rate * TC_UNIT_BITS[unit] > TC_RATE32_MAX_BITS:
+                raise ValueError(f"Invalid default rate {default_rate}")
+        policy = self.policy.modified(payload)
+        self.configure(min_rate, max_rate, interval_sec, rate_unit)
+        self.mode = mode
+        self.policy = policy
+        self.fraction = fraction
+        self.pace = pace
+        self.sync = sync
+        self.egress = egress
+        self.asymmetric = asymmetric
+        self.edges = edges
+        self.default_rate = default_rate
+
+    def random_rate(self) -> int:
+        return random.randint(self.min_rate, self.max_rate)
+
+    def random_rates(self) -> tuple[int, int]:
+        """Get the rates of both directions of a pair, drawn separately
+        if the group is asymmetric."""
+        rate = self.random_rate()
+        return rate, self.random_rate() if self.asymmetric else rate
+
+    def pairs(self) -> list[tuple[str, str]]:
+        """Get the shaped pairs of members, in a stable order. Only the
+        edges are walked in a sparse group."""
+        if self.edges is None:
+            return list(itertools.combinations(self.containers, 2))
+        members = self.containers
+        return sorted(
+            (c1, c2) for c1, c2 in self.edges if c1 in members and c2 in members
+        )
+
+    def is_edge(self, container1: str, container2: str) -> bool:
+        """Check if the pair of two members is shaped."""
+        return self.edges is None or _edge(container1, container2) in self.edges
+
+    def neighbors(self, container: str, peers: Iterable[str]) -> list[str]:
+        """Get the peers whose pair with container is shaped."""
+        return [
+            peer
+            for peer in peers
+            if peer != container and self.is_edge(container, peer)
+        ]
+
+    def rolling_pairs(self, pairs: list) -> list:
+        """Get the pairs to update on this tick.
+        With a fraction below 1, the next `fraction` of the pairs is
+        taken from where the previous tick stopped.
+        Args:
+            - pairs (list) : all pairs of the group, in a stable order
+        """
+        if self.fraction >= 1 or not pairs:
+            return pairs
+        count = max(1, math.ceil(self.fraction * len(pairs)))
+        start = self._cursor % len(pairs)
+        self._cursor = start + count
+        return [pairs[(start + k) % len(pairs)] for k in range(count)]
+
+    def info(self) -> dict:
+        return {
+            "min_rate": self.min_rate,
+            "max_rate": self.max_rate,
+            "rate_unit": self.rate_unit,
+            "interval_sec": self.interval_sec,
+            "mode": self.mode,
+            "fraction": self.fraction,
+            "pace": self.pace,
+            "sync": self.sync,
+            "skew": self.last_skew,
+            "egress": self.egress,
+            "asymmetric": self.asymmetric,
+            "edges": None if self.edges is None else len(self.edges),
+            "default_rate": self.default_rate,
+            **self.policy.info(),
+            "containers": list(self.containers),
+        }
+
+    @staticmethod
+    def _parse_edges(edges) -> Optional[set[tuple[str, str]]]:
+        if edges is None or edges == "all":
+            return None
+        parsed = set()
+        for edge in edges:
+            if (
+                not isinstance(edge, (list, tuple))
+                or len(edge) != 2
+                or edge[0] == edge[1]
+            ):
+                raise ValueError(f"Invalid edge {edge}")
+            parsed.add(_edge(*edge))
+        return parsed
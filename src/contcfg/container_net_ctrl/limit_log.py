@@ -0,0 +1,194 @@
+import os
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+__all__ = ["LimitLog", "LimitLogReader", "RECORD", "NO_LIMIT"]
+
+MAGIC = b"CTCFLIM1"
+# magic, then the rate unit padded with zeros
+HEADER = struct.Struct("<8s8s")
+# time.time() of the change, index of the sender and of the receiver in
+# the names file, rate in the unit of the header
+RECORD = struct.Struct("<dIIQ")
+# rate of a pair whose limit was removed. 0 is a valid rate, so the
+# largest value of the rate field is used instead.
+NO_LIMIT = 2**64 - 1
+
+
+def names_path(path: str) -> str:
+    """Path of the file mapping the indexes of a log to container names."""
+    return path + ".names"
+
+
+class LimitLog:
+    """Append-only binary log of the rates applied between containers.
+    Each change is a fixed-width record, packed into a buffer and written
+    in bulk once `buffer_size` records are pending or `flush_interval`
+    seconds passed since the last write. Container names are stored once
+    in a names file next to the log, one per line, the line number being
+    the index used in the records. A name is written before the first
+    record using it, so a log is readable up to any point where it was
+    cut. Appending to an existing log keeps its names. All methods are
+    thread safe.
+    Args:
+        - path (str) : path of the log
+        - rate_unit (str, optional) : unit of the rates. Default is "mbit".
+        - buffer_size (int, optional) : records buffered before a write.
+        Default is 4096.
+        - flush_interval (float, optional) : seconds after which pending
+        records are written anyway. Default is 5.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        rate_unit: str = "mbit",
+        buffer_size: int = 4096,
+        flush_interval: float = 5,
+    ):
+        self.path = path
+        self.rate_unit = rate_unit
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._names: dict[str, int] = {}
+        self._new_names: list[str] = []
+        self._buffer = bytearray()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._open()
+
+    def record(self, container1: str, container2: str, rate: int):
+        """Log the rate now in force from container1 to container2,
+        NO_LIMIT once the limit is removed."""
+        with self._lock:
+            self._buffer += RECORD.pack(
+                time.time(),
+                self._index(container1),
+                self._index(container2),
+                rate,
+            )
+            self._pending += 1
+            if (
+                self._pending >= self.buffer_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def flush(self):
+        """Write the pending records."""
+        with self._lock:
+            self._flush()
+
+    def _open(self):
+        """Write the header of a new log, or check and load an existing
+        one."""
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "rb") as f:
+                magic, unit = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a limit log")
+            unit = unit.rstrip(b"\0").decode()
+            if unit != self.rate_unit:
+                raise ValueError(
+                    f"{self.path} holds rates in {unit}, not {self.rate_unit}"
+                )
+            if os.path.exists(names_path(self.path)):
+                with open(names_path(self.path)) as f:
+                    names = f.read().splitlines()
+                self._names = {name: i for i, name in enumerate(names)}
+            return
+        with open(self.path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.rate_unit.encode()))
+        open(names_path(self.path), "w").close()
+
+    def _index(self, container: str) -> int:
+        if container not in self._names:
+            self._names[container] = len(self._names)
+            self._new_names.append(container)
+        return self._names[container]
+
+    def _flush(self):
+        if self._new_names:
+            with open(names_path(self.path), "a") as f:
+                f.writelines(f"{name}\n" for name in self._new_names)
+            self._new_names = []
+        if self._buffer:
+            with open(self.path, "ab") as f:
+                f.write(self._buffer)
+            self._buffer = bytearray()
+            self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+class LimitLogReader:
+    """Memory-mapped reader of a LimitLog, needs numpy.
+    The records are mapped as a structured array with the fields "ts",
+    "src", "dst" and "rate", so only the pages that are used are read.
+    A record cut by a crash at the end of the log is ignored. Records
+    are in the order they were logged, which is the order of their
+    timestamps unless the wall clock was set back.
+    Args:
+        - path (str) : path of the log
+    """
+
+    def __init__(self, path: str):
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError(
+                "LimitLogReader needs numpy, install contcfg[analysis]"
+            ) from e
+        with open(path, "rb") as f:
+            magic, unit = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a limit log")
+        self.rate_unit = unit.rstrip(b"\0").decode()
+        with open(names_path(path)) as f:
+            self.containers = f.read().splitlines()
+        self._index = {name: i for i, name in enumerate(self.containers)}
+        self.dtype = np.dtype(
+            [("ts", "<f8"), ("src", "<u4"), ("dst", "<u4"), ("rate", "<u8")]
+        )
+        count = (os.path.getsize(path) - HEADER.size) // self.dtype.itemsize
+        self.records: np.ndarray = (
+            np.memmap(
+                path, self.dtype, "r", offset=HEADER.size, shape=(count,)
+            )
+            if count
+            else np.empty(0, self.dtype)
+        )
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def between(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> "np.ndarray":
+        """Get the records logged in [start, end), as a view."""
+        ts = self.records["ts"]
+        lo = 0 if start is None else int(ts.searchsorted(start, "left"))
+        hi = len(ts) if end is None else int(ts.searchsorted(end, "left"))
+        return self.records[lo:hi]
+
+    def pair(self, container1: str, container2: str) -> "np.ndarray":
+        """Get the records of the rate from container1 to container2."""
+        src, dst = self._index[container1], self._index[container2]
+        records = self.records
+        return records[(records["src"] == src) & (records["dst"] == dst)]
+
+    def rate_at(
+        self, container1: str, container2: str, ts: float
+    ) -> Optional[int]:
+        """Get the rate in force from container1 to container2 at ts,
+        None if no limit was set."""
+        records = self.pair(container1, container2)
+        i = int(records["ts"].searchsorted(ts, "right"))
+        if not i or records["rate"][i - 1] == NO_LIMIT:
+            return None
+        return int(records["rate"][i - 1])
@@ -0,0 +1,224 @@
+import threading
+from array import array
+from collections.abc import Iterator
+from typing import Optional
+
+from .limit_log import NO_LIMIT, LimitLog
+
+__all__ = ["LimitMatrix"]
+
+UNSET = -1
+
+
+class LimitMatrix:
+    """Bandwidth limits between containers stored in a dense rate matrix.
+    Each container is mapped to an integer index, and the rate from
+    container i to container j is kept at cell i * capacity + j of a
+    preallocated array, so set and lookup are O(1). Indexes of removed
+    containers are reused. All methods are thread safe.
+    Args:
+        - capacity (int, optional) : initial number of containers.
+        The matrix doubles its capacity when full. Default is 16.
+        - log (LimitLog, optional) : log of every rate change, the
+        limits of a removed container are logged as NO_LIMIT.
+        Default is None.
+    """
+
+    def __init__(self, capacity: int = 16, log: Optional[LimitLog] = None):
+        self._capacity = max(capacity, 1)
+        self._rates = array("q", [UNSET]) * (self._capacity**2)
+        self._index: dict[str, int] = {}
+        self._free: list[int] = []
+        self._next = 0  # next never used index
+        # number of pairs per rate, for the summary
+        self._rate_counts: dict[int, int] = {}
+        self._changed = 0
+        self._log = log
+        self._lock = threading.RLock()
+
+    def __contains__(self, container: object) -> bool:
+        with self._lock:
+            return container in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def containers(self) -> list[str]:
+        """Get the containers in the order they were added."""
+        with self._lock:
+            return list(self._index)
+
+    def index(self, container: str) -> int:
+        """Get the index of a container."""
+        with self._lock:
+            return self._index[container]
+
+    def add(self, container: str) -> int:
+        """Add a container and return its index."""
+        with self._lock:
+            if container in self._index:
+                return self._index[container]
+            if self._free:
+                i = self._free.pop()
+            else:
+                if self._next == self._capacity:
+                    self._grow()
+                i = self._next
+                self._next += 1
+            self._index[container] = i
+            return i
+
+    def remove(self, container: str):
+        """Remove a container and all its limits."""
+        with self._lock:
+            i = self._index.pop(container, None)
+            if i is None:
+                return
+            for other, j in self._index.items():
+                if self._log is not None:
+                    self._log_removed(container, i, other, j)
+                self._clear(i, j)
+                self._clear(j, i)
+            self._free.append(i)
+
+    def set(
+        self,
+        container1: str,
+        container2: str,
+        rate: int,
+        reverse: Optional[int] = None,
+    ) -> bool:
+        """Set the rates between two containers.
+        Args:
+            - container1 (str) : container name or id
+            - container2 (str) : container name or id
+            - rate (int) : rate from container1 to container2
+            - reverse (int, optional) : rate from container2 to
+            container1. Default is None (rate).
+
+        Returns:
+            - bool : False if one of the containers is not in the matrix.
+        """
+        with self._lock:
+            i = self._index.get(container1)
+            j = self._index.get(container2)
+            if i is None or j is None:
+                return False
+            reverse = rate if reverse is None else reverse
+            self._set(i, j, rate)
+            self._set(j, i, reverse)
+            self._changed += 1
+            if self._log is not None:
+                self._log.record(container1, container2, rate)
+                self._log.record(container2, container1, reverse)
+            return True
+
+    def unset(self, container1: str, container2: str):
+        """Remove the rates between two containers, in both directions."""
+        with self._lock:
+            i = self._index.get(container1)
+            j = self._index.get(container2)
+            if i is None or j is None:
+                return
+            if self._log is not None:
+                self._log_removed(container1, i, container2, j)
+            self._clear(i, j)
+            self._clear(j, i)
+            self._changed += 1
+
+    def get(self, container1: str, container2: str) -> Optional[int]:
+        """Get the rate from container1 to container2, None if unset."""
+        with self._lock:
+            i = self._index.get(container1)
+            j = self._index.get(container2)
+            if i is None or j is None:
+                return None
+            rate = self._rates[i * self._capacity + j]
+            return None if rate == UNSET else rate
+
+    def pairs(self) -> Iterator[tuple[str, str, int]]:
+        """Iterate over (container1, container2, rate) of all set pairs,
+        with the rate from container1 to container2."""
+        with self._lock:
+            items = list(self._index.items())
+            out = []
+            for a, (container1, i) in enumerate(items):
+                for container2, j in items[a + 1 :]:
+                    rate = self._rates[i * self._capacity + j]
+                    if rate != UNSET:
+                        out.append((container1, container2, rate))
+        return iter(out)
+
+    def flush_log(self):
+        """Write the pending records of the log."""
+        if self._log is not None:
+            self._log.flush()
+
+    def log_cleared(self):
+        """Log all the limits as removed, once their rules are cleared
+        while the containers are kept."""
+        if self._log is None:
+            return
+        with self._lock:
+            items = list(self._index.items())
+            for a, (container1, i) in enumerate(items):
+                for container2, j in items[a + 1 :]:
+                    self._log_removed(container1, i, container2, j)
+
+    def summary(self) -> dict:
+        """Get a bounded summary of the limits, and reset the number of
+        pairs changed since the last summary.
+
+        Returns:
+            - summary (dict) : containers, pairs, min, max, mean, changed
+        """
+        with self._lock:
+            # both directions of a pair are counted
+            pairs = sum(self._rate_counts.values()) // 2
+            total = sum(r * n for r, n in self._rate_counts.items()) // 2
+            summary = {
+                "containers": len(self._index),
+                "pairs": pairs,
+                "min": min(self._rate_counts, default=None),
+                "max": max(self._rate_counts, default=None),
+                "mean": total / pairs if pairs else None,
+                "changed": self._changed,
+            }
+            self._changed = 0
+            return summary
+
+    def _log_removed(self, container1: str, i: int, container2: str, j: int):
+        assert self._log is not None
+        if self._rates[i * self._capacity + j] != UNSET:
+            self._log.record(container1, container2, NO_LIMIT)
+        if self._rates[j * self._capacity + i] != UNSET:
+            self._log.record(container2, container1, NO_LIMIT)
+
+    def _set(self, i: int, j: int, rate: int):
+        cell = i * self._capacity + j
+        self._uncount(self._rates[cell])
+        self._rates[cell] = rate
+        self._rate_counts[rate] = self._rate_counts.get(rate, 0) + 1
+
+    def _clear(self, i: int, j: int):
+        cell = i * self._capacity + j
+        self._uncount(self._rates[cell])
+        self._rates[cell] = UNSET
+
+    def _uncount(self, rate: int):
+        if rate == UNSET:
+            return
+        self._rate_counts[rate] -= 1
+        if not self._rate_counts[rate]:
+            del self._rate_counts[rate]
+
+    def _grow(self):
+        """Double the capacity, keeping the rates of all indexes."""
+        old, old_capacity = self._rates, self._capacity
+        self._capacity *= 2
+        self._rates = array("q", [UNSET]) * (self._capacity**2)
+        for i in range(old_capacity):
+            row = old[i * old_capacity : (i + 1) * old_capacity]
+            start = i * self._capacity
+            self._rates[start : start + old_capacity] = row
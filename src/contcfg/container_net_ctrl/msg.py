@@ -1,6 +1,9 @@
 from enum import Enum
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:  # asyncio is not needed by clients
+    import asyncio
 
 
 class CtrlAction(Enum):
@@ -8,9 +11,34 @@ class CtrlAction(Enum):
     ADD_CONTAINER = 2  # add a new container to monitor
     DEL_CONTAINER = 3  # remove a container from monitoring
     STOP = 4  # stop monitoring and adjusting network
+    GET_STATS = 5  # get sampled traffic counters of container pairs
+    SET_LIMIT = 6  # set the bandwidth limit between two containers now
+    CLEAR_LIMIT = 7  # clear the tc rules of a container now
+    CREATE_GROUP = 8  # create a shaping group
+    MODIFY_GROUP = 9  # change the rates or interval of a shaping group
+    DESTROY_GROUP = 10  # remove a shaping group and its containers
+    LIST_GROUPS = 11  # get the config and members of all shaping groups
 
 
 @dataclass
 class CtrlMsg:
     action: CtrlAction
     container: Optional[str] = None
+    # action specific arguments
+    payload: Optional[dict] = None
+    # shaping group, None for the default group
+    group: Optional[str] = None
+    # set by clients expecting a CtrlReply, which carries the same id
+    request_id: Optional[int] = None
+    # set by the server when the message is received, never sent
+    reply: Optional["asyncio.Future"] = field(
+        default=None, repr=False, compare=False
+    )
+
+
+@dataclass
+class CtrlReply:
+    request_id: int
+    ok: bool = True
+    result: Any = None
+    error: Optional[str] = None
@@ -0,0 +1,51 @@
+import time
+from typing import Callable
+
+__all__ = ["TokenBucket", "PACE_SPAN"]
+
+# share of the interval over which a paced tick spreads its updates,
+# leaving some slack before the next tick
+PACE_SPAN = 0.9
+
+
+class TokenBucket:
+    """Token bucket pacing operations at a steady rate.
+    Tokens are reserved ahead: `reserve` always succeeds and tells how
+    long the caller has to wait before using its token, so the bucket
+    never sleeps itself and the caller can give up while waiting.
+    Args:
+        - rate (float) : tokens per second
+        - burst (float, optional) : tokens available at once. Default is 1.
+        - clock (Callable, optional) : time source in seconds. Default is
+        time.monotonic, the clock of the asyncio loop.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError(f"Invalid rate {rate}")
+        if burst <= 0:
+            raise ValueError(f"Invalid burst {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._last = clock()
+
+    def reserve(self, n: float = 1) -> float:
+        """Take n tokens.
+
+        Returns:
+            - delay (float) : seconds to wait before the tokens are due
+        """
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last) * self.rate
+        )
+        self._last = now
+        self._tokens -= n
+        return max(0.0, -self._tokens / self.rate)
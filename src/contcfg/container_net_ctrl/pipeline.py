@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Hashable, Iterable
+from typing import Callable
+
+__all__ = ["CtrlPipeline", "container_key", "pair_key"]
+
+
+def container_key(container: str) -> tuple:
+    """Key of the operations on the whole tc tree of a container."""
+    return ("container", container)
+
+
+def pair_key(container1: str, container2: str) -> tuple:
+    """Key of the operations on the limit between two containers."""
+    return ("pair", min(container1, container2), max(container1, container2))
+
+
+class CtrlPipeline:
+    """Runs control operations concurrently.
+    Each operation is started with the keys of the state it touches,
+    e.g. `pair_key(c1, c2)`. Operations sharing a key run in the order
+    they were started, the others overlap. An operation only waits for
+    the operations started before it, so there is no deadlock.
+    """
+
+    def __init__(self) -> None:
+        # key -> done future of the last operation started with it
+        self._tails: dict[Hashable, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(
+        self,
+        keys: Iterable[Hashable],
+        func: Callable[..., Awaitable],
+        *args,
+    ) -> asyncio.Task:
+        """Run `func(*args)` once all the operations started before
+        with one of keys are done. Keys are reserved right away, so the
+        order of the calls is the order of the operations."""
+        keys = set(keys)
+        loop = asyncio.get_running_loop()
+        deps = {self._tails[key] for key in keys if key in self._tails}
+        done = loop.create_future()
+        for key in keys:
+            self._tails[key] = done
+
+        async def run():
+            try:
+                if deps:
+                    await asyncio.wait(deps)
+                return await func(*args)
+            finally:
+                done.set_result(None)
+                for key in keys:
+                    if self._tails.get(key) is done:
+                        del self._tails[key]
+
+        task = loop.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    async def join(self):
+        """Wait for all the running operations."""
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                "Control operation failed", exc_info=task.exception()
+            )
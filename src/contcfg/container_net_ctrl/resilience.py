@@ -0,0 +1,114 @@
+import time
+import random
+import logging
+import subprocess
+import threading
+from typing import Callable, TypeVar
+
+from ..cmd_wrapper import CommandTimeoutError
+
+__all__ = ["RetryPolicy", "CircuitBreaker", "TRANSIENT_ERRORS"]
+
+T = TypeVar("T")
+
+# errors worth a retry. ContainerNotFoundError and RateValueError
+# will fail the same way again. A lost connection to the privileged
+# helper is reopened by the retry.
+TRANSIENT_ERRORS = (
+    CommandTimeoutError,
+    subprocess.CalledProcessError,
+    ConnectionError,
+)
+
+
+class RetryPolicy:
+    """Retry transient failures with a jittered exponential backoff.
+    Args:
+        - retries (int, optional) : retries after the first attempt.
+        Default is 2.
+        - backoff (float, optional) : delay before the first retry in
+        seconds, doubled for each retry. Default is 0.5.
+        - max_backoff (float, optional) : maximum delay. Default is 10.
+    """
+
+    def __init__(
+        self, retries: int = 2, backoff: float = 0.5, max_backoff: float = 10
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Call func, retrying on TRANSIENT_ERRORS. The last error is
+        raised when all attempts failed."""
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.5)
+                logging.debug(f"Retry in {delay:.2f}s after error: {e}")
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+class CircuitBreaker:
+    """Per container circuit breaker.
+    After `threshold` consecutive failures a container is skipped for
+    `cooldown` seconds. Then one attempt is let through: a success closes
+    the breaker, a failure opens it again. Thread safe.
+    Args:
+        - threshold (int, optional) : consecutive failures opening the
+        breaker. Default is 3.
+        - cooldown (float, optional) : seconds a container is skipped.
+        Default is 60.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, container: str) -> bool:
+        """Check whether operations on container may run."""
+        with self._lock:
+            until = self._open_until.get(container)
+            if until is None:
+                return True
+            if time.monotonic() < until:
+                return False
+            # half open: let one attempt through, and block the others
+            # until it has been recorded
+            self._open_until[container] = time.monotonic() + self.cooldown
+            return True
+
+    def record_success(self, container: str):
+        with self._lock:
+            self._failures.pop(container, None)
+            self._open_until.pop(container, None)
+
+    def record_failure(self, container: str):
+        with self._lock:
+            failures = self._failures.get(container, 0) + 1
+            self._failures[container] = failures
+            if failures >= self.threshold:
+                if container not in self._open_until:
+                    logging.warning(
+                        f"Container {container} failed {failures} times in a "
+                        f"row, skipping it for {self.cooldown}s"
+                    )
+                self._open_until[container] = time.monotonic() + self.cooldown
+
+    def is_open(self, container: str) -> bool:
+        with self._lock:
+            until = self._open_until.get(container)
+            return until is not None and time.monotonic() < until
+
+    def forget(self, container: str):
+        with self._lock:
+            self._failures.pop(container, None)
+            self._open_until.pop(container, None)
@@ -0,0 +1,130 @@
+import threading
+from array import array
+from typing import Optional
+
+__all__ = ["PairRingBuffer", "TrafficStats"]
+
+
+class PairRingBuffer:
+    """Fixed size ring buffer of counter samples for one container pair.
+    Samples are kept in preallocated arrays, so the memory used by a pair
+    does not grow over time.
+    Args:
+        - capacity (int) : number of samples kept
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity {capacity}")
+        self.capacity = capacity
+        self._ts = array("d", bytes(8 * capacity))
+        self._bytes = array("Q", bytes(8 * capacity))
+        self._packets = array("Q", bytes(8 * capacity))
+        self._drops = array("Q", bytes(8 * capacity))
+        self._next = 0  # index of the next sample to write
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, ts: float, nbytes: int, packets: int, drops: int):
+        """Append a sample, overwriting the oldest one when full."""
+        i = self._next
+        self._ts[i] = ts
+        self._bytes[i] = nbytes
+        self._packets[i] = packets
+        self._drops[i] = drops
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def samples(
+        self, last: Optional[int] = None
+    ) -> list[tuple[float, int, int, int]]:
+        """Get samples from the oldest to the newest.
+        Args:
+            - last (int, optional) : only return the newest `last` samples.
+
+        Returns:
+            - samples (list) : (timestamp, bytes, packets, drops) tuples
+        """
+        n = self._size if last is None else min(last, self._size)
+        start = (self._next - n) % self.capacity
+        out = []
+        for k in range(n):
+            i = (start + k) % self.capacity
+            out.append(
+                (self._ts[i], self._bytes[i], self._packets[i], self._drops[i])
+            )
+        return out
+
+
+class TrafficStats:
+    """Per pair traffic counters sampled from the htb classes.
+    A pair (src, dst) holds the counters of the traffic from src to dst.
+    Args:
+        - capacity (int, optional) : samples kept per pair. Default is 360.
+    """
+
+    def __init__(self, capacity: int = 360):
+        self.capacity = capacity
+        self._buffers: dict[tuple[str, str], PairRingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        ts: float,
+        class_stats: dict[str, tuple[int, int, int]],
+        pairs: dict[str, tuple[str, str]],
+    ):
+        """Record the counters of one container's classes.
+        Args:
+            - ts (float) : sample timestamp
+            - class_stats (dict) : classid -> (bytes, packets, drops)
+            - pairs (dict) : classid -> (src, dst) of the shaped traffic.
+            Classes not in pairs, e.g. the default class, are ignored.
+        """
+        with self._lock:
+            for classid, (nbytes, packets, drops) in class_stats.items():
+                pair = pairs.get(classid)
+                if pair is None:
+                    continue
+                buffer = self._buffers.get(pair)
+                if buffer is None:
+                    buffer = PairRingBuffer(self.capacity)
+                    self._buffers[pair] = buffer
+                buffer.append(ts, nbytes, packets, drops)
+
+    def forget(self, container: str):
+        """Drop the buffers of all pairs involving a container."""
+        with self._lock:
+            for pair in [p for p in self._buffers if container in p]:
+                del self._buffers[pair]
+
+    def query(
+        self, container: Optional[str] = None, last: Optional[int] = None
+    ) -> dict[tuple[str, str], list[tuple[float, int, int, int]]]:
+        """Get samples per pair.
+        Args:
+            - container (str, optional) : only pairs involving container.
+            - last (int, optional) : only the newest `last` samples per pair.
+        """
+        with self._lock:
+            return {
+                pair: buffer.samples(last)
+                for pair, buffer in self._buffers.items()
+                if container is None or container in pair
+            }
+
+    def throughput(self, src: str, dst: str) -> Optional[float]:
+        """Get the throughput from src to dst between the two newest
+        samples, in bits per second. None if there are fewer than two
+        samples or the counters were reset.
+        """
+        with self._lock:
+            buffer = self._buffers.get((src, dst))
+            if buffer is None or len(buffer) < 2:
+                return None
+            (ts0, nbytes0, _, _), (ts, nbytes, _, _) = buffer.samples(2)
+        if ts <= ts0 or nbytes < nbytes0:
+            return None
+        return (nbytes - nbytes0) * 8 / (ts - ts0)
@@ -2,8 +2,9 @@ import argparse
 import sys
 import os
 import contcfg
-from contcfg import ConNetServer, ConNetController, TCCmdWrapper
-from contcfg.cmd_wrapper import split_raw_str_rate
+
+# Sub-commands import what they need when they run, so that e.g.
+# `contcfg cli` does not load the asyncio server.
 
 __version__ = contcfg.__version__
 
@@ -29,6 +30,9 @@ def handle_exception(func):
 
 @handle_exception
 def start_server(args, run_with_sudo):
+    from contcfg.container_net_ctrl import ConNetServer
+    from contcfg.cmd_wrapper import split_raw_str_rate
+
     min_rate, min_unit = split_raw_str_rate(args.min_rate)
     max_rate, max_unit = split_raw_str_rate(args.max_rate)
     if min_unit != max_unit:
@@ -39,43 +43,305 @@ def start_server(args, run_with_sudo):
         args.interval,
         rate_unit=min_unit,
         interval_unit="min",
+        backend=args.backend,
+        runtime=args.runtime,
+        stats_interval=args.stats_interval,
+        cmd_timeout=args.cmd_timeout,
+        max_retries=args.max_retries,
+        mtu=args.mtu,
+        hz=args.hz,
+        fq_codel=args.fq_codel,
+        ingress=args.ingress,
+        limit_log=args.limit_log,
+        helper_socket=args.helper_socket,
         _server_socket_path=args.socket_path,
         _run_with_sudo=run_with_sudo,
+        **update_options(args),
     )
     server.start()
 
 
 @handle_exception
 def ctrl(args, run_with_sudo):
+    from contcfg.container_net_ctrl import ConNetController
+
     sender = ConNetController(
-        _socket_path=args.socket_path, _run_with_sudo=run_with_sudo
+        _socket_path=args.socket_path,
+        _run_with_sudo=run_with_sudo,
+        _runtime=args.runtime,
     )
     if args.ctrl_command == "add":
-        sender.add_container(args.container)
+        sender.add_container(args.container, args.group)
     elif args.ctrl_command == "del":
         sender.del_container(args.container)
     elif args.ctrl_command == "add-all":
-        sender.add_all_containers(args.prefix)
+        sender.add_all_containers(args.prefix, args.group)
+    elif args.ctrl_command == "stats":
+        print_stats(sender.get_stats(args.container, args.last))
+    elif args.ctrl_command == "group-create":
+        sender.create_group(
+            args.name,
+            args.min_rate,
+            args.max_rate,
+            args.interval,
+            **update_options(args),
+        )
+    elif args.ctrl_command == "group-modify":
+        sender.modify_group(
+            args.name,
+            args.min_rate,
+            args.max_rate,
+            args.interval,
+            **update_options(args),
+        )
+    elif args.ctrl_command == "group-destroy":
+        sender.destroy_group(args.name)
+    elif args.ctrl_command == "groups":
+        for name, info in sender.list_groups().items():
+            line = (
+                f"{name}: {info['min_rate']}-{info['max_rate']}"
+                f"{info['rate_unit']} every {info['interval_sec']}s, "
+                f"{info['mode']}, {len(info['containers'])} containers"
+            )
+            ready = info.get("ready")
+            if ready is not None and ready < len(info["containers"]):
+                line += f" ({ready} ready)"
+            if info.get("egress"):
+                line += f", egress {info['egress']}"
+            if info.get("asymmetric"):
+                line += ", asymmetric"
+            if info.get("edges") is not None:
+                line += f", {info['edges']} edges"
+            if info.get("default_rate"):
+                line += f", default {info['default_rate']}"
+            if info["skew"] is not None:
+                line += f", skew {info['skew'] * 1000:.2f}ms"
+            print(line)
     sender.stop()
 
 
+def print_stats(stats):
+    """Print the newest sample and the throughput of each pair."""
+    for (src, dst), samples in sorted(stats.items()):
+        if not samples:
+            continue
+        ts, nbytes, packets, drops = samples[-1]
+        line = f"{src} --> {dst} : {nbytes} bytes {packets} pkt {drops} drops"
+        if len(samples) > 1:
+            ts0, nbytes0 = samples[-2][:2]
+            if ts > ts0:
+                line += f" ({(nbytes - nbytes0) * 8 / (ts - ts0):.0f} bit/s)"
+        print(line)
+
+
 @handle_exception
 def stop_server(args, run_with_sudo):
+    from contcfg.container_net_ctrl import ConNetController
+
     sender = ConNetController(
         _socket_path=args.socket_path, _run_with_sudo=run_with_sudo
     )
     sender.stop_server()
 
 
+@handle_exception
+def start_helper(args):
+    import pwd
+    from contcfg.cmd_wrapper import PrivHelper
+
+    if not is_running_as_root():
+        raise PermissionError("The helper must run as root")
+    # the user who ran sudo by default
+    user = args.user or os.environ.get("SUDO_UID")
+    uid = None
+    if user is not None:
+        uid = int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid
+    with PrivHelper(args.helper_socket, uid) as helper:
+        print(f"Helper listening on {args.helper_socket}")
+        try:
+            helper.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
 @handle_exception
 def run_cli(args, run_with_sudo):
+    sender = connect_server(args.socket_path, run_with_sudo)
+    if sender is not None:
+        # a running server applies the request with its warm metadata
+        # cache and executor
+        try:
+            if args.cli_command == "set":
+                sender.set_bandwidth(
+                    args.container1,
+                    args.container2,
+                    args.bandwidth,
+                    args.reverse,
+                )
+            elif args.cli_command == "clear":
+                for c in args.containers:
+                    sender.clear_container(c)
+        finally:
+            sender.stop()
+        return
+
+    from contcfg.cmd_wrapper import TCCmdWrapper, HostTCCmdWrapper, set_runtime
+
+    set_runtime(args.runtime)
+    if args.backend == "host":
+        wrapper = HostTCCmdWrapper(run_with_sudo)
+    else:
+        wrapper = TCCmdWrapper(run_with_sudo)
+        wrapper.set_ingress(args.ingress)
     if args.cli_command == "set":
-        TCCmdWrapper(run_with_sudo).set_bandwidth(
-            args.container1, args.container2, args.bandwidth
+        wrapper.set_bandwidth(
+            args.container1,
+            args.container2,
+            args.bandwidth,
+            reverse=args.reverse,
         )
     elif args.cli_command == "clear":
         for c in args.containers:
-            TCCmdWrapper(run_with_sudo).clear_one_container(c)
+            wrapper.clear_one_container(c)
+
+
+def connect_server(socket_path, run_with_sudo):
+    """Connect to a running server. Returns None if no server is listening
+    on socket_path."""
+    if not os.path.exists(socket_path):
+        return None
+    from contcfg.container_net_ctrl import ConNetController
+
+    try:
+        return ConNetController(
+            _socket_path=socket_path,
+            _run_with_sudo=run_with_sudo,
+            _conn_retry=1,
+        )
+    except OSError:
+        return None
+
+
+def add_backend_argument(parser):
+    parser.add_argument(
+        "--backend",
+        choices=["exec", "host"],
+        default="exec",
+        help="Run tc inside the containers (exec) "
+        "or on their host side veth (host)",
+    )
+    parser.add_argument(
+        "--ingress",
+        action="store_true",
+        help="With the exec backend, shape the traffic received by the "
+        "containers through an ifb device",
+    )
+
+
+def add_update_arguments(parser):
+    parser.add_argument(
+        "--mode",
+        choices=["random", "adaptive"],
+        help="Draw random rates (default) or adapt them to the measured "
+        "throughput",
+    )
+    parser.add_argument(
+        "--policy",
+        choices=["target", "fair"],
+        help="Adaptive policy: keep the utilization of each pair around "
+        "the target (default) or share a per container budget fairly",
+    )
+    parser.add_argument(
+        "--target",
+        type=float,
+        help="Utilization kept by the adaptive mode (default: 0.8)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Relative rate change under which a pair is left alone "
+        "(default: 0.1)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=str,
+        help="Per container rate shared by the fair policy "
+        "(default: max rate)",
+    )
+    parser.add_argument(
+        "--egress",
+        type=str,
+        help="Rate shared by the peer classes of each container, pairs "
+        'borrow up to it ("" removes the budget)',
+    )
+    parser.add_argument(
+        "--fraction",
+        type=float,
+        help="Share of the pairs re-randomized on each tick, in turn "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--pace",
+        action="store_true",
+        help="Spread the updates of a tick over the interval",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Prepare the updates of a tick, then apply them all together",
+    )
+    parser.add_argument(
+        "--topology",
+        type=str,
+        help='Edge list file, one "container1 container2" pair per line. '
+        'Only those pairs are shaped ("all" shapes all pairs)',
+    )
+    parser.add_argument(
+        "--default-rate",
+        type=str,
+        help="Rate of the traffic outside the edges of the topology, or "
+        '"blocked" ("" leaves it alone)',
+    )
+    parser.add_argument(
+        "--asymmetric",
+        action="store_true",
+        help="Draw or adapt the two directions of a pair separately",
+    )
+
+
+def update_options(args) -> dict:
+    """Get the update arguments given on the command line."""
+    keys = (
+        "mode",
+        "policy",
+        "target",
+        "threshold",
+        "budget",
+        "fraction",
+        "egress",
+        "default_rate",
+    )
+    options = {k: getattr(args, k) for k in keys}
+    options = {k: v for k, v in options.items() if v is not None}
+    if args.topology == "all":
+        options["edges"] = "all"
+    elif args.topology is not None:
+        from contcfg.container_net_ctrl.group import load_edges
+
+        options["edges"] = load_edges(args.topology)
+    for flag in ("pace", "sync", "asymmetric"):
+        if getattr(args, flag):
+            options[flag] = True
+    return options
+
+
+def add_group_argument(parser):
+    parser.add_argument(
+        "--group",
+        type=str,
+        default=None,
+        help="Shaping group (default: the group of the server arguments)",
+    )
 
 
 def create_parser():
@@ -90,6 +356,13 @@ def create_parser():
         default="/tmp/contcfg.sock",
         help="Path to the Unix socket",
     )
+    parser.add_argument(
+        "--runtime",
+        choices=["docker", "podman", "netns"],
+        default="docker",
+        help="Container runtime. netns treats the named network namespaces "
+        "of `ip netns` as containers",
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="Sub-command help")
 
@@ -100,6 +373,76 @@ def create_parser():
     server_parser.add_argument("min_rate", type=str, help="Minimum rate")
     server_parser.add_argument("max_rate", type=str, help="Maximum rate")
     server_parser.add_argument("interval", type=int, help="Interval in minutes")
+    add_backend_argument(server_parser)
+    server_parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="Seconds between two samples of the traffic counters "
+        "(0 disables sampling)",
+    )
+    server_parser.add_argument(
+        "--cmd-timeout",
+        type=float,
+        default=30,
+        help="Seconds before a docker or tc command is killed",
+    )
+    server_parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=2,
+        help="Retries of a failed docker or tc command",
+    )
+    server_parser.add_argument(
+        "--mtu",
+        type=int,
+        default=1500,
+        help="MTU of the shaped interfaces, sizes the htb bursts",
+    )
+    server_parser.add_argument(
+        "--hz",
+        type=int,
+        default=None,
+        help="Kernel tick rate sizing the htb bursts "
+        "(default: CONFIG_HZ of the running kernel)",
+    )
+    server_parser.add_argument(
+        "--fq-codel",
+        action="store_true",
+        help="Attach fq_codel to the htb classes",
+    )
+    server_parser.add_argument(
+        "--limit-log",
+        type=str,
+        default=None,
+        help="Append every applied rate to this binary log",
+    )
+    server_parser.add_argument(
+        "--helper-socket",
+        type=str,
+        default=None,
+        help="Run the commands through the privileged helper listening "
+        "on this socket, instead of sudo",
+    )
+    add_update_arguments(server_parser)
+
+    # Privileged helper sub-command
+    helper_parser = subparsers.add_parser(
+        "helper", help="Start the privileged helper (as root)"
+    )
+    helper_parser.add_argument(
+        "--helper-socket",
+        type=str,
+        default="/tmp/contcfg-helper.sock",
+        help="Path to the helper socket",
+    )
+    helper_parser.add_argument(
+        "--user",
+        type=str,
+        default=None,
+        help="User allowed to use the helper, name or uid "
+        "(default: the user running sudo)",
+    )
 
     # Control server sub-command
     ctrl_parser = subparsers.add_parser("ctrl", help="Control the server")
@@ -114,17 +457,53 @@ def create_parser():
         sub_parser.add_argument(
             "container", type=str, help="Container name or id"
         )
+        if action == "add":
+            add_group_argument(sub_parser)
     # Add all containers sub-command
     sub_parser = ctrl_subparsers.add_parser(
         "add-all", help="Add all containers"
     )
     sub_parser.add_argument("prefix", type=str, help="Container name prefix")
+    add_group_argument(sub_parser)
+    # Shaping group sub-commands
+    sub_parser = ctrl_subparsers.add_parser(
+        "group-create", help="Create a shaping group"
+    )
+    sub_parser.add_argument("name", type=str, help="Group name")
+    sub_parser.add_argument("min_rate", type=str, help="Minimum rate")
+    sub_parser.add_argument("max_rate", type=str, help="Maximum rate")
+    sub_parser.add_argument("interval", type=int, help="Interval in minutes")
+    add_update_arguments(sub_parser)
+    sub_parser = ctrl_subparsers.add_parser(
+        "group-modify", help="Modify a shaping group"
+    )
+    sub_parser.add_argument("name", type=str, help="Group name")
+    sub_parser.add_argument("--min-rate", type=str, help="Minimum rate")
+    sub_parser.add_argument("--max-rate", type=str, help="Maximum rate")
+    sub_parser.add_argument("--interval", type=int, help="Interval in minutes")
+    add_update_arguments(sub_parser)
+    sub_parser = ctrl_subparsers.add_parser(
+        "group-destroy", help="Destroy a shaping group"
+    )
+    sub_parser.add_argument("name", type=str, help="Group name")
+    ctrl_subparsers.add_parser("groups", help="List shaping groups")
+    # Traffic stats sub-command
+    sub_parser = ctrl_subparsers.add_parser(
+        "stats", help="Show sampled traffic counters"
+    )
+    sub_parser.add_argument(
+        "container", type=str, nargs="?", help="Container name or id"
+    )
+    sub_parser.add_argument(
+        "--last", type=int, default=2, help="Samples per pair"
+    )
 
     # Stop server sub-command
     subparsers.add_parser("stop-server", help="Stop the server")
 
     # Cli of wrapper
     cli_parser = subparsers.add_parser("cli", help="Run the CLI")
+    add_backend_argument(cli_parser)
 
     cli_subparsers = cli_parser.add_subparsers(
         dest="cli_command", help="CLI sub-command help"
@@ -135,6 +514,12 @@ def create_parser():
     sub_parser.add_argument("container1", type=str, help="Container name or id")
     sub_parser.add_argument("container2", type=str, help="Container name or id")
     sub_parser.add_argument("bandwidth", type=str, help="Bandwidth limit")
+    sub_parser.add_argument(
+        "--reverse",
+        type=str,
+        help="Bandwidth limit from container2 to container1 "
+        "(default: bandwidth)",
+    )
 
     # Clear bandwidth sub-command
     sub_parser = cli_subparsers.add_parser("clear", help="Clear bandwidth")
@@ -155,6 +540,8 @@ def main():
         ctrl(args, run_with_sudo)
     elif args.command == "stop-server":
         stop_server(args, run_with_sudo)
+    elif args.command == "helper":
+        start_helper(args)
     elif args.command == "cli":
         run_cli(args, run_with_sudo)
     else:
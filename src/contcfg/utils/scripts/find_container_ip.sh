@@ -16,15 +16,17 @@ if [ -z "$1" ]; then
 fi
 
 CONTAINER=$1
+# docker compatible cli, e.g. podman
+CLI=${CONTAINER_CLI:-docker}
 
 # Check if the container exists
-if ! docker inspect "$CONTAINER" > /dev/null 2>&1; then
+if ! "$CLI" inspect "$CONTAINER" > /dev/null 2>&1; then
     echo "Container '$CONTAINER' does not exist." >&2
     exit 1
 fi
 
 # Get the IP address of the container
-IP=$(docker inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' "$CONTAINER")
+IP=$("$CLI" inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' "$CONTAINER")
 
 # Check if IP address was retrieved
 if [ -z "$IP" ]; then
@@ -16,9 +16,11 @@ if [ -z "$1" ]; then
 fi
 
 CONTAINER=$1
+# docker compatible cli, e.g. podman
+CLI=${CONTAINER_CLI:-docker}
 
 # Get the container's PID
-PID=$(docker inspect -f '{{.State.Pid}}' "$CONTAINER" 2>/dev/null)
+PID=$("$CLI" inspect -f '{{.State.Pid}}' "$CONTAINER" 2>/dev/null)
 if [ -z "$PID" ]; then
     echo "Cannot retrieve PID for container '$CONTAINER'." >&2
     exit 1
@@ -1,4 +1,10 @@
 #!/bin/bash
+# -----------------------------------------------------------------------------
+# Parent of the peer classes, holding the egress budget. Its minor has hex
+# letters, so it never clashes with the decimal minors of generate_ids.
+# -----------------------------------------------------------------------------
+BUDGET_CLASS="1:fffd"
+
 # -----------------------------------------------------------------------------
 # Function to execute tc command inside Docker container
 # -----------------------------------------------------------------------------
@@ -17,8 +23,12 @@ init_htb() {
     if ! exec_tc "$container" qdisc show dev "$iface" | grep -q "htb 1:"; then
         debug "Adding HTB root queue to interface $iface in container $container..."
         exec_tc "$container" qdisc add dev "$iface" root handle 1: htb default 9999 || { echo "Failed to add root qdisc"; exit 1; }
-        exec_tc "$container" class add dev "$iface" parent 1: classid 1:1 htb rate 10000000mbit ceil 10000000mbit || { echo "Failed to add default class 1:1"; exit 1; }
-        exec_tc "$container" class add dev "$iface" parent 1: classid 1:9999 htb rate 10000000mbit ceil 10000000mbit || { echo "Failed to add default class 1:9999"; exit 1; }
+        exec_tc "$container" class add dev "$iface" parent 1: classid "$BUDGET_CLASS" htb rate 34359mbit ceil 34359mbit quantum 200000 || { echo "Failed to add budget class $BUDGET_CLASS"; exit 1; }
+        exec_tc "$container" class add dev "$iface" parent 1: classid 1:9999 htb rate 34359mbit ceil 34359mbit quantum 200000 || { echo "Failed to add default class 1:9999"; exit 1; }
+    elif ! class_exists "$container" "$iface" "$BUDGET_CLASS"; then
+        # tree built before the budget class existed
+        debug "Adding budget class to interface $iface in container $container..."
+        exec_tc "$container" class add dev "$iface" parent 1: classid "$BUDGET_CLASS" htb rate 34359mbit ceil 34359mbit quantum 200000 || { echo "Failed to add budget class $BUDGET_CLASS"; exit 1; }
     fi
 }
 
@@ -41,6 +51,9 @@ generate_ids() {
     # Convert hash to a decimal minor ID within 1-4095
     local minor_id=$(( 0x$hash % 4095 + 1 ))
     CLASS_ID_FULL="${major_id}:${minor_id}"
+    # Explicit u32 handle (800::<minor in hex>) so the filter of a peer
+    # can be deleted or replaced without listing the filter chain
+    FILTER_HANDLE="800::$(printf '%x' "$minor_id")"
 }
 
 # -----------------------------------------------------------------------------
@@ -50,5 +63,33 @@ class_exists() {
     local container="$1"
     local iface="$2"
     local classid="$3"
-    exec_tc "$container" class show dev "$iface" | grep -q "class htb $classid"
+    exec_tc "$container" class show dev "$iface" | grep -q "class htb $classid "
+}
+
+# -----------------------------------------------------------------------------
+# Function: Check if a class is a child of the budget class
+# -----------------------------------------------------------------------------
+class_under_budget() {
+    local container="$1"
+    local iface="$2"
+    local classid="$3"
+    exec_tc "$container" class show dev "$iface" classid "$classid" | grep -q "parent $BUDGET_CLASS "
+}
+
+# -----------------------------------------------------------------------------
+# Function: Delete a class and the filters sending traffic to it
+# -----------------------------------------------------------------------------
+delete_class() {
+    local container="$1"
+    local iface="$2"
+    local classid="$3"
+    local handle
+    # filters added before explicit handles were used have kernel chosen ones
+    for handle in $(exec_tc "$container" filter show dev "$iface" parent 1: | awk -v id="$classid" '{
+        for (i = 1; i < NF; i++) if (($i == "flowid" || $i == "*flowid") && $(i + 1) == id)
+            for (j = 1; j < NF; j++) if ($j == "fh") print $(j + 1)
+    }'); do
+        exec_tc "$container" filter del dev "$iface" parent 1: protocol ip prio 1 handle "$handle" u32 || { echo "Failed to delete filter"; exit 1; }
+    done
+    exec_tc "$container" class del dev "$iface" classid "$classid" || { echo "Failed to delete class"; exit 1; }
 }
\ No newline at end of file
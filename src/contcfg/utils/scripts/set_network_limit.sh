@@ -132,18 +132,25 @@ add_or_update_tc_rules() {
     
     init_htb "$container" "$iface"
     
+    if class_exists "$container" "$iface" "$CLASS_ID_FULL" && ! class_under_budget "$container" "$iface" "$CLASS_ID_FULL"; then
+        # tc cannot move a class to another parent, so a class added before
+        # the budget class existed is deleted and added again below it
+        debug "Moving class $CLASS_ID_FULL on interface $iface under $BUDGET_CLASS..."
+        delete_class "$container" "$iface" "$CLASS_ID_FULL"
+    fi
+    
     if class_exists "$container" "$iface" "$CLASS_ID_FULL"; then
         
         debug "Updating bandwidth limit on interface $iface from $src_ip to $dst_ip to $rate..."
         # Update the class bandwidth
-        exec_tc "$container" class change dev "$iface" parent 1: classid "$CLASS_ID_FULL" htb rate "$rate" ceil "$rate" || { echo "Failed to update class"; exit 1; }
+        exec_tc "$container" class change dev "$iface" parent "$BUDGET_CLASS" classid "$CLASS_ID_FULL" htb rate "$rate" ceil "$rate" || { echo "Failed to update class"; exit 1; }
     else
         
         debug "Adding bandwidth limit on interface $iface from $src_ip to $dst_ip ($rate)..."
         # Add a new class
-        exec_tc "$container" class add dev "$iface" parent 1: classid "$CLASS_ID_FULL" htb rate "$rate" ceil "$rate" || { echo "Failed to add class"; exit 1; }
+        exec_tc "$container" class add dev "$iface" parent "$BUDGET_CLASS" classid "$CLASS_ID_FULL" htb rate "$rate" ceil "$rate" || { echo "Failed to add class"; exit 1; }
         # Add filters using flowid
-        exec_tc "$container" filter add dev "$iface" protocol ip parent 1: prio 1 u32 match ip dst "$dst_ip"/32 flowid "$CLASS_ID_FULL" || { echo "Failed to add filter"; exit 1; }
+        exec_tc "$container" filter add dev "$iface" protocol ip parent 1: prio 1 handle "$FILTER_HANDLE" u32 match ip dst "$dst_ip"/32 flowid "$CLASS_ID_FULL" || { echo "Failed to add filter"; exit 1; }
     fi
 }
 
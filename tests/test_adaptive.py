@@ -0,0 +1,71 @@
+import pytest
+
+from contcfg.container_net_ctrl.adaptive import AdaptivePolicy, max_min_share
+from contcfg.container_net_ctrl.group import ShapingGroup
+
+MBIT = 10**6
+
+
+def test_max_min_share():
+    share = max_min_share({"a": 10, "b": 100, "c": 100}, 90)
+    assert share == {"a": 10, "b": 40, "c": 40}
+    assert max_min_share({"a": 1, "b": 2}, 100) == {"a": 1, "b": 2}
+
+
+def test_target_policy_only_moves_busy_pairs():
+    policy = AdaptivePolicy("target", target=0.5, threshold=0.1)
+    limits = {("c1", "c2"): 100, ("c1", "c3"): 100, ("c2", "c3"): 100}
+    usage = {
+        ("c1", "c2"): 100 * MBIT,  # saturated, asks for 200
+        ("c1", "c3"): 52 * MBIT,  # around the target, kept
+    }  # c2 - c3 not measured, kept
+    rates = policy.plan(limits, usage, 10, 150, "mbit")
+    assert rates == {("c1", "c2"): 150}
+
+    pair = ("c1", "c2")
+    idle = policy.plan({pair: 100}, {pair: 0.0}, 10, 150, "mbit")
+    assert idle == {pair: 10}
+
+
+def test_fair_policy_shares_budget():
+    policy = AdaptivePolicy("fair", target=1, threshold=0, budget="100mbit")
+    limits = {("c1", "c2"): 80, ("c1", "c3"): 50, ("c2", "c3"): 50}
+    usage = {
+        ("c1", "c2"): 200 * MBIT,
+        ("c1", "c3"): 200 * MBIT,
+        ("c2", "c3"): 10 * MBIT,
+    }
+    rates = policy.plan(limits, usage, 1, 1000, "mbit")
+    # c1 splits its budget evenly, c2 and c3 give the rest to c1
+    # c1 - c3 already has its share and is not returned
+    assert rates == {("c1", "c2"): 50, ("c2", "c3"): 10}
+
+
+def test_group_adaptive_payload():
+    group = ShapingGroup.from_payload(
+        "exp",
+        {
+            "min_rate": "1mbit",
+            "max_rate": "10mbit",
+            "interval": 1,
+            "mode": "adaptive",
+            "policy": "fair",
+            "budget": "1gbit",
+        },
+    )
+    assert group.mode == "adaptive"
+    assert group.info()["policy"] == "fair"
+    with pytest.raises(ValueError):
+        group.modify({"mode": "chaos"})
+    with pytest.raises(ValueError):
+        group.modify({"target": 0})
+    assert group.policy.target == 0.8  # failed updates are not applied
+
+
+def test_fair_policy_directed():
+    policy = AdaptivePolicy("fair", target=1, threshold=0, budget="100mbit")
+    limits = {("c1", "c2"): 50, ("c2", "c1"): 50, ("c1", "c3"): 50}
+    usage = {("c1", "c2"): 200 * MBIT, ("c2", "c1"): 10 * MBIT}
+    rates = policy.plan(limits, usage, 1, 1000, "mbit", directed=True)
+    # c2 -> c1 does not eat the sending budget of c1
+    assert rates == {("c2", "c1"): 10}
@@ -3,7 +3,7 @@ import asyncio
 from asyncio import Queue
 
 from contcfg.container_net_ctrl.comm import NetCtrlCommServer, NetCtrlCommClient
-from contcfg.container_net_ctrl import CtrlMsg, CtrlAction
+from contcfg.container_net_ctrl import CtrlMsg, CtrlAction, CtrlReply
 
 
 q = Queue()
@@ -38,3 +38,76 @@ def test_net_ctrl_comm():
 if __name__ == "__main__":
     test_net_ctrl_comm()
     assert q.qsize() == 20
+
+
+def test_net_ctrl_request():
+    import time
+
+    path = "/tmp/net_ctrl_request_socket.sock"
+
+    async def serve():
+        requests: Queue = Queue()
+        server = NetCtrlCommServer(path)
+        server_task = asyncio.create_task(server.start(requests))
+        while True:
+            msg = await requests.get()
+            if msg.action == CtrlAction.STOP:
+                break
+            reply = CtrlReply(msg.request_id, result=msg.container)
+            msg.reply.set_result(reply)
+        await server_task
+
+    server_thread = threading.Thread(target=asyncio.run, args=(serve(),))
+    server_thread.start()
+    time.sleep(0.2)
+
+    client = NetCtrlCommClient(path)
+    for i in range(3):
+        reply = client.request(
+            CtrlMsg(action=CtrlAction.GET_STATS, container=f"container{i}")
+        )
+        assert reply.ok and reply.result == f"container{i}"
+    client.stop_server()
+    server_thread.join()
+
+
+def test_async_client_pipelined_requests():
+    from contcfg.container_net_ctrl.async_comm_client import (
+        AsyncNetCtrlCommClient,
+    )
+
+    path = "/tmp/net_ctrl_async_socket.sock"
+
+    async def run():
+        requests: Queue = Queue()
+        server = NetCtrlCommServer(path)
+        server_task = asyncio.create_task(server.start(requests))
+        await asyncio.sleep(0.1)
+
+        async def handle():
+            # reply in reverse order, the client matches replies by id
+            while True:
+                msgs = [await requests.get()]
+                while not requests.empty():
+                    msgs.append(requests.get_nowait())
+                for msg in reversed(msgs):
+                    if msg.action == CtrlAction.STOP:
+                        return
+                    reply = CtrlReply(msg.request_id, result=msg.container)
+                    msg.reply.set_result(reply)
+
+        handler = asyncio.create_task(handle())
+        client = AsyncNetCtrlCommClient(path)
+        futures = [
+            client.submit(CtrlMsg(CtrlAction.GET_STATS, f"container{i}"))
+            for i in range(100)
+        ]
+        replies = await asyncio.gather(*futures)
+        assert [r.result for r in replies] == [
+            f"container{i}" for i in range(100)
+        ]
+        await client.stop_server()
+        await handler
+        await server_task
+
+    asyncio.run(run())
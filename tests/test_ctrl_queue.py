@@ -0,0 +1,70 @@
+import asyncio
+
+from contcfg.container_net_ctrl import CtrlMsg, CtrlAction
+from contcfg.container_net_ctrl.ctrl_queue import CtrlQueue
+
+
+def drain(q: CtrlQueue) -> list[CtrlMsg]:
+    msgs = []
+    while not q.empty():
+        msgs.append(q.get_nowait())
+    return msgs
+
+
+def test_priority_and_tick_coalescing():
+    async def run():
+        q = CtrlQueue()
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH))
+        q.put_nowait(CtrlMsg(CtrlAction.ADD_CONTAINER, "c1"))
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH))
+        q.put_nowait(CtrlMsg(CtrlAction.DEL_CONTAINER, "c1"))
+        q.put_nowait(CtrlMsg(CtrlAction.ADD_CONTAINER, "c3"))
+        q.put_nowait(CtrlMsg(CtrlAction.GET_STATS))
+        q.put_nowait(CtrlMsg(CtrlAction.STOP))
+        return [(m.action, m.container) for m in drain(q)]
+
+    # the DEL of c1 overtakes the tick but not the ADD of c1
+    assert asyncio.run(run()) == [
+        (CtrlAction.STOP, None),
+        (CtrlAction.GET_STATS, None),
+        (CtrlAction.ADD_CONTAINER, "c1"),
+        (CtrlAction.DEL_CONTAINER, "c1"),
+        (CtrlAction.ADD_CONTAINER, "c3"),
+        (CtrlAction.SET_BANDWIDTH, None),
+    ]
+
+
+def test_new_tick_supersedes_round():
+    async def run():
+        q = CtrlQueue()
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH))
+        q.get_nowait()
+        round_id = q.round_id  # the running round
+        q.put_nowait(CtrlMsg(CtrlAction.ADD_CONTAINER, "c1"))
+        assert q.round_id == round_id
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH))
+        assert q.round_id != round_id
+        # the dequeued tick no longer blocks new ticks
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH))
+        return len(drain(q))
+
+    assert asyncio.run(run()) == 2
+
+
+def test_ticks_per_group():
+    async def run():
+        q = CtrlQueue()
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH, group="a"))
+        q.get_nowait()
+        round_a = q.group_round("a")
+        # ticks of another group neither coalesce with nor supersede "a"
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH, group="b"))
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH, group="a"))
+        q.put_nowait(CtrlMsg(CtrlAction.SET_BANDWIDTH, group="b"))
+        assert q.group_round("a") == round_a + 1
+        round_b = q.group_round("b")
+        q.put_nowait(CtrlMsg(CtrlAction.STOP))
+        assert q.group_round("b") == round_b + 1
+        return [m.group for m in drain(q)]
+
+    assert asyncio.run(run()) == [None, "b", "a"]
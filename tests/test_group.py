@@ -0,0 +1,115 @@
+import pytest
+
+from contcfg.container_net_ctrl.group import (
+    ShapingGroup,
+    interval_to_sec,
+    load_edges,
+)
+
+
+def test_group_from_payload_and_modify():
+    group = ShapingGroup.from_payload(
+        "exp",
+        {"min_rate": "1gbit", "max_rate": "2gbit", "interval": 30},
+    )
+    assert (group.min_rate, group.max_rate, group.rate_unit) == (1, 2, "gbit")
+    assert group.interval_sec == 1800
+    assert 1 <= group.random_rate() <= 2
+
+    group.modify({"interval": 10, "interval_unit": "s"})
+    assert group.interval_sec == 10
+    assert group.rate_unit == "gbit"  # kept
+
+    with pytest.raises(ValueError):
+        group.modify({"min_rate": "10mbit"})  # max_rate missing
+    with pytest.raises(ValueError):
+        group.modify({"min_rate": "10mbit", "max_rate": "1gbit"})
+    with pytest.raises(ValueError):
+        group.modify({"min_rate": "20mbit", "max_rate": "10mbit"})
+    with pytest.raises(ValueError):
+        ShapingGroup.from_payload("bad", {"min_rate": "1mbit"})
+    assert group.info()["min_rate"] == 1
+
+
+def test_interval_to_sec():
+    assert interval_to_sec(2, "s") == 2
+    assert interval_to_sec(2, "min") == 120
+    assert interval_to_sec(2, "h") == 7200
+    with pytest.raises(ValueError):
+        interval_to_sec(2, "d")
+
+
+def test_group_rolling_pairs():
+    group = ShapingGroup("exp", 1, 2, 60)
+    pairs = list(range(10))
+    assert group.rolling_pairs(pairs) == pairs
+    group.modify({"fraction": 0.3, "pace": True})
+    assert group.pace and group.info()["fraction"] == 0.3
+    assert group.rolling_pairs(pairs) == [0, 1, 2]
+    assert group.rolling_pairs(pairs) == [3, 4, 5]
+    assert group.rolling_pairs(pairs) == [6, 7, 8]
+    assert group.rolling_pairs(pairs) == [9, 0, 1]
+    with pytest.raises(ValueError):
+        group.modify({"fraction": 0})
+
+
+def test_group_sync_excludes_pace():
+    group = ShapingGroup("exp", 1, 2, 60)
+    group.modify({"sync": True})
+    assert group.info()["sync"] and group.info()["skew"] is None
+    with pytest.raises(ValueError):
+        group.modify({"pace": True})
+    assert not group.pace
+
+
+def test_group_rejects_rates_above_32_bits():
+    ShapingGroup("big", 1, 34359, 60)
+    with pytest.raises(ValueError, match="32-bit"):
+        ShapingGroup("big", 1, 40, 60, rate_unit="gbit")
+
+
+def test_group_egress_budget():
+    group = ShapingGroup("budget", 1, 10, 60)
+    group.modify({"egress": "1gbit"})
+    assert group.info()["egress"] == "1gbit"
+    with pytest.raises(ValueError):
+        group.modify({"egress": "0mbit"})
+    group.modify({"egress": ""})
+    assert group.egress is None
+
+
+def test_group_asymmetric_rates():
+    group = ShapingGroup("asym", 1, 1000, 60)
+    assert len(set(group.random_rates())) == 1
+    group.modify({"asymmetric": True})
+    assert group.info()["asymmetric"]
+    draws = [group.random_rates() for _ in range(20)]
+    assert all(1 <= r <= 1000 for pair in draws for r in pair)
+    assert any(rate != reverse for rate, reverse in draws)
+
+
+def test_group_sparse_edges(tmp_path):
+    path = tmp_path / "ring.txt"
+    path.write_text("# ring\nc1 c2\nc3 c2\n\nc3 c4  # last\n")
+    edges = load_edges(str(path))
+    assert edges == [("c1", "c2"), ("c3", "c2"), ("c3", "c4")]
+    group = ShapingGroup("ring", 1, 10, 60)
+    group.containers = dict.fromkeys(["c1", "c2", "c3"])
+    assert len(group.pairs()) == 3  # all pairs
+    group.modify({"edges": edges, "default_rate": "blocked"})
+    # c4 is not a member yet
+    assert group.pairs() == [("c1", "c2"), ("c2", "c3")]
+    assert group.neighbors("c2", group.containers) == ["c1", "c3"]
+    assert not group.is_edge("c3", "c1")
+    assert group.info()["edges"] == 3
+    with pytest.raises(ValueError):
+        group.modify({"edges": [("c1", "c1")]})
+    with pytest.raises(ValueError):
+        group.modify({"default_rate": "0mbit"})
+    group.modify({"edges": "all", "default_rate": ""})
+    assert group.edges is None and group.default_rate is None
+    # members keep the order they joined in
+    del group.containers["c2"]
+    group.containers["c4"] = None
+    assert group.info()["containers"] == ["c1", "c3", "c4"]
+    assert group.pairs() == [("c1", "c3"), ("c1", "c4"), ("c3", "c4")]
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from contcfg.container_net_ctrl.limit_log import NO_LIMIT, RECORD, LimitLog
+from contcfg.container_net_ctrl.limit_store import LimitMatrix
+
+
+def test_limit_log_buffers_and_appends(tmp_path):
+    path = str(tmp_path / "limits.bin")
+    log = LimitLog(path, buffer_size=3)
+    log.record("c1", "c2", 10)
+    log.record("c2", "c1", 20)
+    assert os.path.getsize(path) == 16  # only the header
+    log.record("c1", "c3", 30)
+    assert os.path.getsize(path) == 16 + 3 * RECORD.size
+    with open(path + ".names") as f:
+        assert f.read().splitlines() == ["c1", "c2", "c3"]
+    # reopening keeps the indexes
+    log = LimitLog(path)
+    log.record("c3", "c4", 40)
+    log.flush()
+    with open(path + ".names") as f:
+        assert f.read().splitlines() == ["c1", "c2", "c3", "c4"]
+    with pytest.raises(ValueError):
+        LimitLog(path, rate_unit="kbit")
+
+
+def test_limit_log_reader(tmp_path):
+    pytest.importorskip("numpy")
+    from contcfg.container_net_ctrl.limit_log import LimitLogReader
+
+    path = str(tmp_path / "limits.bin")
+    limits = LimitMatrix(log=LimitLog(path))
+    for c in ["c1", "c2", "c3"]:
+        limits.add(c)
+    limits.set("c1", "c2", 10, 20)
+    limits.set("c1", "c3", 30)
+    limits.set("c1", "c2", 50)
+    limits.remove("c2")
+    limits.flush_log()
+    # a record cut at the end of the log is ignored
+    with open(path, "ab") as f:
+        f.write(b"\0" * 5)
+
+    reader = LimitLogReader(path)
+    assert reader.rate_unit == "mbit"
+    assert len(reader) == 8
+    assert list(reader.pair("c1", "c2")["rate"]) == [10, 50, NO_LIMIT]
+    assert list(reader.pair("c2", "c1")["rate"]) == [20, 50, NO_LIMIT]
+    ts = reader.records["ts"]
+    assert reader.rate_at("c1", "c2", ts[0] - 1) is None
+    assert reader.rate_at("c1", "c2", ts[0]) == 10
+    assert reader.rate_at("c1", "c3", ts[-1]) == 30
+    assert reader.rate_at("c1", "c2", ts[-1]) is None
+    window = reader.between(ts[2], ts[4])
+    assert all(ts[2] <= t < ts[4] for t in window["ts"])
+    assert len(reader.between()) == len(reader)
+    # a zero rate is a limit, not its removal
+    path = str(tmp_path / "zero.bin")
+    log = LimitLog(path)
+    log.record("c1", "c2", 0)
+    log.flush()
+    reader = LimitLogReader(path)
+    assert reader.rate_at("c1", "c2", reader.records["ts"][-1]) == 0
@@ -0,0 +1,49 @@
+from contcfg.container_net_ctrl.limit_store import LimitMatrix
+
+
+def test_set_get_and_remove():
+    limits = LimitMatrix(capacity=2)
+    for c in ["c1", "c2", "c3"]:  # grows past the initial capacity
+        limits.add(c)
+    assert limits.set("c1", "c2", 10)
+    assert limits.set("c2", "c3", 30)
+    assert not limits.set("c1", "unknown", 5)
+    assert limits.get("c2", "c1") == 10
+    assert limits.get("c1", "c3") is None
+    assert list(limits.pairs()) == [("c1", "c2", 10), ("c2", "c3", 30)]
+
+    limits.remove("c2")
+    assert limits.containers() == ["c1", "c3"]
+    assert list(limits.pairs()) == []
+    # the index of c2 is reused without inheriting its limits
+    assert limits.add("c4") == 1
+    assert limits.get("c4", "c1") is None
+
+
+def test_summary():
+    limits = LimitMatrix()
+    for c in ["c1", "c2", "c3"]:
+        limits.add(c)
+    limits.set("c1", "c2", 10)
+    limits.set("c1", "c3", 20)
+    limits.set("c1", "c3", 30)
+    summary = limits.summary()
+    assert summary == {
+        "containers": 3,
+        "pairs": 2,
+        "min": 10,
+        "max": 30,
+        "mean": 20.0,
+        "changed": 3,
+    }
+    assert limits.summary()["changed"] == 0
+
+
+def test_set_directions():
+    limits = LimitMatrix()
+    for c in ["c1", "c2"]:
+        limits.add(c)
+    assert limits.set("c1", "c2", 10, 40)
+    assert limits.get("c1", "c2") == 10
+    assert limits.get("c2", "c1") == 40
+    assert list(limits.pairs()) == [("c1", "c2", 10)]
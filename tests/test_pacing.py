@@ -0,0 +1,24 @@
+import pytest
+
+from contcfg.container_net_ctrl.pacing import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_spreads_reservations():
+    clock = FakeClock()
+    bucket = TokenBucket(2, clock=clock)  # one token every 0.5s
+    assert [bucket.reserve() for _ in range(3)] == [0, 0.5, 1.0]
+    clock.now = 1.0  # the reserved tokens are due now
+    assert bucket.reserve() == 0.5
+    clock.now = 10.0  # refilled up to the burst only
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    with pytest.raises(ValueError):
+        TokenBucket(0)
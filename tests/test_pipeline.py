@@ -0,0 +1,32 @@
+import asyncio
+
+from contcfg.container_net_ctrl.pipeline import (
+    CtrlPipeline,
+    container_key,
+    pair_key,
+)
+
+
+def test_pipeline_orders_conflicts_and_overlaps_the_rest():
+    async def run():
+        pipeline = CtrlPipeline()
+        events = []
+
+        async def op(name, delay):
+            events.append(f"{name} start")
+            await asyncio.sleep(delay)
+            events.append(f"{name} end")
+
+        pipeline.start([pair_key("c2", "c1")], op, "round", 0.05)
+        pipeline.start([container_key("c3")], op, "add", 0)
+        pipeline.start(
+            [container_key("c1"), pair_key("c1", "c2")], op, "del", 0
+        )
+        await pipeline.join()
+        assert len(pipeline) == 0
+        return events
+
+    events = asyncio.run(run())
+    # the add does not wait for the round, the del does
+    assert events.index("add end") < events.index("round end")
+    assert events.index("round end") < events.index("del start")
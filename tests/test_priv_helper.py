@@ -0,0 +1,88 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from contcfg.cmd_wrapper.base import exec_cmd, get_script, set_priv_helper
+from contcfg.cmd_wrapper.exception import HelperError
+from contcfg.cmd_wrapper.priv_helper import (
+    PrivHelper,
+    check_argv,
+    check_tc_line,
+)
+from contcfg.cmd_wrapper.tc_batch import TCBatch
+from contcfg.cmd_wrapper.tc_session import TCSession
+
+TC_BATCH = ["tc", "-force", "-batch", "-"]
+
+
+def test_check_argv():
+    script = str(get_script("find_container_ip.sh"))
+    for argv in [
+        ["tc", "-s", "-j", "class", "show", "dev", "eth0"],
+        ["ip", "netns", "exec", "n1", *TC_BATCH],
+        ["docker", "exec", "-i", "c1", "ip", "link", "set", "ifb0", "up"],
+        ["ip", "-n", "n1", "-4", "-o", "addr", "show", "dev", "eth0"],
+        ["podman", "inspect", "-f", "{{.State.Pid}}", "c1"],
+        ["docker", "ps", "--format", "{{.Names}}"],
+        ["env", "CONTAINER_CLI=podman", "bash", script, "c1"],
+    ]:
+        check_argv(argv)
+    for argv in [
+        [],
+        ["sh", "-c", "id"],
+        ["docker", "run", "image"],
+        ["docker", "exec", "-u", "root", "c1", "sh"],
+        # an option in place of the container
+        ["docker", "exec", "-i", "--privileged=true", *TC_BATCH],
+        ["docker", "exec", "-i", "--user=root", *TC_BATCH],
+        ["podman", "exec", "-i", "-uroot", *TC_BATCH],
+        ["docker", "ps", "|", "grep", "c"],
+        ["ip", "netns", "exec", "n1", "ip", "netns", "exec", "n1", "sh"],
+        ["ip", "-all", "netns", "exec", "sh", "-c", "id"],
+        ["ip", "-4", "netns", "exec", "x", "sh", "-c", "id"],
+        ["ip", "-batch", "/tmp/cmds"],
+        ["ip", "link", "set", "eth0", "netns", "1"],
+        ["tc", "exec", "bpf", "import", "/tmp/u", "run", "sh"],
+        ["tc", "-batch", "/tmp/cmds"],
+        ["tc", "-force", "-batch", "-", "qdisc", "show"],
+        ["env", "CONTAINER_CLI=sh", "bash", script, "c1"],
+        ["bash", "/tmp/find_container_ip.sh", "c1"],
+    ]:
+        with pytest.raises(HelperError):
+            check_argv(argv)
+    check_argv(TC_BATCH, "qdisc add dev eth0 root handle 1: htb default 9999\n")
+    for line in [
+        "exec bpf import /tmp/u run sh",
+        "filter add dev eth0 parent 1: bpf obj /tmp/x.o",
+        "filter add dev eth0 parent 1: u32 match u32 0 0 action bpf obj x",
+    ]:
+        with pytest.raises(HelperError):
+            check_tc_line(line)
+        with pytest.raises(HelperError):
+            check_argv(TC_BATCH, f"class show dev eth0\n{line}\n")
+
+
+@pytest.mark.skipif(shutil.which("tc") is None, reason="needs iproute2")
+def test_priv_helper_runs_commands(tmp_path):
+    path = str(tmp_path / "helper.sock")
+    with PrivHelper(path, os.getuid()) as helper:
+        threading.Thread(target=helper.serve_forever, daemon=True).start()
+        set_priv_helper(path)
+        try:
+            output = exec_cmd("ip -o link show", bash=False, stdout=True)
+            assert b"lo" in output.stdout
+            with pytest.raises(HelperError):
+                exec_cmd("sh -c id", bash=False)
+            # the session is started by the helper
+            session = TCSession()
+            batch = TCBatch()
+            batch.add("qdisc show dev lo")
+            session.run(batch, timeout=5)
+            assert session.alive
+            session.close()
+            assert not session.alive
+        finally:
+            set_priv_helper(None)
+            helper.shutdown()
@@ -0,0 +1,73 @@
+import os
+import subprocess
+
+import pytest
+
+from contcfg.cmd_wrapper import CommandTimeoutError, ContainerNotFoundError
+from contcfg.cmd_wrapper.base import exec_cmd
+from contcfg.container_net_ctrl.resilience import RetryPolicy, CircuitBreaker
+
+
+def test_exec_cmd_timeout():
+    with pytest.raises(CommandTimeoutError):
+        exec_cmd("sleep 5", False, bash=False, timeout=0.2)
+
+
+def test_exec_cmd_does_not_inherit_stdin():
+    # a stdin that is never closed, like the one of a server in a terminal
+    read, write = os.pipe()
+    saved = os.dup(0)
+    os.dup2(read, 0)
+    try:
+        exec_cmd("cat", False, bash=False, timeout=2)
+    finally:
+        os.dup2(saved, 0)
+        for fd in (saved, read, write):
+            os.close(fd)
+
+
+def test_retry_policy():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise subprocess.CalledProcessError(1, "tc")
+        return "ok"
+
+    assert RetryPolicy(retries=2, backoff=0).call(flaky) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(subprocess.CalledProcessError):
+        RetryPolicy(retries=1, backoff=0).call(flaky)
+    assert len(calls) == 2
+
+    def missing():
+        calls.append(1)
+        raise ContainerNotFoundError("c1")
+
+    calls.clear()
+    with pytest.raises(ContainerNotFoundError):
+        RetryPolicy(retries=2, backoff=0).call(missing)
+    assert len(calls) == 1  # not transient, no retry
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=2, cooldown=0)
+    breaker.record_failure("c1")
+    assert breaker.allow("c1")
+    breaker.record_failure("c1")
+    assert "c1" in breaker._open_until
+    # cooldown is over: one attempt goes through, then a success closes it
+    assert breaker.allow("c1")
+    breaker.record_success("c1")
+    assert not breaker.is_open("c1")
+
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.record_failure("c2")
+    assert breaker.is_open("c2")
+    assert not breaker.allow("c2")
+    assert breaker.allow("c3")
+    breaker.forget("c2")
+    assert breaker.allow("c2")
@@ -0,0 +1,27 @@
+import pytest
+
+from contcfg.cmd_wrapper import (
+    DockerCmdWrapper,
+    NetnsCmdWrapper,
+    PodmanCmdWrapper,
+    get_runtime,
+    set_runtime,
+)
+
+
+def test_get_runtime():
+    assert get_runtime(runtime="docker") is DockerCmdWrapper(False)
+    podman = get_runtime(runtime="podman")
+    assert podman is PodmanCmdWrapper(False)
+    assert podman.exec_prefix("c1") == "podman exec -i c1"
+    netns = get_runtime(runtime="netns")
+    assert netns is NetnsCmdWrapper(False)
+    assert netns.exec_prefix("n1") == "ip netns exec n1"
+    assert netns.get_container_netns("n1") == "/run/netns/n1"
+    try:
+        set_runtime("netns")
+        assert get_runtime() is netns
+    finally:
+        set_runtime("docker")
+    with pytest.raises(ValueError):
+        set_runtime("lxc")
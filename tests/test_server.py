@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+from contcfg.container_net_ctrl import ConNetServer, AsyncConNetController
+from contcfg.container_net_ctrl.msg import CtrlMsg, CtrlAction
+
+
+def test_server_embedded_in_running_loop(tmp_path):
+    socket_path = str(tmp_path / "contcfg.sock")
+
+    async def run():
+        server = ConNetServer(
+            1, 10, 5, interval_unit="s", _server_socket_path=socket_path
+        )
+        async with server:
+            # direct calls and socket clients share the same dispatcher
+            with pytest.raises(RuntimeError, match="not found"):
+                await server.del_container("missing")
+            async with AsyncConNetController(
+                _socket_path=socket_path
+            ) as client:
+                groups = await client.list_groups()
+            assert "default" in groups
+            await server.stop()
+            await server.stop()  # already stopped
+        with pytest.raises(RuntimeError, match="not running"):
+            await server.add_container("c1")
+
+    asyncio.run(run())
+
+
+def test_server_serve_cancelled_releases_socket(tmp_path):
+    socket_path = str(tmp_path / "contcfg.sock")
+
+    async def run():
+        server = ConNetServer(
+            1, 10, 5, interval_unit="s", _server_socket_path=socket_path
+        )
+        task = asyncio.create_task(server.serve())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the socket path can be served again
+        async with server:
+            pass
+
+    asyncio.run(run())
+
+
+def test_server_onboards_in_parallel(tmp_path):
+    socket_path = str(tmp_path / "contcfg.sock")
+    server = ConNetServer(
+        1, 10, 60, interval_unit="s", _server_socket_path=socket_path
+    )
+    running = []
+    peak = []
+    pairs = []
+
+    def init(container):
+        running.append(container)
+        peak.append(len(running))
+        time.sleep(0.1)
+        running.remove(container)
+        return container != "bad"
+
+    def set_limit(container1, container2, *args, **kwargs):
+        pairs.append(tuple(sorted((container1, container2))))
+        return True
+
+    server._init_container_htb = init
+    server._set_bandwidth_limit = set_limit
+    server._clear_one = lambda *args: None
+    containers = [f"c{i}" for i in range(6)] + ["bad"]
+
+    async def run():
+        async with server:
+            await asyncio.gather(*(server.add_container(c) for c in containers))
+            reply = await server.request(CtrlMsg(CtrlAction.LIST_GROUPS))
+            await server.stop()
+        return reply.result["default"]
+
+    info = asyncio.run(run())
+    assert max(peak) > 1
+    assert info["ready"] == 6 and len(info["containers"]) == 7
+    # each pair of ready containers is set once, by the last one ready
+    good = sorted(containers[:6])
+    expected = [(a, b) for i, a in enumerate(good) for b in good[i + 1 :]]
+    assert sorted(pairs) == expected
+
+
+def test_server_stop_with_connected_client(tmp_path):
+    socket_path = str(tmp_path / "contcfg.sock")
+
+    async def run():
+        server = ConNetServer(
+            1, 10, 5, interval_unit="s", _server_socket_path=socket_path
+        )
+        async with server:
+            # the socket is bound once the server is entered
+            client = AsyncConNetController(
+                _socket_path=socket_path, _conn_retry=1
+            )
+            await client.list_groups()
+            await server.stop()
+        await client.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_server_enter_raises_startup_error(tmp_path):
+    # longer than the limit of a Unix socket path
+    socket_path = str(tmp_path / ("d" * 120) / "contcfg.sock")
+    (tmp_path / ("d" * 120)).mkdir()
+
+    async def run():
+        server = ConNetServer(
+            1, 10, 5, interval_unit="s", _server_socket_path=socket_path
+        )
+        with pytest.raises(OSError):
+            async with server:
+                pass
+
+    asyncio.run(run())
+
+
+def test_server_del_does_not_overtake_add(tmp_path):
+    socket_path = str(tmp_path / "contcfg.sock")
+    server = ConNetServer(
+        1, 10, 60, interval_unit="s", _server_socket_path=socket_path
+    )
+    server._init_container_htb = lambda container: True
+    server._clear_one = lambda *args: None
+
+    async def run():
+        async with server:
+            # pipelined by an async client as well
+            await asyncio.gather(
+                server.add_container("c1"), server.del_container("c1")
+            )
+            reply = await server.request(CtrlMsg(CtrlAction.LIST_GROUPS))
+            await server.stop()
+        return reply.result["default"]["containers"]
+
+    assert asyncio.run(run()) == []
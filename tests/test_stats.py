@@ -0,0 +1,55 @@
+from contcfg.cmd_wrapper.tc_base import parse_class_stats
+from contcfg.container_net_ctrl.stats import PairRingBuffer, TrafficStats
+
+TEXT_OUTPUT = """\
+class htb 1:2748 root prio 0 rate 10Mbit ceil 10Mbit burst 1600b cburst 1600b
+ Sent 1500 bytes 3 pkt (dropped 1, overlimits 0 requeues 0)
+ backlog 0b 0p requeues 0
+class htb 1:9999 root prio 0 rate 10Tbit ceil 10Tbit burst 0b cburst 0b
+ Sent 42 bytes 1 pkt (dropped 0, overlimits 0 requeues 0)
+"""
+
+JSON_OUTPUT = (
+    '[{"class":"htb","handle":"1:2748","stats":'
+    '{"bytes":1500,"packets":3,"drops":1}}]'
+)
+
+
+def test_parse_class_stats():
+    assert parse_class_stats(TEXT_OUTPUT) == {
+        "1:2748": (1500, 3, 1),
+        "1:9999": (42, 1, 0),
+    }
+    assert parse_class_stats(JSON_OUTPUT) == {"1:2748": (1500, 3, 1)}
+
+
+def test_ring_buffer_wraps():
+    buffer = PairRingBuffer(3)
+    for i in range(5):
+        buffer.append(float(i), i * 10, i, 0)
+    assert len(buffer) == 3
+    assert [s[0] for s in buffer.samples()] == [2.0, 3.0, 4.0]
+    assert buffer.samples(last=1) == [(4.0, 40, 4, 0)]
+
+
+def test_traffic_stats_record_and_forget():
+    stats = TrafficStats(capacity=2)
+    pairs = {"1:2748": ("c1", "c2")}
+    stats.record(1.0, parse_class_stats(TEXT_OUTPUT), pairs)
+    stats.record(2.0, parse_class_stats(TEXT_OUTPUT), pairs)
+    stats.record(3.0, parse_class_stats(TEXT_OUTPUT), pairs)
+    samples = stats.query("c1")[("c1", "c2")]
+    assert [s[0] for s in samples] == [2.0, 3.0]
+    stats.forget("c2")
+    assert stats.query() == {}
+
+
+def test_traffic_stats_throughput():
+    stats = TrafficStats()
+    pairs = {"1:2748": ("c1", "c2")}
+    stats.record(1.0, {"1:2748": (1000, 1, 0)}, pairs)
+    assert stats.throughput("c1", "c2") is None
+    stats.record(3.0, {"1:2748": (3000, 3, 0)}, pairs)
+    assert stats.throughput("c1", "c2") == 8000
+    stats.record(4.0, {"1:2748": (0, 0, 0)}, pairs)  # class recreated
+    assert stats.throughput("c1", "c2") is None
@@ -0,0 +1,77 @@
+from contcfg.cmd_wrapper.tc_batch import (
+    BLOCKED,
+    HTB_MAX_RATE,
+    IFB_DEV,
+    HTBProfile,
+    TCBatch,
+    get_class_minor,
+)
+from contcfg.cmd_wrapper.tc_base import TC_RATE32_MAX_BITS, TC_UNIT_BITS
+
+
+def test_htb_profile_class_params():
+    profile = HTBProfile(mtu=1500, hz=250)
+    # one tick worth of bytes, the quantum is capped
+    assert profile.class_params("1gbit") == (
+        "rate 1gbit ceil 1gbit burst 500000 cburst 500000 quantum 200000"
+    )
+    # at least one mtu at low rates, quantum rate / r2q in between
+    assert profile.class_params("1mbit").endswith(
+        "burst 1500 cburst 1500 quantum 12500"
+    )
+    assert profile.class_params("10kbit").endswith("quantum 1500")
+    assert int(HTB_MAX_RATE[:-4]) * TC_UNIT_BITS["mbit"] <= TC_RATE32_MAX_BITS
+
+
+def test_tc_batch_fq_codel_leaves():
+    batch = TCBatch(HTBProfile(hz=1000, fq_codel=True))
+    batch.init_htb("eth0")
+    batch.set_peer_limit("eth0", "10.0.0.2", "100mbit")
+    lines = list(batch)
+    assert "qdisc replace dev eth0 parent 1:9999 fq_codel" in lines
+    assert sum("fq_codel" in line for line in lines) == 2
+    assert all("quantum" in line for line in lines if "class" in line)
+    batch = TCBatch(HTBProfile(hz=1000))
+    batch.set_peer_limit("eth0", "10.0.0.2", "100mbit")
+    assert not any("fq_codel" in line for line in batch)
+
+
+def test_tc_batch_budget_and_borrowing():
+    batch = TCBatch(HTBProfile(hz=1000))
+    batch.set_budget("eth0", "1gbit")
+    batch.set_peer_limit("eth0", "10.0.0.2", "100mbit", ceil="1gbit")
+    batch.set_peer_limit("eth0", "10.0.0.3", "2gbit", ceil="1gbit")
+    budget, borrow, _, above, _ = list(batch)
+    assert "classid 1:fffd htb rate 1gbit ceil 1gbit" in budget
+    assert "parent 1:fffd" in borrow and "rate 100mbit ceil 1gbit" in borrow
+    # the ceil is at least the rate
+    assert "rate 2gbit ceil 2gbit" in above
+    # a peer whose minor is 1 is not the budget class
+    assert get_class_minor("10.1.97.1") == 1
+    batch = TCBatch(HTBProfile(hz=1000))
+    batch.set_peer_limit("eth0", "10.1.97.1", "100mbit")
+    assert "parent 1:fffd classid 1:1 " in list(batch)[0]
+
+
+def test_tc_batch_redirect_ingress():
+    batch = TCBatch()
+    batch.redirect_ingress("eth0")
+    qdisc, redirect = list(batch)
+    assert qdisc == "qdisc add dev eth0 handle ffff: ingress"
+    assert "parent ffff:" in redirect
+    assert redirect.endswith(f"mirred egress redirect dev {IFB_DEV}")
+
+
+def test_tc_batch_default_class():
+    batch = TCBatch(HTBProfile(hz=1000))
+    batch.set_default("eth0", BLOCKED)
+    table, other, leaf, catch_all = list(batch)
+    # the peer filters keep the first u32 table
+    assert "prio 1 u32" in table
+    assert "classid 1:fffe" in other
+    assert leaf.endswith("pfifo limit 0")
+    assert "prio 2 handle 801::1" in catch_all
+    assert catch_all.endswith("flowid 1:fffe")
+    batch = TCBatch(HTBProfile(hz=1000))
+    batch.set_default("eth0")
+    assert list(batch)[-1].endswith("flowid 1:9999")
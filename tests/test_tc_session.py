@@ -0,0 +1,48 @@
+import pytest
+
+from contcfg.cmd_wrapper.exception import TCBatchError
+from contcfg.cmd_wrapper.tc_batch import TCBatch
+from contcfg.cmd_wrapper.tc_session import TCSession
+
+# stands in for `tc -force -batch -`: fails the lines containing "bad"
+# and the ack command, like tc does
+FAKE_TC = (
+    "sh -c 'n=0; while read -r line; do n=$((n+1)); case \"$line\" in "
+    '*bad*|*contcfg-ack*) echo "Error: $line" >&2; '
+    'echo "Command failed -:$n" >&2;; esac; done\' fake'
+)
+
+
+def make_batch(*lines):
+    batch = TCBatch()
+    for line in lines:
+        batch.add(line)
+    return batch
+
+
+def test_tc_session_reports_failed_lines():
+    session = TCSession(FAKE_TC)
+    session.run(make_batch("class add a", "class add b"), timeout=5)
+    with pytest.raises(TCBatchError) as e:
+        session.run(make_batch("ok", "bad one", "ok", "bad two"), timeout=5)
+    assert [f.split(" (")[0] for f in e.value.failed] == ["bad one", "bad two"]
+    # line numbers keep counting across batches
+    session.run(make_batch("bad: File exists", "ok"), timeout=5, ignore=[0])
+    # only the exists errors of ignored lines are ignored
+    with pytest.raises(TCBatchError) as e:
+        session.run(make_batch("bad other", "ok"), timeout=5, ignore=[0])
+    assert [f.split(" (")[0] for f in e.value.failed] == ["bad other"]
+    assert session.alive
+    session.close()
+    assert not session.alive
+
+
+def test_tc_session_send_then_wait():
+    sessions = [TCSession(FAKE_TC) for _ in range(3)]
+    tickets = [s.send(make_batch("class replace a")) for s in sessions]
+    acked = [s.wait(t, timeout=5) for s, t in zip(sessions, tickets)]
+    assert all(t.sent <= a for t, a in zip(tickets, acked))
+    # the session is unlocked again
+    sessions[0].run(make_batch("ok"), timeout=5)
+    for session in sessions:
+        session.close()